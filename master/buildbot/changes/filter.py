@@ -13,8 +13,13 @@
 #
 # Copyright Buildbot Team Members
 from future.utils import iteritems
+from future.utils import itervalues
 
 import re
+from collections import OrderedDict
+
+from twisted.python import failure
+from twisted.python import log
 
 from buildbot.util import ComparableMixin
 from buildbot.util import NotABranch
@@ -139,3 +144,225 @@ class ChangeFilter(ComparableMixin):
             return ChangeFilter(**cfargs)
         else:
             return None
+
+
+class _PatternSet(object):
+
+    """
+    The regular expressions of many filters for one change attribute.
+
+    Most patterns are also joined into a single alternation, so a value that
+    matches none of them is rejected with one match; the individual patterns
+    are only tried when that succeeds.  The outcome is remembered for each
+    value, since a master sees the same few branches and projects over and
+    over.
+    """
+
+    CACHE_SIZE = 1000
+
+    # backreferences, named groups and inline flags do not survive being
+    # joined with other patterns
+    _uncombinable_re = re.compile(r'\\[1-9]|\(\?P|\(\?[aiLmsux]')
+    _default_flags = re.compile('').flags
+
+    def __init__(self):
+        self._masks = {}
+        self.mask = 0
+        self._cache = {}
+        self._combined = []
+        self._alone = []
+        self._prefilter = None
+
+    def add(self, regex, mask):
+        self.mask |= mask
+        key = (regex.pattern, regex.flags)
+        if key in self._masks:
+            self._masks[key][1] |= mask
+        else:
+            self._masks[key] = [regex, mask]
+
+    def compile(self):
+        for regex, mask in self._masks.values():
+            if (regex.flags == self._default_flags and
+                    not self._uncombinable_re.search(regex.pattern)):
+                self._combined.append((regex, mask))
+            else:
+                self._alone.append((regex, mask))
+        if self._combined:
+            try:
+                self._prefilter = re.compile('|'.join(
+                    '(?:%s)' % regex.pattern for regex, _ in self._combined))
+            except re.error:
+                self._alone.extend(self._combined)
+                self._combined = []
+
+    def match(self, value):
+        """
+        Return the bits of the filters whose pattern matches C{value}.
+        """
+        if value is None:
+            return 0
+        try:
+            return self._cache[value]
+        except (KeyError, TypeError):
+            pass
+        matched = 0
+        if self._prefilter is not None and self._prefilter.match(value):
+            for regex, mask in self._combined:
+                if regex.match(value):
+                    matched |= mask
+        for regex, mask in self._alone:
+            if regex.match(value):
+                matched |= mask
+        try:
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            self._cache[value] = matched
+        except TypeError:
+            pass
+        return matched
+
+
+class ChangeFilterIndex(object):
+
+    """
+    Match a change against many L{ChangeFilter}s at once.
+
+    Filters are added under a key, and L{match} returns the keys of the
+    filters accepting a change, in the order they were added.  The filters
+    are compiled into one decision structure, where each filter is a bit in
+    an integer mask: the exact values of all filters are looked up in one
+    dictionary per change attribute, and their regular expressions are
+    matched through a L{_PatternSet} per attribute.  Callables are only
+    called for the filters that are left after that.  A filter of C{None}
+    accepts every change, and filters that cannot be compiled (such as
+    subclasses with their own C{filter_change}) are evaluated as usual.
+    """
+
+    ATTRS = ('project', 'repository', 'branch', 'category', 'codebase')
+
+    def __init__(self):
+        self._filters = OrderedDict()
+        self._compiled = False
+
+    def __len__(self):
+        return len(self._filters)
+
+    def add(self, key, change_filter):
+        self._filters[key] = change_filter
+        self._compiled = False
+
+    def remove(self, key):
+        del self._filters[key]
+        self._compiled = False
+
+    def _compilable(self, change_filter):
+        if not isinstance(change_filter, ChangeFilter):
+            return False
+        if type(change_filter).filter_change != ChangeFilter.filter_change:
+            return False
+        return set(change_filter.checks) <= set(self.ATTRS)
+
+    def _compile(self):
+        self._keys = []
+        self._listed = dict((attr, 0) for attr in self.ATTRS)
+        self._values = dict((attr, {}) for attr in self.ATTRS)
+        self._patterns = dict((attr, _PatternSet()) for attr in self.ATTRS)
+        self._callables = []
+        self._fallback = []
+        self._all = 0
+
+        for key, change_filter in iteritems(self._filters):
+            mask = 1 << len(self._keys)
+            self._keys.append(key)
+            self._all |= mask
+            if change_filter is None:
+                continue
+            if not self._compilable(change_filter):
+                self._fallback.append((mask, change_filter))
+                continue
+            try:
+                for filt_list, _, _ in itervalues(change_filter.checks):
+                    if filt_list is not None:
+                        set(filt_list)
+            except TypeError:
+                # unhashable values can only be compared one by one
+                self._fallback.append((mask, change_filter))
+                continue
+
+            if change_filter.filter_fn is not None:
+                self._callables.append(
+                    (mask, None, change_filter.filter_fn))
+            for attr, (filt_list, filt_re, filt_fn) in \
+                    iteritems(change_filter.checks):
+                if filt_list is not None:
+                    self._listed[attr] |= mask
+                    values = self._values[attr]
+                    for value in filt_list:
+                        values[value] = values.get(value, 0) | mask
+                if filt_re is not None:
+                    self._patterns[attr].add(filt_re, mask)
+                if filt_fn is not None:
+                    self._callables.append((mask, attr, filt_fn))
+
+        for attr in self.ATTRS:
+            if not self._listed[attr]:
+                del self._listed[attr]
+            self._patterns[attr].compile()
+            if not self._patterns[attr].mask:
+                del self._patterns[attr]
+        self._compiled = True
+
+    def match(self, change):
+        """
+        Return the keys of the filters that accept C{change}.
+
+        A filter whose callable raises an exception does not accept the
+        change; the exception is logged.
+        """
+        if not self._compiled:
+            self._compile()
+        accepted = self._all
+        for attr, listed in iteritems(self._listed):
+            value = getattr(change, attr, '')
+            try:
+                found = self._values[attr].get(value, 0)
+            except TypeError:
+                found = 0
+            accepted &= ~(listed & ~found)
+        for attr, patterns in iteritems(self._patterns):
+            if not accepted & patterns.mask:
+                continue
+            value = getattr(change, attr, '')
+            accepted &= ~(patterns.mask & ~patterns.match(value))
+
+        for mask, attr, fn in self._callables:
+            if not accepted & mask:
+                continue
+            value = change if attr is None else getattr(change, attr, '')
+            try:
+                ok = fn(value)
+            except Exception:
+                log.err(failure.Failure(),
+                        'while filtering change %s' % (change,))
+                ok = False
+            if not ok:
+                accepted &= ~mask
+        for mask, change_filter in self._fallback:
+            if not accepted & mask:
+                continue
+            try:
+                ok = change_filter.filter_change(change)
+            except Exception:
+                log.err(failure.Failure(),
+                        'while filtering change %s' % (change,))
+                ok = False
+            if not ok:
+                accepted &= ~mask
+
+        keys = []
+        while accepted:
+            bit = accepted & -accepted
+            keys.append(self._keys[bit.bit_length() - 1])
+            accepted ^= bit
+        return keys
@@ -523,7 +523,8 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
 
         if 'db' in config_dict:
             db = config_dict['db']
-            if set(db.keys()) - set(['db_url', 'db_poll_interval']) and throwErrors:
+            if set(db.keys()) - set(['db_url', 'db_poll_interval',
+                                     'pool_size', 'bulk_pool_size']) and throwErrors:
                 error("unrecognized keys in c['db']")
             config_dict = db
 
@@ -541,6 +542,17 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
     def load_db(self, filename, config_dict):
         self.db = dict(db_url=self.getDbUrlFromConfig(config_dict))
 
+        db = config_dict.get('db', {})
+        for key, minimum in (('pool_size', 1), ('bulk_pool_size', 0)):
+            if key not in db:
+                continue
+            value = db[key]
+            if not isinstance(value, int) or value < minimum:
+                error("c['db']['%s'] must be an integer of at least %d"
+                      % (key, minimum))
+            else:
+                self.db[key] = value
+
     def load_mq(self, filename, config_dict):
         from buildbot.mq import connector  # avoid circular imports
         if 'mq' in config_dict:
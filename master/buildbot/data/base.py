@@ -77,6 +77,9 @@ class Endpoint(object):
     rootLinkName = None
     isCollection = False
     isRaw = False
+    # raw endpoints with isStreamable also implement getStream, which is like
+    # get but returns a 'stream' in place of the 'raw' content
+    isStreamable = False
 
     def __init__(self, rtype, master):
         self.rtype = rtype
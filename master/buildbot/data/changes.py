@@ -66,6 +66,19 @@ class ChangesEndpoint(FixerMixin, base.Endpoint):
         /sourcestamps/n:ssid/changes
     """
     rootLinkName = 'changes'
+    fieldMapping = {
+        'changeid': 'changes.changeid',
+        'author': 'changes.author',
+        'comments': 'changes.comments',
+        'revision': 'changes.revision',
+        'when_timestamp': 'changes.when_timestamp',
+        'branch': 'changes.branch',
+        'category': 'changes.category',
+        'revlink': 'changes.revlink',
+        'repository': 'changes.repository',
+        'project': 'changes.project',
+        'codebase': 'changes.codebase',
+    }
 
     @defer.inlineCallbacks
     def get(self, resultSpec, kwargs):
@@ -79,16 +92,22 @@ class ChangesEndpoint(FixerMixin, base.Endpoint):
                 changes = [change]
             else:
                 changes = []
-        else:
+        elif (resultSpec.order == ['-changeid'] and resultSpec.limit and
+                resultSpec.offset is None and not resultSpec.filters):
             # this special case is useful and implemented by the dbapi
-            # so give it a boost
-            if (resultSpec.order == ['-changeid'] and resultSpec.limit and
-                    resultSpec.offset is None):
-                changes = yield self.master.db.changes.getRecentChanges(resultSpec.limit)
-            else:
-                changes = yield self.master.db.changes.getChanges()
-        changes = [(yield self._fixChange(ch)) for ch in changes]
-        defer.returnValue(changes)
+            # so give it a boost; paginating in the database would also
+            # count the whole changes table
+            changes = yield self.master.db.changes.getRecentChanges(
+                resultSpec.limit)
+        else:
+            resultSpec.fieldMapping = self.fieldMapping
+            changes = yield self.master.db.changes.getChanges(
+                resultSpec=resultSpec)
+        rv = [(yield self._fixChange(ch)) for ch in changes]
+        if isinstance(changes, base.ListResult):
+            rv = base.ListResult(rv, offset=changes.offset,
+                                 total=changes.total, limit=changes.limit)
+        defer.returnValue(rv)
 
 
 class Change(base.ResourceType):
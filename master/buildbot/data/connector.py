@@ -124,6 +124,7 @@ class DataConnector(service.AsyncService):
         endpoint, kwargs = self.getEndpoint(path)
         rv = yield endpoint.get(resultSpec, kwargs)
         if resultSpec:
+            resultSpec.countFallback(endpoint)
             rv = resultSpec.apply(rv)
         defer.returnValue(rv)
 
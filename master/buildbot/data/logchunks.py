@@ -90,6 +90,7 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
     # offset/limit query params in ResultSpec
     isCollection = False
     isRaw = True
+    isStreamable = True
     pathPatterns = """
         /logs/n:logid/raw
         /steps/n:stepid/logs/i:log_slug/raw
@@ -100,7 +101,7 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
     """
 
     @defer.inlineCallbacks
-    def get(self, resultSpec, kwargs):
+    def getStream(self, resultSpec, kwargs):
         logid, dbdict = yield self.getLogIdAndDbDictFromKwargs(kwargs)
         if logid is None:
             return
@@ -109,19 +110,65 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
             dbdict = yield self.master.db.logs.getLog(logid)
             if not dbdict:
                 return
-        lastline = max(0, dbdict['num_lines'] - 1)
-
-        logLines = yield self.master.db.logs.getLogLines(
-            logid, 0, lastline)
-
-        if dbdict['type'] == 's':
-            logLines = "\n".join([line[1:] for line in logLines.splitlines()])
 
         defer.returnValue({
-            'raw': logLines,
+            'stream': RawLogStream(self.master, logid, dbdict['type']),
             'mime-type': u'text/html' if dbdict['type'] == 'h' else u'text/plain',
             'filename': dbdict['slug']})
 
+    @defer.inlineCallbacks
+    def get(self, resultSpec, kwargs):
+        data = yield self.getStream(resultSpec, kwargs)
+        if data is None:
+            return
+
+        stream = data.pop('stream')
+        parts = []
+        while True:
+            part = yield stream.getNext()
+            if part is None:
+                break
+            parts.append(part)
+        data['raw'] = u''.join(parts)
+        defer.returnValue(data)
+
+
+class RawLogStream(object):
+
+    """
+    The contents of a log, as returned by the raw endpoint, read from the
+    database a few chunks at a time.  Call C{getNext} until it returns None.
+    """
+
+    # number of chunks (each at most 64k) to fetch from the db per batch
+    BATCH_CHUNKS = 16
+
+    def __init__(self, master, logid, type):
+        self.master = master
+        self.logid = logid
+        self.type = type
+        self.next_line = 0
+
+    @defer.inlineCallbacks
+    def getNext(self):
+        if self.next_line is None:
+            return
+        first = self.next_line == 0
+        lines, last_line = yield self.master.db.logs.getLogLinesBatch(
+            self.logid, self.next_line, self.BATCH_CHUNKS)
+        if last_line is None:
+            self.next_line = None
+            return
+        self.next_line = last_line + 1
+
+        if self.type == 's':
+            # strip the stream prefix from each line; note that the
+            # separating newline goes before each batch but the first one
+            lines = u"\n".join([line[1:] for line in lines.splitlines()])
+            if not first:
+                lines = u"\n" + lines
+        defer.returnValue(lines)
+
 
 class LogChunk(base.ResourceType):
 
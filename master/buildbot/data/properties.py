@@ -13,8 +13,6 @@
 #
 # Copyright Buildbot Team Members
 
-from future.utils import iteritems
-
 from twisted.internet import defer
 
 from buildbot.data import base
@@ -64,18 +62,20 @@ class Properties(base.ResourceType):
     @base.updateMethod
     @defer.inlineCallbacks
     def setBuildProperties(self, buildid, properties):
-        to_update = {}
-        oldproperties = yield self.master.data.get(('builds', str(buildid), "properties"))
-        for k, v in iteritems(properties.getProperties().asDict()):
-            if k in oldproperties and oldproperties[k] == v:
-                continue
-            to_update[k] = v
-
-        if to_update:
-            for k, v in iteritems(to_update):
-                yield self.master.db.builds.setBuildProperty(
-                    buildid, k, v[0], v[1])
-            yield self.generateUpdateEvent(buildid, to_update)
+        # only the properties set since the last flush are written, all in
+        # one transaction, and only those that actually changed are sent
+        properties = properties.getProperties()
+        dirty = properties.takeDirtyProperties()
+        if not dirty:
+            return
+        try:
+            changed = yield self.master.db.builds.setBuildProperties(
+                buildid, dirty)
+        except Exception:
+            properties.dirty.update(dirty)
+            raise
+        if changed:
+            yield self.generateUpdateEvent(buildid, changed)
 
     @base.updateMethod
     @defer.inlineCallbacks
@@ -17,6 +17,7 @@ from future.utils import iteritems
 from twisted.python import log
 
 from buildbot.data import base
+from buildbot.process import metrics
 
 
 class FieldBase(object):
@@ -106,6 +107,11 @@ def nonecmp(a, b):
     return cmp(a, b)
 
 
+def noneFirst(value):
+    # sort key that treats None as smaller than anything, like nonecmp
+    return (value is not None, value)
+
+
 class ResultSpec(object):
 
     __slots__ = ['filters', 'fields', 'properties',
@@ -196,6 +202,12 @@ class ResultSpec(object):
         for col in query.inner_columns:
             if str(col) == mapped:
                 return col
+        # the column need not be selected, as long as it is in one of the
+        # tables the query reads from
+        for from_obj in query.froms:
+            for col in from_obj.columns:
+                if str(col) == mapped:
+                    return col
         raise KeyError("unable to find field {} in query".format(field))
 
     def applyFilterToSQLQuery(self, query, f):
@@ -263,6 +275,26 @@ class ResultSpec(object):
 
         return query, count_query
 
+    def isFullyApplied(self):
+        """
+        Return true if nothing is left for L{apply} to do but select fields;
+        that is, if the endpoint (or the database) already took care of
+        filtering, ordering and pagination.
+        """
+        return (not self.filters and not self.order and
+                self.limit is None and self.offset is None)
+
+    def countFallback(self, endpoint):
+        """
+        Count a request to C{endpoint} that still needs filtering, sorting or
+        pagination in Python, so that slow endpoints can be found.  Call this
+        after the endpoint's C{get} and before L{apply}.
+        """
+        if endpoint.isCollection and not self.isFullyApplied():
+            metrics.MetricCountEvent.log(
+                "DataConnector.resultspec-fallback.%s"
+                % (endpoint.__class__.__name__,))
+
     def thd_execute(self, conn, q, dictFromRow):
         offset, limit = self.offset, self.limit
         q, qc = self.applyToSQLQuery(q)
@@ -300,9 +332,9 @@ class ResultSpec(object):
 
             # item collection
             if isinstance(data, base.ListResult):
-                # if pagination was applied, then fields, etc. must be empty
-                assert not fields and not order and not filters, \
-                    "endpoint must apply fields, order, and filters if it performs pagination"
+                # if pagination was applied, then order, etc. must be empty
+                assert not order and not filters, \
+                    "endpoint must apply order and filters if it performs pagination"
                 offset, total = data.offset, data.total
                 limit = data.limit
             else:
@@ -320,20 +352,16 @@ class ResultSpec(object):
             if total is None:
                 total = len(data)
 
-            # precompute the ordering functions and sort
+            # sort by each key in turn, least significant first; sorts are
+            # stable, so this gives the same result as a single sort on all
+            # of the keys
             if self.order:
-                order = [(lambda a, b, k=k[1:]: nonecmp(b[k], a[k]))
-                         if k[0] == '-' else
-                         (lambda a, b, k=k: nonecmp(a[k], b[k]))
-                         for k in self.order]
-
-                def cmpFunc(a, b):
-                    for f in order:
-                        c = f(a, b)
-                        if c:
-                            return c
-                    return 0
-                data.sort(cmp=cmpFunc)
+                for k in reversed(self.order):
+                    reverse = k[0] == '-'
+                    if reverse:
+                        k = k[1:]
+                    data.sort(key=lambda d, k=k: noneFirst(d[k]),
+                              reverse=reverse)
 
             # finally, slice out the limit/offset
             if self.offset is not None or self.limit is not None:
@@ -36,6 +36,17 @@ class Db2DataMixin(object):
             'hidden': dbdict['hidden'],
         }
         return defer.succeed(data)
+    fieldMapping = {
+        'stepid': 'steps.id',
+        'number': 'steps.number',
+        'name': 'steps.name',
+        'buildid': 'steps.buildid',
+        'started_at': 'steps.started_at',
+        'complete_at': 'steps.complete_at',
+        'state_string': 'steps.state_string',
+        'results': 'steps.results',
+        'hidden': 'steps.hidden',
+    }
 
 
 class StepEndpoint(Db2DataMixin, base.BuildNestingMixin, base.Endpoint):
@@ -83,8 +94,14 @@ class StepsEndpoint(Db2DataMixin, base.BuildNestingMixin, base.Endpoint):
             buildid = yield self.getBuildid(kwargs)
             if buildid is None:
                 return
-        steps = yield self.master.db.steps.getSteps(buildid=buildid)
-        defer.returnValue([(yield self.db2data(dbdict)) for dbdict in steps])
+        resultSpec.fieldMapping = self.fieldMapping
+        steps = yield self.master.db.steps.getSteps(buildid=buildid,
+                                                    resultSpec=resultSpec)
+        rv = [(yield self.db2data(dbdict)) for dbdict in steps]
+        if isinstance(steps, base.ListResult):
+            rv = base.ListResult(rv, offset=steps.offset, total=steps.total,
+                                 limit=steps.limit)
+        defer.returnValue(rv)
 
 
 class Step(base.ResourceType):
@@ -129,6 +146,18 @@ class Step(base.ResourceType):
         yield self.generateEvent(stepid, 'new')
         defer.returnValue((stepid, num, name))
 
+    @base.updateMethod
+    @defer.inlineCallbacks
+    def addSteps(self, buildid, names):
+        added = yield self.master.db.steps.addSteps(
+            buildid=buildid, names=names, state_string=u'pending')
+        # fetch the new steps with one query, rather than one per step
+        stepids = set([stepid for stepid, _, _ in added])
+        for step in (yield self.master.data.get(('builds', buildid, 'steps'))):
+            if step['stepid'] in stepids:
+                self.produceEvent(step, 'new')
+        defer.returnValue(added)
+
     @base.updateMethod
     @defer.inlineCallbacks
     def startStep(self, stepid):
@@ -12,6 +12,8 @@
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 # Copyright Buildbot Team Members
+from future.utils import iteritems
+
 import sqlalchemy as sa
 
 from twisted.internet import defer
@@ -179,6 +181,23 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
             return dict(props)
         return self.db.pool.do(thd)
 
+    def getBuildPropertiesForBuilds(self, bids):
+        def thd(conn):
+            bp_tbl = self.db.model.build_properties
+            rv = dict((bid, {}) for bid in bids)
+            # batch the bids, so that the parameter lists supported by the
+            # DBAPI aren't exhausted
+            for batch in self.doBatch(sorted(rv), 100):
+                q = sa.select(
+                    [bp_tbl.c.buildid, bp_tbl.c.name, bp_tbl.c.value,
+                     bp_tbl.c.source],
+                    whereclause=bp_tbl.c.buildid.in_(batch))
+                for row in conn.execute(q):
+                    rv[row.buildid][row.name] = (json.loads(row.value),
+                                                 row.source)
+            return rv
+        return self.db.pool.do(thd)
+
     def setBuildProperty(self, bid, name, value, source):
         """ A kind of create_or_update, that's between one or two queries per
         call """
@@ -202,6 +221,63 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
                              dict(value=value_js, source=source))
         return self.db.pool.do(thd)
 
+    def setBuildProperties(self, bid, properties):
+        """ Create or update all of the given properties in one transaction,
+        with one query to find the existing ones and at most one insert and
+        one update statement; return the ones that actually changed """
+        def thd(conn):
+            bp_tbl = self.db.model.build_properties
+            props = {}
+            for name, (value, source) in iteritems(properties):
+                self.checkLength(bp_tbl.c.name, name)
+                self.checkLength(bp_tbl.c.source, source)
+                props[name] = (value, source, json.dumps(value))
+
+            transaction = conn.begin()
+            try:
+                existing = {}
+                # batch the names, so that the parameter lists supported by
+                # the DBAPI aren't exhausted
+                names = sorted(props)
+                for i in range(0, len(names), 100):
+                    q = sa.select(
+                        [bp_tbl.c.name, bp_tbl.c.value, bp_tbl.c.source],
+                        whereclause=(bp_tbl.c.buildid == bid) &
+                        bp_tbl.c.name.in_(names[i:i + 100]))
+                    for row in conn.execute(q):
+                        existing[row.name] = (row.value, row.source)
+
+                inserts = []
+                updates = []
+                changed = {}
+                for name in names:
+                    value, source, value_js = props[name]
+                    if name not in existing:
+                        inserts.append(dict(buildid=bid, name=name,
+                                            value=value_js, source=source))
+                    elif existing[name] != (value_js, source):
+                        updates.append(dict(b_name=name, b_value=value_js,
+                                            b_source=source))
+                    else:
+                        continue
+                    changed[name] = (value, source)
+
+                if inserts:
+                    conn.execute(bp_tbl.insert(), inserts).close()
+                if updates:
+                    q = bp_tbl.update()
+                    q = q.where((bp_tbl.c.buildid == bid) &
+                                (bp_tbl.c.name == sa.bindparam('b_name')))
+                    q = q.values(value=sa.bindparam('b_value'),
+                                 source=sa.bindparam('b_source'))
+                    conn.execute(q, updates).close()
+            except Exception:
+                transaction.rollback()
+                raise
+            transaction.commit()
+            return changed
+        return self.db.pool.do(thd)
+
     def _builddictFromRow(self, row):
         def mkdt(epoch):
             if epoch:
@@ -25,6 +25,7 @@ from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.python import log
 
+from buildbot.data.base import ListResult
 from buildbot.db import base
 from buildbot.util import datetime2epoch
 from buildbot.util import epoch2datetime
@@ -261,11 +262,13 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                                         for changeid in changeids])
         return d
 
-    def getChanges(self):
+    def getChanges(self, resultSpec=None):
         def thd(conn):
             # get the changeids from the 'changes' table
             changes_tbl = self.db.model.changes
             q = sa.select([changes_tbl.c.changeid])
+            if resultSpec is not None:
+                return resultSpec.thd_execute(conn, q, lambda row: row.changeid)
             rp = conn.execute(q)
             changeids = [row.changeid for row in rp]
             rp.close()
@@ -275,8 +278,14 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         # then turn those into changes, using the cache
         @d.addCallback
         def get_changes(changeids):
-            return defer.gatherResults([self.getChange(changeid)
-                                        for changeid in changeids])
+            d = defer.gatherResults([self.getChange(changeid)
+                                     for changeid in changeids])
+            if isinstance(changeids, ListResult):
+                # keep the pagination done by the database
+                d.addCallback(lambda chdicts: ListResult(
+                    chdicts, offset=changeids.offset, total=changeids.total,
+                    limit=changeids.limit))
+            return d
         return d
 
     def getChangesCount(self):
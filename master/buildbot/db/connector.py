@@ -111,7 +111,8 @@ class DBConnector(WorkerAPICompatMixin, service.ReconfigurableServiceMixin,
 
     @defer.inlineCallbacks
     def setup(self, check_version=True, verbose=True):
-        db_url = self.configured_url = self.master.config.db['db_url']
+        db_config = self.master.config.db
+        db_url = self.configured_url = db_config['db_url']
 
         log.msg("Setting up database with URL %r"
                 % util.stripUrlPassword(db_url))
@@ -120,7 +121,9 @@ class DBConnector(WorkerAPICompatMixin, service.ReconfigurableServiceMixin,
         self._engine = enginestrategy.create_engine(db_url,
                                                     basedir=self.basedir)
         self.pool = pool.DBThreadPool(
-            self._engine, reactor=self.master.reactor, verbose=verbose)
+            self._engine, reactor=self.master.reactor, verbose=verbose,
+            pool_size=db_config.get('pool_size'),
+            bulk_pool_size=db_config.get('bulk_pool_size'))
 
         # make sure the db is up to date, unless specifically asked not to
         if check_version:
@@ -12,15 +12,18 @@
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 # Copyright Buildbot Team Members
-from future.builtins import range
 from future.utils import itervalues
 
+import array
+import threading
+
 import sqlalchemy as sa
 
 from twisted.internet import defer
 from twisted.python import log
 
 from buildbot.db import base
+from buildbot.util import lru
 
 
 def dumps_gzip(data):
@@ -53,6 +56,59 @@ def read_bz2(data):
     return bz2.decompress(data)
 
 
+def lineOffsets(data):
+    """
+    Return an array of the byte offsets at which each line of DATA starts.
+    A final entry points one byte past the end of DATA, as if the chunk had
+    a trailing newline, so that line N spans C{offsets[N]:offsets[N + 1] - 1}.
+    """
+    offsets = array.array('l', [0])
+    find = data.find
+    idx = find(b'\n')
+    while idx != -1:
+        offsets.append(idx + 1)
+        idx = find(b'\n', idx + 1)
+    offsets.append(len(data) + 1)
+    return offsets
+
+
+def sliceLines(data, offsets, chunk_first_line, first_line, last_line):
+    """
+    Return the bytes of lines FIRST_LINE through LAST_LINE (inclusive, and
+    clamped to the chunk) of a chunk starting at CHUNK_FIRST_LINE, without
+    a trailing newline.
+    """
+    start = max(first_line - chunk_first_line, 0)
+    end = min(last_line - chunk_first_line + 1, len(offsets) - 1)
+    return data[offsets[start]:offsets[end] - 1]
+
+
+class DecompressedChunk(object):
+
+    """
+    A decompressed log chunk, as kept in the C{logchunks} cache.  The line
+    index of the chunk is built the first time a partial range is requested.
+    """
+
+    __slots__ = ('first_line', 'last_line', 'data', '_offsets',
+                 '__weakref__')
+
+    def __init__(self, first_line, last_line, data):
+        self.first_line = first_line
+        self.last_line = last_line
+        self.data = data
+        self._offsets = None
+
+    def getLines(self, first_line, last_line):
+        data = self.data
+        if first_line > self.first_line or last_line < self.last_line:
+            if self._offsets is None:
+                self._offsets = lineOffsets(data)
+            data = sliceLines(data, self._offsets, self.first_line,
+                              first_line, last_line)
+        return data.decode('utf-8')
+
+
 class LogsConnectorComponent(base.DBConnectorComponent):
 
     # Postgres and MySQL will both allow bigger sizes than this.  The limit
@@ -65,6 +121,34 @@ class LogsConnectorComponent(base.DBConnectorComponent):
     COMPRESSION_BYID = dict((x["id"], x) for x in itervalues(COMPRESSION_MODE))
     total_raw_bytes = 0
     total_compressed_bytes = 0
+    # number of per-chunk line indexes kept in memory by getLogLines
+    LINE_INDEX_CACHE_SIZE = 500
+    # ranges spanning more chunks than this are read in a single query
+    # instead of chunk by chunk through the logchunks cache
+    MAX_CACHED_CHUNKS = 4
+    # maximum number of appends written in a single transaction
+    MAX_APPEND_BATCH = 100
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # chunks are immutable once written, so the line index of a chunk
+        # can be cached by its identity.  The cache is used from the DB
+        # threads, hence the lock.
+        self._lineIndexLock = threading.Lock()
+        self._lineIndex = lru.LRUCache(
+            lambda key, data: lineOffsets(data), self.LINE_INDEX_CACHE_SIZE)
+        self._pendingAppends = []
+        self._writingAppends = False
+
+    def _getLineOffsets(self, logid, first_line, last_line, data):
+        key = (logid, first_line, last_line)
+        with self._lineIndexLock:
+            offsets = self._lineIndex.get(key, data=data)
+            # guard against a stale entry, e.g., from a reused logid
+            if offsets[-1] != len(data) + 1:
+                offsets = lineOffsets(data)
+                self._lineIndex.put(key, offsets)
+        return offsets
 
     def _getLog(self, whereclause):
         def thd(conn):
@@ -97,7 +181,38 @@ class LogsConnectorComponent(base.DBConnectorComponent):
             return [self._logdictFromRow(row) for row in res.fetchall()]
         return self.db.pool.do(thd)
 
-    def getLogLines(self, logid, first_line, last_line):
+    def getLogsForSteps(self, stepids):
+        def thd(conn):
+            tbl = self.db.model.logs
+            rv = []
+            # batch the stepids, as in getStepsForBuilds
+            for batch in self.doBatch(sorted(set(stepids)), 100):
+                q = tbl.select(whereclause=tbl.c.stepid.in_(batch))
+                q = q.order_by(tbl.c.stepid, tbl.c.id)
+                res = conn.execute(q)
+                rv.extend(self._logdictFromRow(row) for row in res.fetchall())
+            return rv
+        return self.db.pool.do(thd)
+
+    @base.cached("logchunks")
+    def getChunk(self, key):
+        logid, first_line = key
+
+        def thd(conn):
+            tbl = self.db.model.logchunks
+            q = sa.select([tbl.c.last_line, tbl.c.content, tbl.c.compressed])
+            q = q.where(tbl.c.logid == logid)
+            q = q.where(tbl.c.first_line == first_line)
+            res = conn.execute(q)
+            row = res.fetchone()
+            res.close()
+            if not row:
+                return None
+            data = self.COMPRESSION_BYID[row.compressed]["read"](row.content)
+            return DecompressedChunk(first_line, row.last_line, data)
+        return self.db.pool.do(thd)
+
+    def _getLogLinesUncached(self, logid, first_line, last_line):
         def thd(conn):
             # get a set of chunks that completely cover the requested range
             tbl = self.db.model.logchunks
@@ -112,24 +227,76 @@ class LogsConnectorComponent(base.DBConnectorComponent):
                 # Retrieve associated "reader" and extract the data
                 data = self.COMPRESSION_BYID[
                     row.compressed]["read"](row.content)
-                content = data.decode('utf-8')
 
-                if row.first_line < first_line:
-                    idx = -1
-                    count = first_line - row.first_line
-                    for _ in range(count):
-                        idx = content.index('\n', idx + 1)
-                    content = content[idx + 1:]
-                if row.last_line > last_line:
-                    idx = len(content) + 1
-                    count = row.last_line - last_line
-                    for _ in range(count):
-                        idx = content.rindex('\n', 0, idx)
-                    content = content[:idx]
-                rv.append(content)
+                if row.first_line < first_line or row.last_line > last_line:
+                    # slice the requested lines out of the raw chunk using
+                    # its line index, and only decode that part
+                    offsets = self._getLineOffsets(
+                        logid, row.first_line, row.last_line, data)
+                    data = sliceLines(data, offsets, row.first_line,
+                                      first_line, last_line)
+                rv.append(data.decode('utf-8'))
             return u'\n'.join(rv) + u'\n' if rv else u''
         return self.db.pool.do(thd)
 
+    @defer.inlineCallbacks
+    def getLogLines(self, logid, first_line, last_line):
+        def thdGetBounds(conn):
+            tbl = self.db.model.logchunks
+            q = sa.select([tbl.c.first_line, tbl.c.last_line])
+            q = q.where(tbl.c.logid == logid)
+            q = q.where(tbl.c.first_line <= last_line)
+            q = q.where(tbl.c.last_line >= first_line)
+            q = q.order_by(tbl.c.first_line)
+            q = q.limit(self.MAX_CACHED_CHUNKS + 1)
+            return [tuple(row) for row in conn.execute(q)]
+        bounds = yield self.db.pool.do(thdGetBounds)
+
+        # big ranges, such as whole-log reads, would only thrash the cache
+        if len(bounds) > self.MAX_CACHED_CHUNKS:
+            lines = yield self._getLogLinesUncached(logid, first_line,
+                                                    last_line)
+            defer.returnValue(lines)
+
+        chunks = yield defer.gatherResults([
+            self.getChunk((logid, chunk_first_line))
+            for chunk_first_line, _ in bounds])
+
+        rv = []
+        for (chunk_first_line, chunk_last_line), chunk in zip(bounds, chunks):
+            if chunk is not None and chunk.last_line != chunk_last_line:
+                # compressLog has rewritten the chunks of this log since
+                # this one was cached; replace the stale entry
+                key = (logid, chunk_first_line)
+                chunk = yield self.getChunk(key, no_cache=1)
+                if chunk is not None:
+                    self.getChunk.cache.put(key, chunk)
+            if chunk is not None:
+                rv.append(chunk.getLines(first_line, last_line))
+        defer.returnValue(u'\n'.join(rv) + u'\n' if rv else u'')
+
+    def getLogLinesBatch(self, logid, first_line, max_chunks):
+        def thd(conn):
+            tbl = self.db.model.logchunks
+            q = sa.select([tbl.c.first_line, tbl.c.last_line,
+                           tbl.c.content, tbl.c.compressed])
+            q = q.where(tbl.c.logid == logid)
+            q = q.where(tbl.c.last_line >= first_line)
+            q = q.order_by(tbl.c.first_line)
+            q = q.limit(max_chunks)
+            rv = []
+            last_line = None
+            for row in conn.execute(q):
+                data = self.COMPRESSION_BYID[
+                    row.compressed]["read"](row.content)
+                if row.first_line < first_line:
+                    data = sliceLines(data, lineOffsets(data), row.first_line,
+                                      first_line, row.last_line)
+                rv.append(data.decode('utf-8'))
+                last_line = row.last_line
+            return (u'\n'.join(rv) + u'\n' if rv else u''), last_line
+        return self.db.pool.do(thd)
+
     def addLog(self, stepid, name, slug, type):
         assert type in 'tsh', "Log type must be one of t, s, or h"
 
@@ -160,9 +327,10 @@ class LogsConnectorComponent(base.DBConnectorComponent):
         self.total_compressed_bytes += len(chunk)
         return chunk, compressed_id
 
-    def thdSplitAndAppendChunk(self, conn, logid, content, first_line):
+    def thdSplitChunks(self, logid, content, first_line):
         # Break the content up into chunks.  This takes advantage of the
         # fact that no character but u'\n' maps to b'\n' in UTF-8.
+        rows = []
         remaining = content
         chunk_first_line = last_line = first_line
         while remaining:
@@ -170,11 +338,16 @@ class LogsConnectorComponent(base.DBConnectorComponent):
             last_line = chunk_first_line + chunk.count('\n')
 
             chunk, compressed_id = self.thdCompressChunk(chunk)
-            conn.execute(self.db.model.logchunks.insert(),
-                         dict(logid=logid, first_line=chunk_first_line,
-                              last_line=last_line, content=chunk,
-                              compressed=compressed_id)).close()
+            rows.append(dict(logid=logid, first_line=chunk_first_line,
+                             last_line=last_line, content=chunk,
+                             compressed=compressed_id))
             chunk_first_line = last_line + 1
+        return rows, last_line
+
+    def thdSplitAndAppendChunk(self, conn, logid, content, first_line):
+        rows, last_line = self.thdSplitChunks(logid, content, first_line)
+        if rows:
+            conn.execute(self.db.model.logchunks.insert(), rows).close()
 
         conn.execute(self.db.model.logs.update(whereclause=(self.db.model.logs.c.id == logid)),
                      num_lines=last_line + 1).close()
@@ -198,11 +371,86 @@ class LogsConnectorComponent(base.DBConnectorComponent):
                                            content=content.encode('utf-8'),
                                            first_line=row[0])
 
+    def thdAppendLogs(self, conn, appends):
+        # append each (logid, content) pair in APPENDS, in order, with a
+        # single query per table; returns the result of each append
+        logs_tbl = self.db.model.logs
+        logids = set(logid for logid, _ in appends)
+        q = sa.select([logs_tbl.c.id, logs_tbl.c.num_lines])
+        q = q.where(logs_tbl.c.id.in_(logids))
+        num_lines = dict((row.id, row.num_lines) for row in conn.execute(q))
+
+        results = []
+        chunks = []
+        for logid, content in appends:
+            assert content[-1] == u'\n'
+            if logid not in num_lines:
+                results.append(None)  # ignore a missing log
+                continue
+            first_line = num_lines[logid]
+            rows, last_line = self.thdSplitChunks(
+                logid, content[:-1].encode('utf-8'), first_line)
+            chunks.extend(rows)
+            num_lines[logid] = last_line + 1
+            results.append((first_line, last_line))
+
+        updates = [dict(b_logid=logid, b_num_lines=num_lines[logid])
+                   for logid in sorted(logids) if logid in num_lines]
+        transaction = conn.begin()
+        try:
+            if chunks:
+                conn.execute(self.db.model.logchunks.insert(), chunks).close()
+            if updates:
+                q = logs_tbl.update()
+                q = q.where(logs_tbl.c.id == sa.bindparam('b_logid'))
+                q = q.values(num_lines=sa.bindparam('b_num_lines'))
+                conn.execute(q, updates).close()
+        except Exception:
+            transaction.rollback()
+            raise
+        transaction.commit()
+        return results
+
     def appendLog(self, logid, content):
-        def thdappendLog(conn):
-            return self.thdAppendLog(conn, logid, content)
+        # appends are queued and written in batches, one batch at a time, so
+        # that appends arriving while a batch is being written are coalesced
+        # into the next one.  Appends to the same log are written in the
+        # order they were made.
+        d = defer.Deferred()
+        self._pendingAppends.append((logid, content, d))
+        if not self._writingAppends:
+            self._writeAppends()
+        return d
 
-        return self.db.pool.do(thdappendLog)
+    @defer.inlineCallbacks
+    def _writeAppends(self):
+        self._writingAppends = True
+        try:
+            while self._pendingAppends:
+                batch = self._pendingAppends[:self.MAX_APPEND_BATCH]
+                del self._pendingAppends[:self.MAX_APPEND_BATCH]
+                try:
+                    results = yield self.db.pool.do_bulk(
+                        self.thdAppendLogs,
+                        [(logid, content) for logid, content, _ in batch])
+                except Exception:
+                    log.msg("appending a batch of %d log writes failed; "
+                            "retrying one by one" % (len(batch),))
+                    # retry one by one, so that a single bad append only
+                    # fails its own caller
+                    for logid, content, d in batch:
+                        try:
+                            res = yield self.db.pool.do_bulk(
+                                self.thdAppendLog, logid, content)
+                        except Exception:
+                            d.errback()
+                        else:
+                            d.callback(res)
+                else:
+                    for (_, _, d), res in zip(batch, results):
+                        d.callback(res)
+        finally:
+            self._writingAppends = False
 
     def _splitBigChunk(self, content, logid):
         """
@@ -292,7 +540,7 @@ class LogsConnectorComponent(base.DBConnectorComponent):
             newsize = conn.execute(q).fetchone()[0]
             return len(wholelog) - newsize
 
-        saved = yield self.db.pool.do(thdcompressLog)
+        saved = yield self.db.pool.do_bulk(thdcompressLog)
         defer.returnValue(saved)
 
     def _logdictFromRow(self, row):
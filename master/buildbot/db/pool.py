@@ -16,6 +16,7 @@ from __future__ import division
 from __future__ import print_function
 
 import inspect
+import sys
 import time
 import traceback
 
@@ -90,7 +91,12 @@ class DBThreadPool(object):
 
     running = False
 
-    def __init__(self, engine, reactor, verbose=False):
+    # number of threads reserved for bulk writes (see do_bulk) when neither
+    # the configuration nor the engine says otherwise
+    DEFAULT_BULK_POOL_SIZE = 2
+
+    def __init__(self, engine, reactor, verbose=False, pool_size=None,
+                 bulk_pool_size=None):
         # verbose is used by upgrade scripts, and if it is set we should print
         # messages about versions and other warnings
         log_msg = log.msg
@@ -101,18 +107,36 @@ class DBThreadPool(object):
 
         self.reactor = reactor
 
-        pool_size = 5
-
-        # If the engine has an C{optimal_thread_pool_size} attribute, then the
-        # maxthreads of the thread pool will be set to that value.  This is
-        # most useful for SQLite in-memory connections, where exactly one
-        # connection (and thus thread) should be used.
-        if hasattr(engine, 'optimal_thread_pool_size'):
-            pool_size = engine.optimal_thread_pool_size
+        # If the engine has an C{optimal_thread_pool_size} attribute, then
+        # the thread pools are sized to use that many connections in total,
+        # unless configured otherwise.  This is most useful for SQLite,
+        # where exactly one connection (and thus thread) should be used.
+        max_size = getattr(engine, 'optimal_thread_pool_size', 5)
+        if max_size == 1:
+            # a single connection serves both lanes
+            pool_size, bulk_pool_size = 1, 0
+        else:
+            if bulk_pool_size is None:
+                bulk_pool_size = min(self.DEFAULT_BULK_POOL_SIZE,
+                                     max_size - 1)
+            if pool_size is None:
+                pool_size = max(1, max_size - bulk_pool_size)
+            if pool_size + bulk_pool_size > max_size:
+                log_msg("NOTE: %d database threads are configured, but the "
+                        "database engine only allows %d connections"
+                        % (pool_size + bulk_pool_size, max_size))
 
         self._pool = threadpool.ThreadPool(minthreads=1,
                                            maxthreads=pool_size,
                                            name='DBThreadPool')
+        # bulk writes get their own lane, so that they cannot occupy every
+        # thread while short queries wait behind them
+        if bulk_pool_size:
+            self._bulk_pool = threadpool.ThreadPool(minthreads=1,
+                                                    maxthreads=bulk_pool_size,
+                                                    name='DBThreadPool-bulk')
+        else:
+            self._bulk_pool = self._pool
 
         self.engine = engine
         if engine.dialect.name == 'sqlite':
@@ -131,12 +155,15 @@ class DBThreadPool(object):
         # patch the do methods to do verbose logging if necessary
         if debug:
             self.do = timed_do_fn(self.do)
+            self.do_bulk = timed_do_fn(self.do_bulk)
             self.do_with_engine = timed_do_fn(self.do_with_engine)
 
     def _start(self):
         self._start_evt = None
         if not self.running:
             self._pool.start()
+            if self._bulk_pool is not self._pool:
+                self._bulk_pool.start()
             self._stop_evt = self.reactor.addSystemEventTrigger(
                 'during', 'shutdown', self._stop)
             self.running = True
@@ -144,6 +171,8 @@ class DBThreadPool(object):
     def _stop(self):
         self._stop_evt = None
         self._pool.stop()
+        if self._bulk_pool is not self._pool:
+            self._bulk_pool.stop()
         self.engine.dispose()
         self.running = False
 
@@ -210,13 +239,46 @@ class DBThreadPool(object):
             break
         return rv
 
+    def __timed(self, pool, with_engine, callable, args, kwargs):
+        # run __thd in the given pool, recording how long the call waited for
+        # a thread and how long it ran, under the name of the method that
+        # submitted it (most callables are simply called 'thd')
+        frame = sys._getframe(1)
+        while frame.f_globals.get('__name__') == __name__:
+            frame = frame.f_back
+        name = "%s.%s" % (frame.f_globals.get('__name__', '?').split('.')[-1],
+                          frame.f_code.co_name)
+        times = [time.time()]
+
+        def thd():
+            times.append(time.time())
+            try:
+                return self.__thd(with_engine, callable, args, kwargs)
+            finally:
+                times.append(time.time())
+        d = threads.deferToThreadPool(self.reactor, pool, thd)
+
+        @d.addBoth
+        def record(x):
+            if len(times) == 3:
+                queued, started, finished = times
+                metrics.MetricHistogramEvent.log(
+                    "DBThreadPool.queue-wait.%s" % (name,), started - queued)
+                metrics.MetricHistogramEvent.log(
+                    "DBThreadPool.execute.%s" % (name,), finished - started)
+            return x
+        return d
+
     def do(self, callable, *args, **kwargs):
-        return threads.deferToThreadPool(self.reactor, self._pool,
-                                         self.__thd, False, callable, args, kwargs)
+        return self.__timed(self._pool, False, callable, args, kwargs)
+
+    def do_bulk(self, callable, *args, **kwargs):
+        """Like L{do}, but run in the lane reserved for large writes such as
+        log appends and compression."""
+        return self.__timed(self._bulk_pool, False, callable, args, kwargs)
 
     def do_with_engine(self, callable, *args, **kwargs):
-        return threads.deferToThreadPool(self.reactor, self._pool,
-                                         self.__thd, True, callable, args, kwargs)
+        return self.__timed(self._pool, True, callable, args, kwargs)
 
     def get_sqlite_version(self):
         import sqlite3
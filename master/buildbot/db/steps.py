@@ -12,6 +12,8 @@
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 # Copyright Buildbot Team Members
+import threading
+
 import sqlalchemy as sa
 
 from twisted.internet import defer
@@ -20,12 +22,53 @@ from twisted.internet import reactor
 from buildbot.db import base
 from buildbot.util import epoch2datetime
 from buildbot.util import json
+from buildbot.util import lru
+
+
+class BuildSteps(object):
+
+    """
+    The next step number and the step names already taken in one build.
+    """
+
+    def __init__(self, nextNumber, names):
+        self.nextNumber = nextNumber
+        self.names = names
+        self.stale = False
+
+    def reserve(self, name):
+        number = self.nextNumber
+        self.nextNumber += 1
+        if name in self.names:
+            # Because names are truncated at the right to fit in a
+            # 50-character identifier, this isn't a simple counter.
+            num = 1
+            while True:
+                numstr = '_%d' % num
+                newname = name[:50 - len(numstr)] + numstr
+                if newname not in self.names:
+                    break
+                num += 1
+            name = newname
+        self.names.add(name)
+        return number, name
 
 
 class StepsConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/db.rst
     url_lock = None
 
+    # number of builds whose next step number and step names are kept in
+    # memory, so that adding a step takes a single insert
+    BUILD_STEPS_CACHE_SIZE = 200
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # the steps of a build are added from the DB threads, hence the lock
+        self._buildStepsLock = threading.Lock()
+        self._buildSteps = lru.LRUCache(self._loadBuildSteps,
+                                        self.BUILD_STEPS_CACHE_SIZE)
+
     def getStep(self, stepid=None, buildid=None, number=None, name=None):
         tbl = self.db.model.steps
         if stepid is not None:
@@ -53,60 +96,101 @@ class StepsConnectorComponent(base.DBConnectorComponent):
             return rv
         return self.db.pool.do(thd)
 
-    def getSteps(self, buildid):
+    def getSteps(self, buildid, resultSpec=None):
         def thd(conn):
             tbl = self.db.model.steps
             q = tbl.select()
             q = q.where(tbl.c.buildid == buildid)
-            q = q.order_by(tbl.c.number)
+            if resultSpec is None or not resultSpec.order:
+                # a requested order replaces this default one
+                q = q.order_by(tbl.c.number)
+            if resultSpec is not None:
+                return resultSpec.thd_execute(conn, q, self._stepdictFromRow)
             res = conn.execute(q)
             return [self._stepdictFromRow(row) for row in res.fetchall()]
         return self.db.pool.do(thd)
 
-    def addStep(self, buildid, name, state_string):
+    def getStepsForBuilds(self, buildids):
         def thd(conn):
             tbl = self.db.model.steps
-            # get the highest current number
-            r = conn.execute(sa.select([sa.func.max(tbl.c.number)],
-                                       whereclause=(tbl.c.buildid == buildid)))
-            number = r.scalar()
-            number = 0 if number is None else number + 1
-
-            # note that there is no chance for a race condition here,
-            # since only one master is inserting steps.  If there is a
-            # conflict, then the name is likely already taken.
-            insert_row = dict(buildid=buildid, number=number,
-                              started_at=None, complete_at=None,
-                              state_string=state_string,
-                              urls_json='[]', name=name)
-            try:
-                r = conn.execute(self.db.model.steps.insert(), insert_row)
-                got_id = r.inserted_primary_key[0]
-            except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
-                got_id = None
-
-            if got_id:
-                return (got_id, number, name)
-
-            # we didn't get an id, so calculate a unique name and use that
-            # instead.  Because names are truncated at the right to fit in a
-            # 50-character identifier, this isn't a simple query.
-            res = conn.execute(sa.select([tbl.c.name],
-                                         whereclause=((tbl.c.buildid == buildid))))
-            names = set([row[0] for row in res])
-            num = 1
-            while True:
-                numstr = '_%d' % num
-                newname = name[:50 - len(numstr)] + numstr
-                if newname not in names:
-                    break
-                num += 1
-            insert_row['name'] = newname
-            r = conn.execute(self.db.model.steps.insert(), insert_row)
-            got_id = r.inserted_primary_key[0]
-            return (got_id, number, newname)
+            rv = []
+            # batch the buildids, so that the parameter lists supported by
+            # the DBAPI aren't exhausted
+            for batch in self.doBatch(sorted(set(buildids)), 100):
+                q = tbl.select(whereclause=tbl.c.buildid.in_(batch))
+                q = q.order_by(tbl.c.buildid, tbl.c.number)
+                res = conn.execute(q)
+                rv.extend(self._stepdictFromRow(row) for row in res.fetchall())
+            return rv
+        return self.db.pool.do(thd)
+
+    def addStep(self, buildid, name, state_string):
+        def thd(conn):
+            return self._thdAddSteps(conn, buildid, [name], state_string)[0]
+        return self.db.pool.do(thd)
+
+    def addSteps(self, buildid, names, state_string):
+        if not names:
+            return defer.succeed([])
+
+        def thd(conn):
+            return self._thdAddSteps(conn, buildid, names, state_string)
         return self.db.pool.do(thd)
 
+    def _thdAddSteps(self, conn, buildid, names, state_string):
+        tbl = self.db.model.steps
+        for attempt in (1, 2):
+            buildSteps, reserved = self._reserveSteps(conn, buildid, names)
+            rows = [dict(buildid=buildid, number=number, name=name,
+                         started_at=None, complete_at=None,
+                         state_string=state_string, urls_json='[]')
+                    for number, name in reserved]
+            transaction = conn.begin()
+            try:
+                if len(rows) == 1:
+                    r = conn.execute(tbl.insert(), rows[0])
+                    stepids = [r.inserted_primary_key[0]]
+                else:
+                    conn.execute(tbl.insert(), rows)
+                    # executemany does not return the new ids, so read them
+                    # back by their numbers
+                    q = sa.select([tbl.c.number, tbl.c.id],
+                                  whereclause=((tbl.c.buildid == buildid) &
+                                               (tbl.c.number >= rows[0]['number']) &
+                                               (tbl.c.number <= rows[-1]['number'])))
+                    stepidsByNumber = dict(conn.execute(q).fetchall())
+                    stepids = [stepidsByNumber[row['number']] for row in rows]
+            except Exception as e:
+                transaction.rollback()
+                # what is kept in memory may no longer match the database
+                buildSteps.stale = True
+                # only one master inserts the steps of a build, so the
+                # numbers and names should never collide; if they do anyway,
+                # read them again and try once more
+                if attempt == 2 or not isinstance(
+                        e, (sa.exc.IntegrityError, sa.exc.ProgrammingError)):
+                    raise
+                continue
+            transaction.commit()
+            return [(stepid, row['number'], row['name'])
+                    for stepid, row in zip(stepids, rows)]
+
+    def _reserveSteps(self, conn, buildid, names):
+        with self._buildStepsLock:
+            buildSteps = self._buildSteps.get(buildid, conn=conn)
+            if buildSteps.stale:
+                buildSteps = self._loadBuildSteps(buildid, conn=conn)
+                self._buildSteps.put(buildid, buildSteps)
+            return buildSteps, [buildSteps.reserve(name) for name in names]
+
+    def _loadBuildSteps(self, buildid, conn):
+        tbl = self.db.model.steps
+        res = conn.execute(sa.select([tbl.c.number, tbl.c.name],
+                                     whereclause=(tbl.c.buildid == buildid)))
+        rows = res.fetchall()
+        nextNumber = max([row.number for row in rows]) + 1 if rows else 0
+        return BuildSteps(nextNumber, set([row.name for row in rows]))
+
     def startStep(self, stepid, _reactor=reactor):
         started_at = _reactor.seconds()
 
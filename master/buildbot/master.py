@@ -46,6 +46,7 @@ from buildbot.process import metrics
 from buildbot.process.botmaster import BotMaster
 from buildbot.process.builder import BuilderControl
 from buildbot.process.users.manager import UserManagerManager
+from buildbot.schedulers.dispatcher import ChangeDispatcher
 from buildbot.schedulers.manager import SchedulerManager
 from buildbot.status.master import Status
 from buildbot.util import ascii2unicode
@@ -165,6 +166,9 @@ class BuildMaster(service.ReconfigurableServiceMixin, service.MasterService,
         self.scheduler_manager = SchedulerManager()
         self.scheduler_manager.setServiceParent(self)
 
+        self.change_dispatcher = ChangeDispatcher()
+        self.change_dispatcher.setServiceParent(self)
+
         self.user_manager = UserManagerManager(self)
         self.user_manager.setServiceParent(self)
 
@@ -27,7 +27,7 @@ class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
 
     def __init__(self):
         base.MQBase.__init__(self)
-        self.qrefs = []
+        self.qrefs = tuplematch.TupleTrie()
         self.persistent_qrefs = {}
         self.debug = False
 
@@ -39,9 +39,8 @@ class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
     def produce(self, routingKey, data):
         if self.debug:
             log.msg("MSG: %s\n%s" % (routingKey, pprint.pformat(data)))
-        for qref in self.qrefs:
-            if tuplematch.matchTuple(routingKey, qref.filter):
-                qref.invoke(routingKey, data)
+        for qref in self.qrefs.match(routingKey):
+            qref.invoke(routingKey, data)
 
     def startConsuming(self, callback, filter, persistent_name=None):
         if any(not isinstance(k, str) and k is not None for k in filter):
@@ -52,11 +51,11 @@ class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
                 qref.startConsuming(callback)
             else:
                 qref = PersistentQueueRef(self, callback, filter)
-                self.qrefs.append(qref)
+                self.qrefs.add(filter, qref)
                 self.persistent_qrefs[persistent_name] = qref
         else:
             qref = QueueRef(self, callback, filter)
-            self.qrefs.append(qref)
+            self.qrefs.add(filter, qref)
         return defer.succeed(qref)
 
 
@@ -72,7 +71,7 @@ class QueueRef(base.QueueRef):
     def stopConsuming(self):
         self.callback = None
         try:
-            self.mq.qrefs.remove(self)
+            self.mq.qrefs.remove(self.filter, self)
         except ValueError:
             pass
 
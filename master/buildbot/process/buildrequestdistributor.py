@@ -12,6 +12,7 @@
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 # Copyright Buildbot Team Members
+import heapq
 import random
 from datetime import datetime
 
@@ -29,6 +30,111 @@ from buildbot.util import epoch2datetime
 from buildbot.util import service
 
 
+class UnclaimedBuildRequestQueue(object):
+
+    """
+    The unclaimed build requests for a single builder, indexed by brid and
+    ordered by submission time.
+
+    The queue is kept up to date from buildrequest messages, and reloaded from
+    the database from time to time by L{BuildRequestDistributor}, in case a
+    message was missed or another master claimed a request.
+    """
+
+    def __init__(self):
+        # reactor time of the last reload from the database, or None if the
+        # queue must be reloaded before it is used
+        self.syncedAt = None
+        # brid -> (seq, brdict)
+        self._brdicts = {}
+        # heap of (submitted_at, brid, seq); entries whose seq no longer
+        # matches _brdicts are stale and are dropped lazily
+        self._heap = []
+        self._seq = 0
+        # changes seen while a reload is in progress, replayed over its result
+        self._replay = None
+
+    def __len__(self):
+        return len(self._brdicts)
+
+    def get(self, brid):
+        entry = self._brdicts.get(brid)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def add(self, brdict):
+        if self._replay is not None:
+            self._replay.append((self.add, brdict))
+        self._seq += 1
+        brid = brdict['buildrequestid']
+        self._brdicts[brid] = (self._seq, brdict)
+        heapq.heappush(self._heap, (brdict['submitted_at'], brid, self._seq))
+
+    def remove(self, brid):
+        if self._replay is not None:
+            self._replay.append((self.remove, brid))
+        if self._brdicts.pop(brid, None) is None:
+            return
+        # don't let stale heap entries pile up
+        if len(self._heap) > 2 * len(self._brdicts) + 16:
+            self._heap = [item for item in self._heap if self._isLive(item)]
+            heapq.heapify(self._heap)
+
+    def reset(self, brdicts):
+        self._brdicts = {}
+        self._heap = []
+        for brdict in brdicts:
+            self._seq += 1
+            brid = brdict['buildrequestid']
+            self._brdicts[brid] = (self._seq, brdict)
+            self._heap.append((brdict['submitted_at'], brid, self._seq))
+        heapq.heapify(self._heap)
+
+    def invalidate(self):
+        self.syncedAt = None
+
+    def beginSync(self):
+        self._replay = []
+
+    def finishSync(self, brdicts, now):
+        replay, self._replay = self._replay, None
+        self.reset(brdicts)
+        for method, arg in replay:
+            method(arg)
+        self.syncedAt = now
+
+    def abortSync(self):
+        self._replay = None
+
+    def oldest(self, exclude=()):
+        # return the oldest brdict whose brid is not in exclude, or None
+        skipped = []
+        try:
+            while self._heap:
+                item = self._heap[0]
+                if not self._isLive(item):
+                    heapq.heappop(self._heap)
+                elif item[1] in exclude:
+                    skipped.append(heapq.heappop(self._heap))
+                else:
+                    return self._brdicts[item[1]][1]
+            return None
+        finally:
+            for item in skipped:
+                heapq.heappush(self._heap, item)
+
+    def sorted(self):
+        # return all brdicts, oldest first
+        return [self._brdicts[item[1]][1]
+                for item in sorted(self._heap)
+                if self._isLive(item)]
+
+    def _isLive(self, item):
+        entry = self._brdicts.get(item[1])
+        return entry is not None and entry[0] == item[2]
+
+
 class BuildChooserBase(object):
     #
     # WARNING: This API is experimental and in active development.
@@ -52,6 +158,12 @@ class BuildChooserBase(object):
         self.master = master
         self.breqCache = {}
         self.unclaimedBrdicts = None
+        # set by BuildRequestDistributor.createBuildChooser, so that its
+        # shared queue of unclaimed requests is used
+        self.distributor = None
+        self.unclaimedQueue = None
+        # brids this chooser has already handed out or given up on
+        self.removedBrids = set()
 
     @defer.inlineCallbacks
     def chooseNextBuild(self):
@@ -71,23 +183,42 @@ class BuildChooserBase(object):
         raise NotImplementedError("Subclasses must implement this!")
 
     # - Helper functions that are generally useful to all subclasses -
+    @defer.inlineCallbacks
+    def _fetchUnclaimedQueue(self):
+        # Sets up the queue of unclaimed brdicts for this builder, saved at
+        # self.unclaimedQueue.  This is the distributor's incrementally
+        # maintained queue if there is one; otherwise the queue is loaded
+        # from the data API.
+        if self.unclaimedQueue is None:
+            if self.distributor is not None:
+                queue = yield self.distributor.getUnclaimedQueue(self.bldr)
+            else:
+                queue = UnclaimedBuildRequestQueue()
+                queue.reset((yield self._queryUnclaimedBrdicts()))
+            self.unclaimedQueue = queue
+        defer.returnValue(self.unclaimedQueue)
+
+    @defer.inlineCallbacks
+    def _queryUnclaimedBrdicts(self):
+        brdicts = yield self.master.data.get(('builders',
+                                              (yield self.bldr.getBuilderId()),
+                                              'buildrequests'),
+                                             [resultspec.Filter('claimed',
+                                                                'eq',
+                                                                [False])])
+        defer.returnValue(brdicts)
+
     @defer.inlineCallbacks
     def _fetchUnclaimedBrdicts(self):
-        # Sets up a cache of all the unclaimed brdicts. The cache is
-        # saved at self.unclaimedBrdicts cache. If the cache already
+        # Sets up a cache of all the unclaimed brdicts, oldest first. The
+        # cache is saved at self.unclaimedBrdicts cache. If the cache already
         # exists, this function does nothing. If a refetch is desired, set
-        # the self.unclaimedBrdicts to None before calling."""
+        # the self.unclaimedBrdicts to None before calling.
         if self.unclaimedBrdicts is None:
-            # TODO: use order of the DATA API
-            brdicts = yield self.master.data.get(('builders',
-                                                  (yield self.bldr.getBuilderId()),
-                                                  'buildrequests'),
-                                                 [resultspec.Filter('claimed',
-                                                                    'eq',
-                                                                    [False])])
-            # sort by submitted_at, so the first is the oldest
-            brdicts.sort(key=lambda brd: brd['submitted_at'])
-            self.unclaimedBrdicts = brdicts
+            queue = yield self._fetchUnclaimedQueue()
+            self.unclaimedBrdicts = [
+                brdict for brdict in queue.sorted()
+                if brdict['buildrequestid'] not in self.removedBrids]
         defer.returnValue(self.unclaimedBrdicts)
 
     @defer.inlineCallbacks
@@ -104,16 +235,14 @@ class BuildChooserBase(object):
 
     def _getBrdictForBuildRequest(self, breq):
         # Turn a BuildRequest back into a brdict. This operates from the
-        # cache, which must be set up once via _fetchUnclaimedBrdicts
+        # queue, which must be set up once via _fetchUnclaimedQueue
 
-        if breq is None:
+        if breq is None or self.unclaimedQueue is None:
             return None
 
-        brid = breq.id
-        for brdict in self.unclaimedBrdicts:
-            if brid == brdict['buildrequestid']:
-                return brdict
-        return None
+        if breq.id in self.removedBrids:
+            return None
+        return self.unclaimedQueue.get(breq.id)
 
     def _removeBuildRequest(self, breq):
         # Remove a BuildrRequest object (and its brdict)
@@ -123,8 +252,10 @@ class BuildChooserBase(object):
             return
 
         brdict = self._getBrdictForBuildRequest(breq)
-        if brdict is not None:
-            self.unclaimedBrdicts.remove(brdict)
+        self.removedBrids.add(breq.id)
+        if brdict is not None and self.unclaimedBrdicts is not None:
+            if brdict in self.unclaimedBrdicts:
+                self.unclaimedBrdicts.remove(brdict)
 
         if breq.id in self.breqCache:
             del self.breqCache[breq.id]
@@ -220,14 +351,13 @@ class BasicBuildChooser(BuildChooserBase):
 
     @defer.inlineCallbacks
     def _getNextUnclaimedBuildRequest(self):
-        # ensure the cache is there
-        yield self._fetchUnclaimedBrdicts()
-        if not self.unclaimedBrdicts:
-            defer.returnValue(None)
-            return
-
         if self.nextBuild:
-            # nextBuild expects BuildRequest objects
+            # nextBuild expects the full list of BuildRequest objects
+            yield self._fetchUnclaimedBrdicts()
+            if not self.unclaimedBrdicts:
+                defer.returnValue(None)
+                return
+
             breqs = yield self._getUnclaimedBuildRequests()
             try:
                 nextBreq = yield self.nextBuild(self.bldr, breqs)
@@ -238,8 +368,12 @@ class BasicBuildChooser(BuildChooserBase):
                         "from _getNextUnclaimedBuildRequest for builder '%s'" % (self.bldr,))
                 nextBreq = None
         else:
-            # otherwise just return the first build
-            brdict = self.unclaimedBrdicts[0]
+            # otherwise just return the oldest build
+            queue = yield self._fetchUnclaimedQueue()
+            brdict = queue.oldest(exclude=self.removedBrids)
+            if brdict is None:
+                defer.returnValue(None)
+                return
             nextBreq = yield self._getBuildRequestForBrdict(brdict)
 
         defer.returnValue(nextBreq)
@@ -306,6 +440,10 @@ class BuildRequestDistributor(service.AsyncMultiService):
 
     BuildChooser = BasicBuildChooser
 
+    # how often (in seconds) each builder's queue of unclaimed requests is
+    # reloaded from the database, to catch anything the messages missed
+    RECONCILE_INTERVAL = 60
+
     def __init__(self, botmaster):
         service.AsyncMultiService.__init__(self)
         self.botmaster = botmaster
@@ -321,8 +459,24 @@ class BuildRequestDistributor(service.AsyncMultiService):
 
         self._pendingMSBOCalls = []
 
+        # builderid -> UnclaimedBuildRequestQueue
+        self._unclaimedQueues = {}
+        self._buildrequestConsumers = []
+
+    @defer.inlineCallbacks
+    def startService(self):
+        for event in ('new', 'claimed', 'unclaimed', 'complete'):
+            consumer = yield self.master.mq.startConsuming(
+                self._buildRequestEvent, ('buildrequests', None, event))
+            self._buildrequestConsumers.append(consumer)
+        yield service.AsyncMultiService.startService(self)
+
     @defer.inlineCallbacks
     def stopService(self):
+        for consumer in self._buildrequestConsumers:
+            consumer.stopConsuming()
+        self._buildrequestConsumers = []
+
         # Lots of stuff happens asynchronously here, so we need to let it all
         # quiesce.  First, let the parent stopService succeed between
         # activities; then the loop will stop calling itself, since
@@ -336,6 +490,54 @@ class BuildRequestDistributor(service.AsyncMultiService):
         if self._pendingMSBOCalls:
             yield defer.DeferredList(self._pendingMSBOCalls)
 
+        # the queues are not being updated any more
+        self._unclaimedQueues = {}
+
+    def _buildRequestEvent(self, key, msg):
+        queue = self._unclaimedQueues.get(msg['builderid'])
+        if queue is None:
+            # nobody has asked for this builder yet; its queue will be loaded
+            # from the database when they do
+            return
+        if key[-1] in ('new', 'unclaimed') and \
+                not msg['claimed'] and not msg['complete']:
+            queue.add(msg)
+        else:
+            queue.remove(msg['buildrequestid'])
+
+    @defer.inlineCallbacks
+    def getUnclaimedQueue(self, bldr, _reactor=reactor):
+        """
+        Get the queue of unclaimed build requests for C{bldr}, reloading it
+        from the database if it is new, invalidated or due for reconciliation.
+
+        @returns: L{UnclaimedBuildRequestQueue} via Deferred
+        """
+        builderid = yield bldr.getBuilderId()
+        queue = self._unclaimedQueues.get(builderid)
+        if queue is None:
+            queue = self._unclaimedQueues[builderid] = \
+                UnclaimedBuildRequestQueue()
+
+        now = _reactor.seconds()
+        if queue.syncedAt is None or \
+                now - queue.syncedAt > self.RECONCILE_INTERVAL:
+            queue.beginSync()
+            try:
+                brdicts = yield self.master.data.get(
+                    ('builders', builderid, 'buildrequests'),
+                    [resultspec.Filter('claimed', 'eq', [False])])
+            except Exception:
+                queue.abortSync()
+                raise
+            queue.finishSync(brdicts, now)
+        defer.returnValue(queue)
+
+    def _invalidateUnclaimedQueue(self, builderid):
+        queue = self._unclaimedQueues.get(builderid)
+        if queue is not None:
+            queue.invalidate()
+
     def maybeStartBuildsOn(self, new_builders):
         """
         Try to start any builds that can be started right now.  This function
@@ -499,6 +701,7 @@ class BuildRequestDistributor(service.AsyncMultiService):
         # create a chooser to give us our next builds
         # this object is temporary and will go away when we're done
         bc = self.createBuildChooser(bldr, self.master)
+        builderid = yield bldr.getBuilderId()
 
         while True:
             worker, breqs = yield bc.chooseNextBuild()
@@ -511,20 +714,32 @@ class BuildRequestDistributor(service.AsyncMultiService):
             claimed_at = epoch2datetime(claimed_at_epoch)
             if not (yield self.master.data.updates.claimBuildRequests(
                     brids, claimed_at=claimed_at)):
-                # some brids were already claimed, so start over
+                # some brids were already claimed, so reload the queue and
+                # start over
+                self._invalidateUnclaimedQueue(builderid)
                 bc = self.createBuildChooser(bldr, self.master)
                 continue
 
+            # don't wait for the 'claimed' messages to drop these
+            queue = self._unclaimedQueues.get(builderid)
+            if queue is not None:
+                for brid in brids:
+                    queue.remove(brid)
+
             buildStarted = yield bldr.maybeStartBuild(worker, breqs)
             if not buildStarted:
                 yield self.master.data.updates.unclaimBuildRequests(brids)
+                self._invalidateUnclaimedQueue(builderid)
                 # try starting builds again.  If we still have a working worker,
                 # then this may re-claim the same buildrequests
                 self.botmaster.maybeStartBuildsForBuilder(self.name)
 
     def createBuildChooser(self, bldr, master):
-        # just instantiate the build chooser requested
-        return self.BuildChooser(bldr, master)
+        # just instantiate the build chooser requested, and let it use our
+        # queues of unclaimed requests
+        bc = self.BuildChooser(bldr, master)
+        bc.distributor = self
+        return bc
 
     def _quiet(self):
         # shim for tests
@@ -36,6 +36,7 @@ from __future__ import print_function
 from future.utils import iteritems
 from future.utils import lrange
 
+import bisect
 import gc
 import os
 import sys
@@ -79,6 +80,13 @@ class MetricTimeEvent(MetricEvent):
         self.timer = timer
         self.elapsed = elapsed
 
+
+class MetricHistogramEvent(MetricEvent):
+
+    def __init__(self, histogram, value):
+        self.histogram = histogram
+        self.value = value
+
 ALARM_OK, ALARM_WARN, ALARM_CRIT = lrange(3)
 ALARM_TEXT = ["OK", "WARN", "CRIT"]
 
@@ -271,6 +279,69 @@ class MetricTimeHandler(MetricHandler):
         return dict(timers=retval)
 
 
+class Histogram(object):
+
+    """
+    Counts of values falling under each of a fixed set of upper bounds, along
+    with their total count and sum.  The default bounds suit durations in
+    seconds.
+    """
+
+    BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+              1.0, 2.5, 5.0, 10.0, float('inf'))
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def average(self):
+        if not self.count:
+            return 0
+        return float(self.sum) / self.count
+
+    def asDict(self):
+        return dict(count=self.count, sum=self.sum,
+                    buckets=list(zip(self.bounds, self.buckets)))
+
+
+class MetricHistogramHandler(MetricHandler):
+    _histograms = None
+
+    def reset(self):
+        self._histograms = defaultdict(Histogram)
+
+    def handle(self, eventDict, metric):
+        self._histograms[metric.histogram].add(metric.value)
+
+    def keys(self):
+        return list(self._histograms)
+
+    def get(self, histogram):
+        return self._histograms[histogram]
+
+    def report(self):
+        retval = []
+        for name in sorted(self.keys()):
+            h = self.get(name)
+            retval.append("Histogram %s: count %i, average %.3g"
+                          % (name, h.count, h.average))
+        return "\n".join(retval)
+
+    def asDict(self):
+        retval = {}
+        for name in sorted(self.keys()):
+            retval[name] = self.get(name).asDict()
+        return dict(histograms=retval)
+
+
 class MetricAlarmHandler(MetricHandler):
     _alarms = None
 
@@ -396,6 +467,8 @@ class MetricLogObserver(util_service.ReconfigurableServiceMixin,
         self.registerHandler(MetricCountEvent, MetricCountHandler(self))
         self.registerHandler(MetricTimeEvent, MetricTimeHandler(self))
         self.registerHandler(MetricAlarmEvent, MetricAlarmHandler(self))
+        self.registerHandler(MetricHistogramEvent,
+                             MetricHistogramHandler(self))
 
         self.getHandler(MetricCountEvent).addWatcher(
             AttachedWorkersWatcher(self))
@@ -48,6 +48,10 @@ class Properties(util.ComparableMixin):
 
     As a special case, a property value of None is returned as an empty
     string when used as a mapping.
+
+    @ivar dirty: names of the properties set since the last call to
+        L{takeDirtyProperties}, that is, since they were last written to the
+        database.
     """
 
     compare_attrs = ('properties',)
@@ -60,6 +64,7 @@ class Properties(util.ComparableMixin):
         # Track keys which are 'runtime', and should not be
         # persisted if a build is rebuilt
         self.runtime = set()
+        self.dirty = set()
         self.build = None  # will be set by the Build when starting
         if kwargs:
             self.update(kwargs, "TEST")
@@ -80,6 +85,8 @@ class Properties(util.ComparableMixin):
         self.__dict__ = d
         if not hasattr(self, 'runtime'):
             self.runtime = set()
+        if not hasattr(self, 'dirty'):
+            self.dirty = set(self.properties)
 
     def __contains__(self, name):
         return name in self.properties
@@ -119,6 +126,7 @@ class Properties(util.ComparableMixin):
         """Update this object based on another object; the other object's """
         self.properties.update(other.properties)
         self.runtime.update(other.runtime)
+        self.dirty.update(other.properties)
 
     def updateFromPropertiesNoRuntime(self, other):
         """Update this object based on another object, but don't
@@ -126,6 +134,7 @@ class Properties(util.ComparableMixin):
         for k, v in iteritems(other.properties):
             if k not in other.runtime:
                 self.properties[k] = v
+                self.dirty.add(k)
 
     # IProperties methods
 
@@ -143,9 +152,17 @@ class Properties(util.ComparableMixin):
         source = util.ascii2unicode(source)
 
         self.properties[name] = (value, source)
+        self.dirty.add(name)
         if runtime:
             self.runtime.add(name)
 
+    def takeDirtyProperties(self):
+        """Return the properties set since the last call, as a dictionary
+        mapping names to (value, source) tuples, and mark them clean."""
+        dirty, self.dirty = self.dirty, set()
+        return dict((k, self.properties[k]) for k in dirty
+                    if k in self.properties)
+
     def getProperties(self):
         return self
 
@@ -25,6 +25,7 @@ from buildbot import util
 from buildbot.process import metrics
 from buildbot.process.results import FAILURE
 from buildbot.process.results import SUCCESS
+from buildbot.util.accumulator import Accumulator
 from buildbot.util.eventual import eventually
 from buildbot.worker.protocols import base
 from buildbot.worker_transition import WorkerAPICompatMixin
@@ -44,6 +45,11 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
     rc = None
     debug = False
 
+    # limits on collected stdout/stderr: data past collectMaxSize characters
+    # is dropped, and data past collectSpillSize is kept in a temporary file
+    collectMaxSize = None
+    collectSpillSize = None
+
     def __init__(self, remote_command, args, ignore_updates=False,
                  collectStdout=False, collectStderr=False, decodeRC=None,
                  stdioLogName='stdio'):
@@ -54,8 +60,8 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
         self._closeWhenFinished = {}
         self.collectStdout = collectStdout
         self.collectStderr = collectStderr
-        self.stdout = ''
-        self.stderr = ''
+        self._stdout = self._makeAccumulator()
+        self._stderr = self._makeAccumulator()
         self.updates = {}
         self.stdioLogName = stdioLogName
         self._startTime = None
@@ -79,6 +85,28 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
     def __repr__(self):
         return "<RemoteCommand '%s' at %d>" % (self.remote_command, id(self))
 
+    def _makeAccumulator(self, value=''):
+        acc = Accumulator(maxSize=self.collectMaxSize,
+                          spillSize=self.collectSpillSize)
+        acc.append(value)
+        return acc
+
+    @property
+    def stdout(self):
+        return self._stdout.getvalue()
+
+    @stdout.setter
+    def stdout(self, value):
+        self._stdout = self._makeAccumulator(value)
+
+    @property
+    def stderr(self):
+        return self._stderr.getvalue()
+
+    @stderr.setter
+    def stderr(self, value):
+        self._stderr = self._makeAccumulator(value)
+
     def run(self, step, conn, builder_name):
         self.active = True
         self.step = step
@@ -229,7 +257,7 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
     @defer.inlineCallbacks
     def addStdout(self, data):
         if self.collectStdout:
-            self.stdout += data
+            self._stdout.append(data)
         if self.stdioLogName is not None and self.stdioLogName in self.logs:
             log_ = yield self._unwrap(self.logs[self.stdioLogName])
             log_.addStdout(data)
@@ -238,7 +266,7 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
     @defer.inlineCallbacks
     def addStderr(self, data):
         if self.collectStderr:
-            self.stderr += data
+            self._stderr.append(data)
         if self.stdioLogName is not None and self.stdioLogName in self.logs:
             log_ = yield self._unwrap(self.logs[self.stdioLogName])
             log_.addStderr(data)
@@ -287,6 +315,19 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
             # 'log': (logname, data)
             logname, data = update['log']
             yield self.addToLog(logname, data)
+        if "segments" in update:
+            # 'segments': [(stream, data), ...], where stream is 'stdout',
+            # 'stderr', 'header' or ('log', logname), in the order the data
+            # was produced
+            for stream, data in update['segments']:
+                if stream == 'stdout':
+                    yield self.addStdout(data)
+                elif stream == 'stderr':
+                    yield self.addStderr(data)
+                elif stream == 'header':
+                    yield self.addHeader(data)
+                else:
+                    yield self.addToLog(stream[1], data)
         if "rc" in update:
             rc = self.rc = update['rc']
             log.msg("%s rc=%s" % (self, rc))
@@ -296,7 +337,7 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
 
         # TODO: these should be handled at the RemoteCommand level
         for k in update:
-            if k not in ('stdout', 'stderr', 'header', 'rc'):
+            if k not in ('stdout', 'stderr', 'header', 'rc', 'segments'):
                 if k not in self.updates:
                     self.updates[k] = []
                 self.updates[k].append(update[k])
@@ -405,6 +446,9 @@ class RemoteShellCommand(RemoteCommand):
 
         self.args['command'] = self.command
         if self.remote_command == "shell":
+            if not self.step.workerVersionIsOlderThan("shell", "3.2"):
+                # let the worker send interleaved output in one update
+                self.args['segments'] = True
             # non-ShellCommand worker commands are responsible for doing this
             # fixup themselves
             if self.step.workerVersion("shell", "old") == "old":
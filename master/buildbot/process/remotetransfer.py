@@ -13,9 +13,21 @@
 #
 # Copyright Buildbot Team Members
 
+import hashlib
 import os
+import re
+import shutil
 import tarfile
 import tempfile
+import threading
+import zlib
+from collections import deque
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import threads
+from twisted.python import failure
+from twisted.python import threadpool
 
 from buildbot.worker.protocols import base
 
@@ -30,13 +42,67 @@ except ImportError:
 module for regrouping all FileWriterImpl and FileReaderImpl away from steps
 """
 
+# uploads write to disk and unpack archives in these threads, so that a
+# large upload does not keep the reactor from serving anything else
+MAX_THREADS = 4
+_threadPool = None
+
+
+def getThreadPool():
+    global _threadPool
+    if _threadPool is None:
+        _threadPool = threadpool.ThreadPool(
+            minthreads=0, maxthreads=MAX_THREADS, name='remotetransfer')
+        _threadPool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', _threadPool.stop)
+    return _threadPool
+
+
+class TransferChecksumError(Exception):
+    pass
+
+
+class BlockHasher(object):
+
+    """
+    SHA-256 checksums of the blocks of a transfer, and a digest of the whole
+    file made from them: the SHA-256 of the concatenated block checksums.
+    Both are computed as the blocks go by, so neither side needs a second
+    pass over the file, and a transfer can resume at any block boundary.
+    """
+
+    def __init__(self, checksums=()):
+        self.checksums = []
+        self._digest = hashlib.sha256()
+        for checksum in checksums:
+            self.add(checksum)
+
+    @staticmethod
+    def checksum(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def add(self, checksum):
+        self.checksums.append(checksum)
+        self._digest.update(checksum.encode('ascii'))
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
 
 class FileWriter(base.FileWriterImpl):
 
     """
     Helper class that acts as a file-object with write access
+
+    File operations run in the transfer thread pool, one at a time and in
+    the order the worker asked for them.  Writes are acknowledged right away
+    while less than C{maxBuffered} bytes are waiting to be written, and only
+    once they hit the disk beyond that, which slows the worker down to the
+    speed of the disk.
     """
 
+    maxBuffered = 1024 * 1024
+
     def __init__(self, destfile, maxsize, mode):
         # Create missing directories.
         destfile = os.path.abspath(destfile)
@@ -46,10 +112,53 @@ class FileWriter(base.FileWriterImpl):
 
         self.destfile = destfile
         self.mode = mode
-        fd, self.tmpname = tempfile.mkstemp(dir=dirname)
-        self.fp = os.fdopen(fd, 'wb')
+        self.fp = self._open()
         self.remaining = maxsize
 
+        self.buffered = 0
+        self._ops = deque()
+        self._running = False
+        self._error = None
+
+    def _open(self):
+        fd, self.tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(self.destfile))
+        return os.fdopen(fd, 'wb')
+
+    def _queue(self, fn, *args):
+        """
+        Run C{fn(*args)} in the transfer thread pool once the operations
+        queued before it have finished.
+
+        @returns: Deferred firing with the result of C{fn}
+        """
+        d = defer.Deferred()
+        self._ops.append((fn, args, d))
+        if not self._running:
+            self._runNext()
+        return d
+
+    def _runNext(self):
+        if not self._ops:
+            self._running = False
+            return
+        self._running = True
+        fn, args, d = self._ops.popleft()
+        op = threads.deferToThreadPool(reactor, getThreadPool(), fn, *args)
+
+        @op.addBoth
+        def done(res):
+            self._runNext()
+            d.callback(res)
+
+    def _checkError(self, res=None):
+        # writes are acknowledged before they happen, so a failed write is
+        # reported by the next call from the worker
+        if self._error is not None:
+            why, self._error = self._error, None
+            return why
+        return res
+
     def remote_write(self, data):
         """
         Called from remote worker to write L{data} to L{fp} within boundaries
@@ -58,21 +167,51 @@ class FileWriter(base.FileWriterImpl):
         @type  data: C{string}
         @param data: String of data to write
         """
+        return self._queueWrite(self._write, data)
+
+    def _queueWrite(self, write, data, *args):
+        why = self._checkError()
+        if why is not None:
+            return defer.fail(why)
+
         if self.remaining is not None:
             if len(data) > self.remaining:
                 data = data[:self.remaining]
-            self.fp.write(data)
             self.remaining = self.remaining - len(data)
-        else:
-            self.fp.write(data)
+
+        size = len(data)
+        self.buffered += size
+        d = self._queue(write, data, *args)
+
+        @d.addBoth
+        def written(res):
+            self.buffered -= size
+            if isinstance(res, failure.Failure) and self._error is None:
+                self._error = res
+            return None
+
+        if self.buffered > self.maxBuffered:
+            # wait for the disk; the error, if any, goes to the next call
+            return d
+        return None
+
+    def _write(self, data):
+        self.fp.write(data)
 
     def remote_utime(self, accessed_modified):
-        os.utime(self.destfile, accessed_modified)
+        d = self._queue(os.utime, self.destfile, accessed_modified)
+        d.addCallback(self._checkError)
+        return d
 
     def remote_close(self):
         """
         Called by remote worker to state that no more data will be transfered
         """
+        d = self._queue(self._close)
+        d.addCallback(self._checkError)
+        return d
+
+    def _close(self):
         self.fp.close()
         self.fp = None
         # on windows, os.rename does not automatically unlink, so do it
@@ -85,6 +224,9 @@ class FileWriter(base.FileWriterImpl):
             os.chmod(self.destfile, self.mode)
 
     def cancel(self):
+        return self._queue(self._cancel)
+
+    def _cancel(self):
         # unclean shutdown, the file is probably truncated, so delete it
         # altogether rather than deliver a corrupted file
         fp = getattr(self, "fp", None)
@@ -96,42 +238,520 @@ class FileWriter(base.FileWriterImpl):
                 os.unlink(self.tmpname)
 
 
-class DirectoryWriter(FileWriter):
+class ResumableFileWriter(FileWriter):
+
+    """
+    A L{FileWriter} that checks the checksum of every block it receives, and
+    the digest of the whole file when it is closed.  The data is written to
+    C{destfile}.partial, and the checksums of the blocks written so far to
+    C{destfile}.partial.sums, which are kept if the upload does not finish,
+    so that the next upload to the same destination can carry on after the
+    last good block.
+    """
+
+    def _open(self):
+        self.tmpname = self.destfile + '.partial'
+        self.sumsname = self.destfile + '.partial.sums'
+        self.blocksize = None
+        self.hasher = None
+        self.sumsfile = None
+        # opened by resumeAt
+        return None
+
+    def remote_getBlockChecksums(self, blocksize):
+        """
+        Called by the worker before anything else, to learn what is left of
+        an earlier upload with the same block size.
+
+        @returns: Deferred firing with the list of block checksums
+        """
+        self.blocksize = blocksize
+        return self._queue(self._readChecksums)
+
+    def _readChecksums(self):
+        if not self.blocksize:
+            return []
+        try:
+            with open(self.sumsname) as f:
+                lines = f.read().split()
+        except IOError:
+            return []
+        if not lines or lines[0] != str(self.blocksize):
+            return []
+        checksums = lines[1:]
+        try:
+            size = os.path.getsize(self.tmpname)
+        except OSError:
+            return []
+        # only trust the checksums of blocks that are still in the file
+        return checksums[:size // self.blocksize]
+
+    def remote_resumeAt(self, nblocks):
+        """
+        Called by the worker to keep the first C{nblocks} blocks of the
+        earlier upload, and continue after them.
+        """
+        if self.remaining is not None:
+            self.remaining = max(0, self.remaining - nblocks * self.blocksize)
+        return self._queue(self._resumeAt, nblocks)
+
+    def _resumeAt(self, nblocks):
+        checksums = self._readChecksums()[:nblocks] if nblocks else []
+        if len(checksums) != nblocks:
+            raise TransferChecksumError(
+                "cannot resume %s after block %d" % (self.destfile, nblocks))
+        mode = 'r+b' if nblocks else 'wb'
+        self.fp = open(self.tmpname, mode)
+        self.fp.truncate(nblocks * self.blocksize)
+        self.fp.seek(0, 2)
+        self.hasher = BlockHasher(checksums)
+        self.sumsfile = open(self.sumsname, 'w')
+        self.sumsfile.write('%s\n' % self.blocksize)
+        self.sumsfile.write(''.join(c + '\n' for c in checksums))
+        self.sumsfile.flush()
+
+    def remote_write(self, data, checksum=None):
+        return self._queueWrite(self._writeBlock, data, checksum)
+
+    def _writeBlock(self, data, expected):
+        if self.fp is None:
+            self._resumeAt(0)
+        checksum = BlockHasher.checksum(data)
+        if expected is not None and checksum != expected:
+            raise TransferChecksumError(
+                "block %d of %s is corrupted"
+                % (len(self.hasher.checksums), self.destfile))
+        self.fp.write(data)
+        # the data has to be in the file before its checksum is recorded
+        self.fp.flush()
+        self.hasher.add(checksum)
+        self.sumsfile.write(checksum + '\n')
+        self.sumsfile.flush()
+
+    def remote_close(self, digest=None):
+        """
+        Called by the worker once it has sent all of the file, with the
+        digest of the whole file.  Without a digest, the upload did not
+        finish, and the partial file is kept.
+        """
+        if digest is None:
+            d = self._queue(self._cancel)
+        else:
+            d = self._queue(self._closeVerified, digest)
+        d.addCallback(self._checkError)
+        return d
+
+    def _closeVerified(self, digest):
+        if self.fp is None:
+            self._resumeAt(0)
+        if digest != self.hasher.hexdigest():
+            # every block was fine, so the worker and the master do not agree
+            # on which blocks make up the file; start over next time
+            self._discard()
+            raise TransferChecksumError(
+                "digest of %s does not match" % (self.destfile,))
+        self.sumsfile.close()
+        self.sumsfile = None
+        os.unlink(self.sumsname)
+        self._close()
+
+    def _cancel(self):
+        # keep what was written so far, for the next upload to resume from
+        for f in (self.fp, self.sumsfile):
+            if f is not None:
+                f.close()
+        self.fp = self.sumsfile = None
+
+    def _discard(self):
+        self._cancel()
+        for name in (self.tmpname, self.sumsname):
+            if os.path.exists(name):
+                os.unlink(name)
+
+
+class ContentStoreWriter(FileWriter):
+
+    """
+    Receive an upload as a manifest of files and their SHA-256 digests, and
+    then only the contents that are missing from the content-addressed store
+    in C{storedir}.  Once the worker is done, every file of the manifest is
+    hard-linked from the store into place under C{destfile}, so a file that
+    was already uploaded by an earlier build is not sent again.
+
+    The manifest is a list of C{(relpath, digest, size, mode)} entries,
+    relative to C{destfile}; the digest of a directory is None, and the
+    relpath of a single uploaded file is the empty string.
+    """
+
+    digestRe = re.compile(r'^[0-9a-f]{64}$')
+
+    def __init__(self, destfile, maxsize, mode, storedir):
+        self.storedir = os.path.abspath(storedir)
+        # maxsize is checked against the manifest, and then against the
+        # contents actually sent
+        FileWriter.__init__(self, destfile, None, mode)
+        self.maxsize = maxsize
+        self.entries = []
+        self.modes = {}
+        self.sizes = {}
+        self.digest = None
+        self.hasher = None
+        self.received = 0
+        self.sent = 0
+
+    def _open(self):
+        self.tmpname = None
+        # opened by beginFile, for each missing content
+        return None
+
+    def storePath(self, digest):
+        return os.path.join(self.storedir, digest[:2], digest[2:])
+
+    def destPath(self, relpath):
+        if not relpath:
+            return self.destfile
+        path = os.path.normpath(os.path.join(self.destfile, relpath))
+        if not path.startswith(self.destfile + os.sep):
+            raise ValueError("%r is not below %s" % (relpath, self.destfile))
+        return path
+
+    def remote_manifest(self, entries):
+        """
+        Called by the worker with the manifest of the upload.
+
+        @returns: Deferred firing with the digests missing from the store
+        """
+        return self._queue(self._missing, entries)
+
+    def _missing(self, entries):
+        size = 0
+        missing = []
+        for relpath, digest, filesize, mode in entries:
+            self.destPath(relpath)
+            if digest is None:
+                continue
+            if not self.digestRe.match(digest):
+                raise ValueError("invalid digest %r" % (digest,))
+            size += filesize
+            if digest in self.modes:
+                continue
+            self.modes[digest] = mode if self.mode is None else self.mode
+            self.sizes[digest] = filesize
+            if not os.path.exists(self.storePath(digest)):
+                missing.append(digest)
+        if self.maxsize is not None and size > self.maxsize:
+            raise ValueError("upload of %d bytes is larger than maxsize %d"
+                             % (size, self.maxsize))
+        self.entries = entries
+        return missing
+
+    def remote_beginFile(self, digest):
+        """
+        Called by the worker before it sends the content with the given
+        digest, with L{remote_write}.
+        """
+        return self._queue(self._beginFile, digest)
+
+    def _beginFile(self, digest):
+        if digest not in self.modes:
+            raise ValueError("%r is not in the manifest" % (digest,))
+        if not os.path.exists(self.storedir):
+            os.makedirs(self.storedir)
+        fd, self.tmpname = tempfile.mkstemp(dir=self.storedir,
+                                            prefix='.incoming-')
+        self.fp = os.fdopen(fd, 'wb')
+        self.digest = digest
+        self.hasher = hashlib.sha256()
+        self.received = 0
+
+    def _write(self, data):
+        self.received += len(data)
+        self.sent += len(data)
+        if self.received > self.sizes[self.digest]:
+            raise ValueError("content sent for %s is larger than its %d bytes"
+                             % (self.digest, self.sizes[self.digest]))
+        if self.maxsize is not None and self.sent > self.maxsize:
+            raise ValueError("upload of %d bytes is larger than maxsize %d"
+                             % (self.sent, self.maxsize))
+        self.fp.write(data)
+        self.hasher.update(data)
+
+    def remote_endFile(self):
+        """
+        Called by the worker once it has sent the whole content; the content
+        is checked against its digest, and added to the store.
+        """
+        d = self._queue(self._endFile)
+        d.addCallback(self._checkError)
+        return d
+
+    def _endFile(self):
+        self.fp.close()
+        self.fp = None
+        tmpname, self.tmpname = self.tmpname, None
+        if self.hasher.hexdigest() != self.digest:
+            os.unlink(tmpname)
+            raise TransferChecksumError(
+                "content sent for %s does not match its digest" % self.digest)
+        mode = self.modes[self.digest]
+        if mode is not None:
+            os.chmod(tmpname, mode)
+        path = self.storePath(self.digest)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if os.path.exists(path):
+            # stored by another upload in the meantime
+            os.unlink(tmpname)
+        else:
+            os.rename(tmpname, path)
+
+    def remote_close(self):
+        """
+        Called by the worker once all of the missing contents have been sent
+        """
+        d = self._queue(self._linkAll)
+        d.addCallback(self._checkError)
+        return d
+
+    def _linkAll(self):
+        for relpath, digest, size, mode in self.entries:
+            dest = self.destPath(relpath)
+            if self.mode is not None:
+                mode = self.mode
+            if digest is None:
+                if not os.path.isdir(dest):
+                    os.makedirs(dest)
+            else:
+                self._link(digest, dest, mode)
+
+    def _link(self, digest, dest, mode):
+        src = self.storePath(digest)
+        dirname = os.path.dirname(dest)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        # the link shares the mode of the stored file, so only link when it
+        # is the one wanted
+        link = getattr(os, 'link', None)
+        if link and (mode is None or os.stat(src).st_mode & 0o7777 == mode):
+            try:
+                link(src, dest)
+                return
+            except OSError:
+                # e.g. the store is on another filesystem
+                pass
+        shutil.copyfile(src, dest)
+        if mode is not None:
+            os.chmod(dest, mode)
+
+    def _cancel(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        if self.tmpname and os.path.exists(self.tmpname):
+            os.unlink(self.tmpname)
+        self.tmpname = None
+
+
+class _TransferCancelled(Exception):
+    pass
+
+
+class _BlockReader(object):
+
+    """
+    File-like object handing the blocks received from the worker over to the
+    thread extracting them.
+    """
+
+    def __init__(self, consumed):
+        self._consumed = consumed
+        self._cond = threading.Condition()
+        self._blocks = deque()
+        self._eof = False
+        self._cancelled = False
+        self._buf = b''
+
+    # reactor
+
+    def feed(self, data):
+        with self._cond:
+            self._blocks.append(data)
+            self._cond.notify()
+
+    def close(self, cancel=False):
+        with self._cond:
+            self._eof = True
+            self._cancelled = cancel
+            self._cond.notify()
+
+    # extracting thread
+
+    def read(self, size=-1):
+        chunks = [self._buf]
+        have = len(self._buf)
+        while size < 0 or have < size:
+            with self._cond:
+                while not self._blocks and not self._eof:
+                    self._cond.wait()
+                if self._cancelled:
+                    raise _TransferCancelled()
+                if not self._blocks:
+                    break
+                block = self._blocks.popleft()
+            reactor.callFromThread(self._consumed, len(block))
+            chunks.append(block)
+            have += len(block)
+        data = b''.join(chunks)
+        if size < 0:
+            self._buf = b''
+            return data
+        data, self._buf = data[:size], data[size:]
+        return data
+
+
+class _ZlibReader(object):
+
+    """
+    Decompress a zlib stream read from C{fileobj}.
+    """
+
+    blocksize = 64 * 1024
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._decompressor = zlib.decompressobj()
+        self._eof = False
+        self._buf = b''
+
+    def read(self, size):
+        while len(self._buf) < size and not self._eof:
+            data = self.fileobj.read(self.blocksize)
+            if data:
+                self._buf += self._decompressor.decompress(data)
+            else:
+                self._buf += self._decompressor.flush()
+                self._eof = True
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+
+class DirectoryWriter(base.FileWriterImpl):
 
     """
-    A DirectoryWriter is implemented as a FileWriter, with an added post-processing
-    step to unpack the archive, once the transfer has completed.
+    Extract the tar archive sent by the worker into a directory while it is
+    received.  The extraction runs in its own thread; as with L{FileWriter},
+    writes are acknowledged right away until C{maxBuffered} bytes are waiting
+    to be extracted.
     """
 
+    maxBuffered = FileWriter.maxBuffered
+
     def __init__(self, destroot, maxsize, compress, mode):
         self.destroot = destroot
         self.compress = compress
+        self.mode = mode
+        self.remaining = maxsize
+
+        self.buffered = 0
+        self._reader = None
+        self._extracted = None
+        self._waiters = []
+        self._error = None
+
+    def _startExtracting(self):
+        self._reader = _BlockReader(self._consumed)
+        self._extracted = defer.Deferred()
+        thread = threading.Thread(target=self._extract,
+                                  name='extract %s' % self.destroot)
+        thread.daemon = True
+        thread.start()
+
+    def _extract(self):
+        try:
+            # Map configured compression to a TarFile setting
+            fileobj = self._reader
+            if self.compress in ('bz2', 'gz'):
+                mode = 'r|' + self.compress
+            else:
+                mode = 'r|'
+                if self.compress == 'zlib':
+                    fileobj = _ZlibReader(fileobj)
+
+            archive = tarfile.open(mode=mode, fileobj=fileobj)
+            archive.extractall(path=self.destroot)
+            archive.close()
+            # skip the padding after the end of the archive
+            while self._reader.read(64 * 1024):
+                pass
+            result = None
+        except _TransferCancelled:
+            return
+        except Exception:
+            result = failure.Failure()
+        reactor.callFromThread(self._extractDone, result)
+
+    def _consumed(self, size):
+        self.buffered -= size
+        while self._waiters and self.buffered <= self.maxBuffered:
+            self._waiters.pop(0).callback(None)
+
+    def _extractDone(self, result):
+        if isinstance(result, failure.Failure):
+            if self._error is None:
+                self._error = result
+            # nothing more will be consumed, so don't keep the worker waiting
+            waiters, self._waiters = self._waiters, []
+            for d in waiters:
+                d.errback(result)
+        self._extracted.callback(None)
+
+    def _checkError(self, res=None):
+        if self._error is not None:
+            why, self._error = self._error, None
+            return why
+        return res
+
+    def remote_write(self, data):
+        why = self._checkError()
+        if why is not None:
+            return defer.fail(why)
+
+        if self.remaining is not None:
+            if len(data) > self.remaining:
+                data = data[:self.remaining]
+            self.remaining = self.remaining - len(data)
 
-        self.fd, self.tarname = tempfile.mkstemp()
-        os.close(self.fd)
+        if self._reader is None:
+            self._startExtracting()
+        self.buffered += len(data)
+        self._reader.feed(data)
+        if self.buffered > self.maxBuffered:
+            d = defer.Deferred()
+            self._waiters.append(d)
+            return d
+        return None
 
-        FileWriter.__init__(self, self.tarname, maxsize, mode)
+    def remote_close(self):
+        if self._reader is not None:
+            self._reader.close()
 
     def remote_unpack(self):
         """
         Called by remote worker to state that no more data will be transfered
         """
-        # Make sure remote_close is called, otherwise atomic rename wont happen
-        self.remote_close()
-
-        # Map configured compression to a TarFile setting
-        if self.compress == 'bz2':
-            mode = 'r|bz2'
-        elif self.compress == 'gz':
-            mode = 'r|gz'
-        else:
-            mode = 'r'
+        if self._reader is None:
+            self._startExtracting()
+        self._reader.close()
+        d = self._extracted
+        d.addCallback(self._checkError)
+        return d
 
-        # Unpack archive and clean up after self
-        archive = tarfile.open(name=self.tarname, mode=mode)
-        archive.extractall(path=self.destroot)
-        archive.close()
-        os.remove(self.tarname)
+    def cancel(self):
+        # stop extracting; whatever was extracted so far stays in place
+        if self._reader is not None:
+            self._reader.close(cancel=True)
 
 
 class FileReader(base.FileReaderImpl):
@@ -142,6 +762,7 @@ class FileReader(base.FileReaderImpl):
 
     def __init__(self, fp):
         self.fp = fp
+        self.hasher = BlockHasher()
 
     def remote_read(self, maxlength):
         """
@@ -159,6 +780,47 @@ class FileReader(base.FileReaderImpl):
         data = self.fp.read(maxlength)
         return data
 
+    def remote_resumeAt(self, blocksize, checksums):
+        """
+        Called by the worker to download with block checksums.  The worker
+        passes the checksums of the blocks it kept from an earlier download,
+        and gets the number of them that match the start of this file; the
+        download carries on after those.
+        """
+        self.hasher = BlockHasher()
+        if not checksums or self.fp is None:
+            return 0
+        return threads.deferToThreadPool(reactor, getThreadPool(),
+                                         self._matchBlocks, blocksize,
+                                         checksums)
+
+    def _matchBlocks(self, blocksize, checksums):
+        for expected in checksums:
+            data = self.fp.read(blocksize)
+            checksum = BlockHasher.checksum(data)
+            if len(data) < blocksize or checksum != expected:
+                self.fp.seek(-len(data), 1)
+                break
+            self.hasher.add(checksum)
+        return len(self.hasher.checksums)
+
+    def remote_readBlock(self, maxlength):
+        """
+        Like L{remote_read}, but return the data along with its checksum
+        """
+        data = self.remote_read(maxlength)
+        if not data:
+            return (data, None)
+        checksum = BlockHasher.checksum(data)
+        self.hasher.add(checksum)
+        return (data, checksum)
+
+    def remote_digest(self):
+        """
+        Return the digest of the blocks read with L{remote_readBlock}
+        """
+        return self.hasher.hexdigest()
+
     def remote_close(self):
         """
         Called by remote worker to state that no more data will be transfered
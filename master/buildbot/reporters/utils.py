@@ -24,19 +24,40 @@ from buildbot.process.properties import renderer
 from buildbot.process.results import RETRY
 from buildbot.util import flatten
 
+# the number of older builds getPreviousBuild reads at once, once the
+# immediately preceding build turned out to be retried
+PREVIOUS_BUILDS_WINDOW = 10
+
+# the number of data API requests getDetailsForBuilds runs at once for
+# details that are read one build or one log at a time, so that a large
+# buildset does not hold every DB thread or load every log at once
+DETAILS_CONCURRENCY = 8
+
 
 @defer.inlineCallbacks
 def getPreviousBuild(master, build):
     # naive n-1 algorithm. Still need to define what we should skip
     # SKIP builds? forced builds? rebuilds?
     # dont hesitate to contribute improvments to that algorithm
-    n = build['number'] - 1
-    while n >= 0:
-        prev = yield master.data.get(("builders", build['builderid'], "builds", n))
-        if prev and prev['results'] != RETRY:
-            defer.returnValue(prev)
-        n -= 1
-    defer.returnValue(None)
+    # The previous build is nearly always the one numbered n-1, so ask for the
+    # latest build below n, and only if that one was retried go on reading
+    # older builds a few at a time; these queries are served by the
+    # (builderid, number) index instead of walking back one build number per
+    # query.  RETRY builds are skipped here rather than in the query, as
+    # still-running builds have no results and must not be skipped.
+    path = ("builders", build['builderid'], "builds")
+    number, limit = build['number'], 1
+    while True:
+        prevs = yield master.data.get(
+            path,
+            filters=[resultspec.Filter('number', 'lt', [number])],
+            order=['-number'], limit=limit)
+        for prev in prevs:
+            if prev['results'] != RETRY:
+                defer.returnValue(prev)
+        if len(prevs) < limit:
+            defer.returnValue(None)
+        number, limit = prevs[-1]['number'], PREVIOUS_BUILDS_WINDOW
 
 
 @defer.inlineCallbacks
@@ -89,31 +110,44 @@ def getDetailsForBuilds(master, buildset, builds, wantProperties=False, wantStep
     buildersbyid = dict([(builder['builderid'], builder)
                          for builder in builders])
 
+    buildids = [build['buildid'] for build in builds]
+    sem = defer.DeferredSemaphore(DETAILS_CONCURRENCY)
+
+    # properties, previous builds and steps do not depend on each other, so
+    # fetch them all at once; the properties and steps of all builds are read
+    # with set-based queries.  Lists of indices stand in for whatever was not
+    # asked for, as we still need a list for the big zip
+    dl = []
     if wantProperties:
-        buildproperties = yield defer.gatherResults(
-            [master.data.get(("builds", build['buildid'], 'properties'))
-             for build in builds])
-    else:  # we still need a list for the big zip
-        buildproperties = lrange(len(builds))
+        d = master.db.builds.getBuildPropertiesForBuilds(buildids)
+        d.addCallback(lambda props: [props[buildid] for buildid in buildids])
+        dl.append(d)
+    else:
+        dl.append(defer.succeed(lrange(len(builds))))
 
     if wantPreviousBuild:
-        prev_builds = yield defer.gatherResults(
-            [getPreviousBuild(master, build) for build in builds])
-    else:  # we still need a list for the big zip
-        prev_builds = lrange(len(builds))
+        dl.append(defer.gatherResults(
+            [sem.run(getPreviousBuild, master, build) for build in builds]))
+    else:
+        dl.append(defer.succeed(lrange(len(builds))))
 
     if wantSteps:
-        buildsteps = yield defer.gatherResults(
-            [master.data.get(("builds", build['buildid'], 'steps'))
-             for build in builds])
-        if wantLogs:
-            for s in flatten(buildsteps, types=(list, UserList)):
-                s['logs'] = yield master.data.get(("steps", s['stepid'], 'logs'))
-                for l in s['logs']:
-                    l['content'] = yield master.data.get(("logs", l['logid'], 'contents'))
-
-    else:  # we still need a list for the big zip
-        buildsteps = lrange(len(builds))
+        dl.append(_getStepsForBuilds(master, buildids))
+    else:
+        dl.append(defer.succeed(lrange(len(builds))))
+
+    buildproperties, prev_builds, buildsteps = yield defer.gatherResults(dl)
+
+    if wantSteps and wantLogs:
+        # one query for the logs of every step, then the contents of every
+        # log, a few logs at a time
+        steps = flatten(buildsteps, types=(list, UserList))
+        logs = yield _getLogsForSteps(master, steps)
+        contents = yield defer.gatherResults(
+            [sem.run(master.data.get, ("logs", l['logid'], 'contents'))
+             for l in logs])
+        for l, content in zip(logs, contents):
+            l['content'] = content
 
     # a big zip to connect everything together
     for build, properties, steps, prev in zip(builds, buildproperties, buildsteps, prev_builds):
@@ -132,6 +166,34 @@ def getDetailsForBuilds(master, buildset, builds, wantProperties=False, wantStep
             build['prev_build'] = prev
 
 
+@defer.inlineCallbacks
+def _getStepsForBuilds(master, buildids):
+    # the data API serves steps one build at a time, so read them from the
+    # database and convert them as the steps endpoint would
+    ep, _ = master.data.getEndpoint(('steps', 0))
+    dbdicts = yield master.db.steps.getStepsForBuilds(buildids)
+    stepsbybuild = dict((buildid, []) for buildid in buildids)
+    for dbdict in dbdicts:
+        step = yield ep.db2data(dbdict)
+        stepsbybuild[step['buildid']].append(step)
+    defer.returnValue([stepsbybuild[buildid] for buildid in buildids])
+
+
+@defer.inlineCallbacks
+def _getLogsForSteps(master, steps):
+    # set each step's 'logs', and return all of the logs
+    ep, _ = master.data.getEndpoint(('logs', 0))
+    dbdicts = yield master.db.logs.getLogsForSteps(
+        [s['stepid'] for s in steps])
+    logsbystep = dict((s['stepid'], []) for s in steps)
+    for dbdict in dbdicts:
+        l = yield ep.db2data(dbdict)
+        logsbystep[l['stepid']].append(l)
+    for s in steps:
+        s['logs'] = logsbystep[s['stepid']]
+    defer.returnValue(flatten([s['logs'] for s in steps]))
+
+
 # perhaps we need data api for users with sourcestamps/:id/users
 @defer.inlineCallbacks
 def getResponsibleUsersForSourceStamp(master, sourcestampid):
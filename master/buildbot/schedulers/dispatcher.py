@@ -0,0 +1,121 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+import time
+
+from twisted.internet import defer
+from twisted.python import failure
+from twisted.python import log
+
+from buildbot.changes import changes
+from buildbot.changes.filter import ChangeFilterIndex
+from buildbot.process import metrics
+from buildbot.util import service
+
+
+class ChangeSubscription(object):
+
+    def __init__(self, dispatcher, callback, change_filter):
+        self.dispatcher = dispatcher
+        self.callback = callback
+        self.change_filter = change_filter
+        self.active = True
+
+    def stopConsuming(self):
+        self.dispatcher._removeSubscription(self)
+
+
+class ChangeDispatcher(service.AsyncService):
+
+    """
+    Hand new changes to the schedulers consuming them.
+
+    The dispatcher consumes ``('changes', None, 'new')`` messages once for
+    the whole master, loads each change from the database and builds its
+    L{Change} once, and then calls the subscribers whose change filters
+    accept it.  The filters of all subscribers are matched together by a
+    L{ChangeFilterIndex}.
+    """
+
+    name = "change_dispatcher"
+
+    def __init__(self):
+        self._filters = ChangeFilterIndex()
+        self._consumer = None
+        self._consumer_lock = defer.DeferredLock()
+
+    @defer.inlineCallbacks
+    def startConsuming(self, callback, change_filter=None):
+        """
+        Call C{callback} with each new L{Change} that C{change_filter}
+        accepts (or with every change, if it is None).
+
+        @returns: a subscription with a C{stopConsuming} method, via Deferred
+        """
+        sub = ChangeSubscription(self, callback, change_filter)
+        self._filters.add(sub, change_filter)
+        yield self._consumer_lock.run(self._updateConsumer)
+        defer.returnValue(sub)
+
+    def _removeSubscription(self, sub):
+        if not sub.active:
+            return
+        sub.active = False
+        self._filters.remove(sub)
+        d = self._consumer_lock.run(self._updateConsumer)
+        d.addErrback(log.err, 'while stopping change consumption')
+
+    def _updateConsumer(self):
+        if self._filters and not self._consumer:
+            d = self.master.mq.startConsuming(self._changeCallback,
+                                              ('changes', None, 'new'))
+
+            @d.addCallback
+            def setConsumer(consumer):
+                self._consumer = consumer
+            return d
+        if not self._filters and self._consumer:
+            self._consumer.stopConsuming()
+            self._consumer = None
+
+    @defer.inlineCallbacks
+    def _changeCallback(self, key, msg):
+        started = time.time()
+        # load the change once, for all of the schedulers
+        chdict = yield self.master.db.changes.getChange(msg['changeid'])
+        change = yield changes.Change.fromChdict(self.master, chdict)
+        loaded = time.time()
+
+        subs = self._filters.match(change)
+        filtered = time.time()
+        for sub in subs:
+            # an earlier callback may have stopped this subscription
+            if not sub.active:
+                continue
+            try:
+                sub.callback(change)
+            except Exception:
+                log.err(failure.Failure(),
+                        'while dispatching change %s' % (change.number,))
+        finished = time.time()
+
+        metrics.MetricHistogramEvent.log("ChangeDispatcher.load",
+                                         loaded - started)
+        metrics.MetricHistogramEvent.log("ChangeDispatcher.filter",
+                                         filtered - loaded)
+        metrics.MetricHistogramEvent.log("ChangeDispatcher.dispatch",
+                                         finished - filtered)
+        metrics.MetricCountEvent.log("ChangeDispatcher.delivered", len(subs))
+        metrics.MetricCountEvent.log("ChangeDispatcher.subscriptions",
+                                     len(self._filters), absolute=True)
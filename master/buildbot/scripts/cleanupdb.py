@@ -18,6 +18,9 @@ from __future__ import with_statement
 
 import os
 import sys
+import time
+
+import sqlalchemy as sa
 
 from twisted.internet import defer
 
@@ -28,6 +31,30 @@ from buildbot.scripts import base
 from buildbot.util import in_reactor
 
 
+# number of log ids fetched, compressed, and checkpointed at a time
+LOGS_BATCH_SIZE = 100
+
+
+def getLogIdsAfter(db, logid, limit):
+    def thd(conn):
+        tbl = db.model.logs
+        q = sa.select([tbl.c.id])
+        q = q.where(tbl.c.id > logid)
+        q = q.order_by(tbl.c.id)
+        q = q.limit(limit)
+        return [row.id for row in conn.execute(q)]
+    return db.pool.do(thd)
+
+
+def countLogsAfter(db, logid):
+    def thd(conn):
+        tbl = db.model.logs
+        q = sa.select([sa.func.count(tbl.c.id)])
+        q = q.where(tbl.c.id > logid)
+        return conn.execute(q).scalar()
+    return db.pool.do(thd)
+
+
 @defer.inlineCallbacks
 def doCleanupDatabase(config, master_cfg):
     if not config['quiet']:
@@ -38,19 +65,56 @@ def doCleanupDatabase(config, master_cfg):
     print(master.config.logCompressionMethod)
     db = master.db
     yield db.setup(check_version=False, verbose=not config['quiet'])
-    res = yield db.logs.getLogs()
+
+    jobs = config.get('jobs', 1)
+    if master_cfg.db['db_url'].startswith("sqlite") and jobs > 1:
+        # sqlite has a single writer anyway
+        if not config['quiet']:
+            print("sqlite does not support concurrent writes; using 1 job")
+        jobs = 1
+
+    # logs are compressed in order of their id, and the highest id below
+    # which all logs are compressed is kept in the state table, so that an
+    # interrupted run can be resumed.
+    objectid = yield db.state.getObjectId('cleanupdb',
+                                          'buildbot.scripts.cleanupdb')
+    last_logid = 0
+    if not config.get('no-resume'):
+        last_logid = yield db.state.getState(objectid, 'last_logid', 0)
+    if last_logid and not config['quiet']:
+        print("resuming after log %d" % (last_logid,))
+
+    total = yield countLogsAfter(db, last_logid)
+    sem = defer.DeferredSemaphore(jobs)
+    start_time = time.time()
+    start_bytes = db.logs.total_raw_bytes
     i = 0
     percent = 0
     saved = 0
-    for log in res:
-        saved += yield db.logs.compressLog(log['id'])
-        i += 1
-        if not config['quiet'] and percent != i * 100 / len(res):
-            percent = i * 100 / len(res)
-            print(" {0}%  {1} saved".format(percent, saved))
+    while True:
+        logids = yield getLogIdsAfter(db, last_logid, LOGS_BATCH_SIZE)
+        if not logids:
+            break
+        results = yield defer.gatherResults(
+            [sem.run(db.logs.compressLog, logid) for logid in logids],
+            consumeErrors=True)
+        saved += sum(results)
+        i += len(logids)
+        last_logid = logids[-1]
+        yield db.state.setState(objectid, 'last_logid', last_logid)
+
+        if not config['quiet'] and total and percent != i * 100 // total:
+            percent = i * 100 // total
+            elapsed = time.time() - start_time
+            mbytes = (db.logs.total_raw_bytes - start_bytes) / 1e6
+            print(" {0}%  {1} saved  {2:.2f} MB/s".format(
+                percent, saved, mbytes / elapsed if elapsed else 0))
             saved = 0
             sys.stdout.flush()
 
+    # the whole table has been processed, so the next run starts over
+    yield db.state.setState(objectid, 'last_logid', 0)
+
     if master_cfg.db['db_url'].startswith("sqlite"):
         if not config['quiet']:
             print("executing sqlite vacuum function...")
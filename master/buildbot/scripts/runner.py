@@ -662,10 +662,15 @@ class CleanupDBOptions(base.BasedirMixin, base.SubcommandOptions):
     subcommandFunction = "buildbot.scripts.cleanupdb.cleanupDatabase"
     optFlags = [
         ["quiet", "q", "Do not emit the commands being run"],
+        ["no-resume", None,
+         "Process all logs, even if a previous run was interrupted"],
         # when this command has several maintainance jobs, we should make
         # them optional here. For now there is only one.
     ]
     optParameters = [
+        ["jobs", "j", 4,
+         "Number of logs to compress concurrently (always 1 for sqlite)",
+         int],
     ]
 
     def getSynopsis(self):
@@ -678,7 +683,9 @@ class CleanupDBOptions(base.BasedirMixin, base.SubcommandOptions):
     This command is frontend for various database maintainance jobs:
 
     - optimiselogs: This optimization groups logs into bigger chunks
-      to apply higher level of compression.
+      to apply higher level of compression.  Logs are processed in order,
+      and an interrupted run resumes where it stopped unless --no-resume is
+      given.
 
     This command uses the database specified in
     the master configuration file.  If you wish to use a database other than
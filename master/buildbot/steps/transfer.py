@@ -51,10 +51,46 @@ class _TransferBuildStep(BuildStep):
 
     haltOnFailure = True
     flunkOnFailure = True
+    checksums = False
+    casdir = None
 
-    def __init__(self, workdir=None, **buildstep_kwargs):
+    def __init__(self, workdir=None, window=1, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.workdir = workdir
+        if not isinstance(window, int) or window < 1:
+            config.error('window must be a positive integer')
+        self.window = window
+
+    def workerCompression(self):
+        # workers older than 3.1 only know about gz and bz2
+        if self.compress == 'zlib' and self.workerVersionIsOlderThan('uploadDirectory', '3.1'):
+            return 'gz'
+        return self.compress
+
+    def useChecksums(self, command):
+        # workers older than 3.4 cannot checksum blocks or resume transfers
+        return (self.checksums and
+                not self.workerVersionIsOlderThan(command, '3.4'))
+
+    def useContentStore(self, command):
+        # workers older than 3.5 cannot send a manifest of their files
+        return (self.casdir is not None and
+                not self.workerVersionIsOlderThan(command, '3.5'))
+
+    def contentStoreWriter(self, masterdest, mode):
+        return remotetransfer.ContentStoreWriter(
+            masterdest, self.maxsize, mode, os.path.expanduser(self.casdir))
+
+    def checkContentStoreArgs(self):
+        # the hard links to a stored file share its timestamps
+        if self.casdir is not None and getattr(self, 'keepstamp', False):
+            config.error("'keepstamp' cannot be used with 'casdir'")
+
+    def addWindowArg(self, command, args):
+        # workers older than 3.1 wait for each block to be acknowledged
+        # before sending the next one, and do not know about 'window'
+        if self.window > 1 and not self.workerVersionIsOlderThan(command, '3.1'):
+            args['window'] = self.window
 
     def runTransferCommand(self, cmd, writer=None):
         # Run a transfer step, add a callback to extract the command status,
@@ -91,7 +127,7 @@ class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
 
     def __init__(self, workersrc=None, masterdest=None,
                  workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
-                 keepstamp=False, url=None,
+                 keepstamp=False, url=None, checksums=False, casdir=None,
                  slavesrc=None,  # deprecated, use `workersrc` instead
                  **buildstep_kwargs):
         # Deprecated API support.
@@ -119,6 +155,9 @@ class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
         self.mode = mode
         self.keepstamp = keepstamp
         self.url = url
+        self.checksums = checksums
+        self.casdir = casdir
+        self.checkContentStoreArgs()
 
     def start(self):
         self.checkWorkerHasCommand("uploadFile")
@@ -139,8 +178,16 @@ class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
                 os.path.basename(os.path.normpath(masterdest)), self.url)
 
         # we use maxsize to limit the amount of data on both sides
-        fileWriter = remotetransfer.FileWriter(
-            masterdest, self.maxsize, self.mode)
+        dedup = self.useContentStore('uploadFile')
+        checksums = self.useChecksums('uploadFile')
+        if dedup:
+            fileWriter = self.contentStoreWriter(masterdest, self.mode)
+        elif checksums:
+            fileWriter = remotetransfer.ResumableFileWriter(
+                masterdest, self.maxsize, self.mode)
+        else:
+            fileWriter = remotetransfer.FileWriter(
+                masterdest, self.maxsize, self.mode)
 
         if self.keepstamp and self.workerVersionIsOlderThan("uploadFile", "2.13"):
             m = ("This worker (%s) does not support preserving timestamps. "
@@ -161,6 +208,11 @@ class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workersrc'] = source
 
+        if dedup:
+            args['dedup'] = True
+        elif checksums:
+            args['checksums'] = True
+        self.addWindowArg('uploadFile', args)
         cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
         d = self.runTransferCommand(cmd, fileWriter)
         d.addCallback(self.finished).addErrback(self.failed)
@@ -174,7 +226,7 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
 
     def __init__(self, workersrc=None, masterdest=None,
                  workdir=None, maxsize=None, blocksize=16 * 1024,
-                 compress=None, url=None,
+                 compress=None, url=None, casdir=None,
                  slavesrc=None,  # deprecated, use `workersrc` instead
                  **buildstep_kwargs
                  ):
@@ -197,11 +249,12 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
         self.masterdest = masterdest
         self.maxsize = maxsize
         self.blocksize = blocksize
-        if compress not in (None, 'gz', 'bz2'):
+        if compress not in (None, 'gz', 'bz2', 'zlib'):
             config.error(
-                "'compress' must be one of None, 'gz', or 'bz2'")
+                "'compress' must be one of None, 'gz', 'bz2', or 'zlib'")
         self.compress = compress
         self.url = url
+        self.casdir = casdir
 
     def start(self):
         self.checkWorkerHasCommand("uploadDirectory")
@@ -222,8 +275,13 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
                 os.path.basename(os.path.normpath(masterdest)), self.url)
 
         # we use maxsize to limit the amount of data on both sides
-        dirWriter = remotetransfer.DirectoryWriter(
-            masterdest, self.maxsize, self.compress, 0o600)
+        compress = self.workerCompression()
+        dedup = self.useContentStore('uploadDirectory')
+        if dedup:
+            dirWriter = self.contentStoreWriter(masterdest, None)
+        else:
+            dirWriter = remotetransfer.DirectoryWriter(
+                masterdest, self.maxsize, compress, 0o600)
 
         # default arguments
         args = {
@@ -231,7 +289,7 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
             'writer': dirWriter,
             'maxsize': self.maxsize,
             'blocksize': self.blocksize,
-            'compress': self.compress
+            'compress': compress
         }
 
         if self.workerVersionIsOlderThan('uploadDirectory', '3.0'):
@@ -239,6 +297,9 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workersrc'] = source
 
+        if dedup:
+            args['dedup'] = True
+        self.addWindowArg('uploadDirectory', args)
         cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         d = self.runTransferCommand(cmd, dirWriter)
         d.addCallback(self.finished).addErrback(self.failed)
@@ -253,6 +314,7 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin):
     def __init__(self, workersrcs=None, masterdest=None,
                  workdir=None, maxsize=None, blocksize=16 * 1024,
                  mode=None, compress=None, keepstamp=False, url=None,
+                 casdir=None,
                  slavesrcs=None,  # deprecated, use `workersrcs` instead
                  **buildstep_kwargs):
         # Deprecated API support.
@@ -278,16 +340,22 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin):
             config.error(
                 'mode must be an integer or None')
         self.mode = mode
-        if compress not in (None, 'gz', 'bz2'):
+        if compress not in (None, 'gz', 'bz2', 'zlib'):
             config.error(
-                "'compress' must be one of None, 'gz', or 'bz2'")
+                "'compress' must be one of None, 'gz', 'bz2', or 'zlib'")
         self.compress = compress
         self.keepstamp = keepstamp
         self.url = url
+        self.casdir = casdir
+        self.checkContentStoreArgs()
 
     def uploadFile(self, source, masterdest):
-        fileWriter = remotetransfer.FileWriter(
-            masterdest, self.maxsize, self.mode)
+        dedup = self.useContentStore('uploadFile')
+        if dedup:
+            fileWriter = self.contentStoreWriter(masterdest, self.mode)
+        else:
+            fileWriter = remotetransfer.FileWriter(
+                masterdest, self.maxsize, self.mode)
 
         args = {
             'workdir': self.workdir,
@@ -302,19 +370,27 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workersrc'] = source
 
+        if dedup:
+            args['dedup'] = True
+        self.addWindowArg('uploadFile', args)
         cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
         return self.runTransferCommand(cmd, fileWriter)
 
     def uploadDirectory(self, source, masterdest):
-        dirWriter = remotetransfer.DirectoryWriter(
-            masterdest, self.maxsize, self.compress, 0o600)
+        compress = self.workerCompression()
+        dedup = self.useContentStore('uploadDirectory')
+        if dedup:
+            dirWriter = self.contentStoreWriter(masterdest, None)
+        else:
+            dirWriter = remotetransfer.DirectoryWriter(
+                masterdest, self.maxsize, compress, 0o600)
 
         args = {
             'workdir': self.workdir,
             'writer': dirWriter,
             'maxsize': self.maxsize,
             'blocksize': self.blocksize,
-            'compress': self.compress
+            'compress': compress
         }
 
         if self.workerVersionIsOlderThan('uploadDirectory', '3.0'):
@@ -322,6 +398,9 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workersrc'] = source
 
+        if dedup:
+            args['dedup'] = True
+        self.addWindowArg('uploadDirectory', args)
         cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         return self.runTransferCommand(cmd, dirWriter)
 
@@ -417,6 +496,7 @@ class FileDownload(_TransferBuildStep, WorkerAPICompatMixin):
 
     def __init__(self, mastersrc, workerdest=None,
                  workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
+                 checksums=False,
                  slavedest=None,  # deprecated, use `workerdest` instead
                  **buildstep_kwargs):
         # Deprecated API support.
@@ -442,6 +522,7 @@ class FileDownload(_TransferBuildStep, WorkerAPICompatMixin):
             config.error(
                 'mode must be an integer or None')
         self.mode = mode
+        self.checksums = checksums
 
     def start(self):
         self.checkWorkerHasCommand("downloadFile")
@@ -483,6 +564,9 @@ class FileDownload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workerdest'] = workerdest
 
+        if self.useChecksums('downloadFile'):
+            args['checksums'] = True
+        self.addWindowArg('downloadFile', args)
         cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
         d = self.runTransferCommand(cmd)
         d.addCallback(self.finished).addErrback(self.failed)
@@ -553,6 +637,7 @@ class StringDownload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workerdest'] = workerdest
 
+        self.addWindowArg('downloadFile', args)
         cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
         d = self.runTransferCommand(cmd)
         d.addCallback(self.finished).addErrback(self.failed)
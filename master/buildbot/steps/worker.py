@@ -178,13 +178,27 @@ class RemoveDirectory(WorkerBuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
-    def __init__(self, dir, **kwargs):
+    def __init__(self, dir, background=False, parallel=False, threads=None,
+                 **kwargs):
         buildstep.BuildStep.__init__(self, **kwargs)
         self.dir = dir
+        self.background = background
+        self.parallel = parallel
+        self.threads = threads
 
     def start(self):
         self.checkWorkerHasCommand('rmdir')
-        cmd = remotecommand.RemoteCommand('rmdir', {'dir': self.dir})
+        args = {'dir': self.dir}
+        # workers older than 3.3 always remove directories with 'rm -rf', one
+        # after the other
+        if not self.workerVersionIsOlderThan('rmdir', '3.3'):
+            if self.background:
+                args['background'] = True
+            if self.parallel:
+                args['parallel'] = True
+            if self.threads:
+                args['threads'] = self.threads
+        cmd = remotecommand.RemoteCommand('rmdir', args)
         d = self.runCommand(cmd)
         d.addCallback(lambda res: self.commandComplete(cmd))
         d.addErrback(self.failed)
@@ -0,0 +1,66 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+import time
+
+from buildbot.process import remotecommand
+from buildbot.test.util import benchmark
+from buildbot.util.accumulator import Accumulator
+
+
+class Holder(object):
+    stdout = ''
+
+
+class CollectStdoutBenchmark(benchmark.BenchmarkTestCase):
+
+    """
+    Capture a large command output the way collectStdout does.
+    """
+
+    SIZE = 100 * 1024 * 1024
+    CHUNK = 'x' * 4096 + '\n'
+
+    def capture(self, name, append, getvalue, size):
+        count = size // len(self.CHUNK)
+        start = time.time()
+        for _ in range(count):
+            append(self.CHUNK)
+        value = getvalue()
+        self.report(name, time.time() - start, count=count, size=size)
+        self.assertEqual(len(value), count * len(self.CHUNK))
+
+    def test_string_concatenation(self):
+        # the old approach is quadratic, so only feed it a tenth of the data
+        holder = Holder()
+
+        def append(data):
+            holder.stdout += data
+        self.capture("string concatenation (10MB)", append,
+                     lambda: holder.stdout, self.SIZE // 10)
+
+    def test_accumulator(self):
+        acc = Accumulator()
+        self.capture("Accumulator", acc.append, acc.getvalue, self.SIZE)
+
+    def test_accumulator_spill(self):
+        acc = Accumulator(spillSize=1024 * 1024)
+        self.capture("Accumulator, spilled to disk", acc.append,
+                     acc.getvalue, self.SIZE)
+        acc.close()
+
+    def test_remotecommand(self):
+        cmd = remotecommand.RemoteCommand('shell', {}, collectStdout=True)
+        self.capture("RemoteCommand.addStdout", cmd.addStdout,
+                     lambda: cmd.stdout, self.SIZE)
@@ -0,0 +1,82 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+import random
+
+from buildbot.changes import filter
+from buildbot.test.fake.change import Change
+from buildbot.test.util import benchmark
+
+
+class MatchBenchmark(benchmark.BenchmarkTestCase):
+
+    NUM_FILTERS = 1000
+    NUM_CHANGES = 1000
+
+    def setUp(self):
+        random.seed(0)
+        projects = ['project%d' % i for i in range(100)]
+        branches = ['master', 'develop'] + \
+            ['release-%d' % i for i in range(20)]
+
+        # a mix resembling a master with a scheduler or two per project
+        self.filters = []
+        for i in range(self.NUM_FILTERS):
+            project = random.choice(projects)
+            if i % 4 == 0:
+                cf = filter.ChangeFilter(project=project, branch='master')
+            elif i % 4 == 1:
+                cf = filter.ChangeFilter(project=project,
+                                         branch_re=r'release-\d+')
+            elif i % 4 == 2:
+                cf = filter.ChangeFilter(
+                    repository='https://vc/%s' % project,
+                    branch=['master', 'develop'])
+            else:
+                cf = filter.ChangeFilter(branch_re='release-%d$' % (i % 20),
+                                         category=['ci', None])
+            self.filters.append(cf)
+        self.index = filter.ChangeFilterIndex()
+        for i, cf in enumerate(self.filters):
+            self.index.add(i, cf)
+
+        self.changes = []
+        for _ in range(self.NUM_CHANGES):
+            project = random.choice(projects)
+            self.changes.append(Change(
+                project=project, repository='https://vc/%s' % project,
+                branch=random.choice(branches), category=None, codebase=''))
+
+    def test_filter_change(self):
+        # the previous approach, for comparison: each filter on its own
+        def matchAll():
+            for change in self.changes:
+                [i for i, cf in enumerate(self.filters)
+                 if cf.filter_change(change)]
+        self.timeit("ChangeFilter.filter_change x %d" % self.NUM_FILTERS,
+                    matchAll)
+
+    def test_index(self):
+        def matchAll():
+            for change in self.changes:
+                self.index.match(change)
+        self.timeit("ChangeFilterIndex.match (%d filters)" % self.NUM_FILTERS,
+                    matchAll)
+
+    def test_same_result(self):
+        for change in self.changes:
+            self.assertEqual(
+                self.index.match(change),
+                [i for i, cf in enumerate(self.filters)
+                 if cf.filter_change(change)])
@@ -0,0 +1,85 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+import time
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from buildbot.db import logs
+from buildbot.test.fake import fakedb
+from buildbot.test.util import benchmark
+from buildbot.test.util import connector_component
+
+
+class LogLinesBenchmark(benchmark.BenchmarkTestCase,
+                        connector_component.ConnectorComponentMixin):
+
+    NUM_LINES = 500000
+    PAGE_SIZE = 50
+    NUM_PAGES = 2000
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpConnectorComponent(
+            table_names=['logs', 'logchunks', 'steps', 'builds', 'builders',
+                         'masters', 'buildrequests', 'buildsets',
+                         'workers'])
+        self.db.logs = logs.LogsConnectorComponent(self.db)
+        yield self.insertTestData([
+            fakedb.Worker(id=47, name='linux'),
+            fakedb.Buildset(id=20),
+            fakedb.Builder(id=88, name='b1'),
+            fakedb.BuildRequest(id=41, buildsetid=20, builderid=88),
+            fakedb.Master(id=88),
+            fakedb.Build(id=30, buildrequestid=41, number=7, masterid=88,
+                         builderid=88, workerid=47),
+            fakedb.Step(id=101, buildid=30, number=1, name='one'),
+        ])
+
+    def tearDown(self):
+        return self.tearDownConnectorComponent()
+
+    @defer.inlineCallbacks
+    def benchmarkPaging(self, method):
+        self.db.master.config.logCompressionMethod = method
+        logid = yield self.db.logs.addLog(
+            stepid=101, name=u'stdio', slug=u'stdio', type=u's')
+        line = u'compiling src/some/fairly/long/path/to/a/file.c ...\n'
+        for _ in range(self.NUM_LINES // 10000):
+            yield self.db.logs.appendLog(logid, line * 10000)
+
+        # page through the log in a pseudo-random order, as several UI
+        # clients would
+        start = time.time()
+        for i in range(self.NUM_PAGES):
+            first = (i * 7919) % (self.NUM_LINES - self.PAGE_SIZE)
+            yield self.db.logs.getLogLines(logid, first,
+                                           first + self.PAGE_SIZE - 1)
+        self.report("getLogLines (%s)" % method, time.time() - start,
+                    count=self.NUM_PAGES)
+
+    def test_paging_raw(self):
+        return self.benchmarkPaging('raw')
+
+    def test_paging_gz(self):
+        return self.benchmarkPaging('gz')
+
+    def test_paging_lz4(self):
+        try:
+            import lz4
+            [lz4]
+        except ImportError:
+            raise unittest.SkipTest("lz4 not installed, skip the benchmark")
+        return self.benchmarkPaging('lz4')
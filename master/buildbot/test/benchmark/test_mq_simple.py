@@ -0,0 +1,68 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+import random
+
+from buildbot.mq import simple
+from buildbot.test.util import benchmark
+from buildbot.util import tuplematch
+
+
+class ProduceBenchmark(benchmark.BenchmarkTestCase):
+
+    NUM_SUBSCRIPTIONS = 10000
+    NUM_MESSAGES = 10000
+
+    def setUp(self):
+        random.seed(0)
+        self.mq = simple.SimpleMQ()
+        self.received = 0
+
+        # a mix resembling a busy master: per-build and per-log websocket
+        # subscriptions, plus a few wildcard consumers
+        self.filters = []
+        for i in range(self.NUM_SUBSCRIPTIONS):
+            buildid = str(i % 2000)
+            if i % 100 == 0:
+                self.filters.append(('builds', None, None))
+            elif i % 2:
+                self.filters.append(('builds', buildid, None))
+            else:
+                self.filters.append(('logs', str(i), 'append'))
+        for filter in self.filters:
+            self.mq.startConsuming(self.callback, filter)
+
+        self.messages = [('logs', str(random.randrange(self.NUM_SUBSCRIPTIONS)),
+                          'append')
+                         for _ in range(self.NUM_MESSAGES // 2)]
+        self.messages += [('builds', str(random.randrange(2000)), 'finished')
+                          for _ in range(self.NUM_MESSAGES // 2)]
+
+    def callback(self, routingKey, data):
+        self.received += 1
+
+    def test_produce(self):
+        def produceAll():
+            for routingKey in self.messages:
+                self.mq.produce(routingKey, None)
+        self.timeit("SimpleMQ.produce (trie)", produceAll)
+
+    def test_produce_linear(self):
+        # the previous implementation, for comparison
+        def produceAll():
+            for routingKey in self.messages:
+                for filter in self.filters:
+                    if tuplematch.matchTuple(routingKey, filter):
+                        self.callback(routingKey, None)
+        self.timeit("SimpleMQ.produce (linear scan)", produceAll)
@@ -0,0 +1,91 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+from twisted.internet import defer
+
+from buildbot.data import connector
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import benchmark
+from buildbot.util import pathmatch
+
+
+def linearMatch(patterns, path):
+    # the previous implementation, for comparison: try every pattern of the
+    # right length, parsing its elements on each lookup
+    for pattern, value in patterns:
+        if len(pattern) != len(path):
+            continue
+        kwargs = {}
+        for pattern_elt, path_elt in zip(pattern, path):
+            mo = pathmatch.Matcher.path_elt_re.match(pattern_elt)
+            if mo:
+                type_flag, arg_name = mo.groups()
+                if type_flag:
+                    try:
+                        path_elt = pathmatch.Matcher.type_fns[type_flag](
+                            path_elt)
+                    except Exception:
+                        break
+                kwargs[arg_name] = path_elt
+            elif pattern_elt != path_elt:
+                break
+        else:
+            return value, kwargs
+    raise KeyError(path)
+
+
+class MatchBenchmark(benchmark.BenchmarkTestCase):
+
+    ROUNDS = 200
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        master = fakemaster.make_master()
+        self.data = connector.DataConnector()
+        yield self.data.setServiceParent(master)
+
+        # one concrete path for every endpoint pattern of the data API
+        self.patterns = self.data.matcher.iterPatterns()
+        self.paths = []
+        for pattern, _ in self.patterns:
+            path = []
+            for elt in pattern:
+                if elt.startswith('n:'):
+                    path.append('17')
+                elif ':' in elt:
+                    path.append('name')
+                else:
+                    path.append(elt)
+            self.paths.append(tuple(path))
+
+    def test_matcher(self):
+        matcher = self.data.matcher
+
+        def lookupAll():
+            for path in self.paths:
+                matcher[path]
+        self.timeit("Matcher (trie), %d paths" % len(self.paths),
+                    lookupAll, count=self.ROUNDS)
+
+    def test_linear(self):
+        def lookupAll():
+            for path in self.paths:
+                linearMatch(self.patterns, path)
+        self.timeit("linear scan, %d paths" % len(self.paths),
+                    lookupAll, count=self.ROUNDS)
+
+    def test_same_result(self):
+        for path in self.paths:
+            self.assertEqual(self.data.matcher[path],
+                             linearMatch(self.patterns, path))
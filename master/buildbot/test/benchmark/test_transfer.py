@@ -0,0 +1,161 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+import os
+import shutil
+import tempfile
+import time
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
+
+from buildbot.process import remotetransfer
+from buildbot.test.util import benchmark
+
+try:
+    from buildbot_worker.commands import transfer
+    from buildbot_worker.test.fake.workerforbuilder import FakeWorkerForBuilder
+except ImportError:
+    transfer = None
+
+
+class LatentRemote(object):
+
+    """
+    Wrap a local master-side object to look like a remote reference on the
+    other end of a link with the given round trip time.  Answers come back
+    in the order the calls were made, as they would over a single
+    connection.
+    """
+
+    def __init__(self, original, rtt):
+        self.original = original
+        self.rtt = rtt
+
+    def callRemote(self, meth, *args, **kwargs):
+        d = defer.Deferred()
+        res = defer.maybeDeferred(
+            getattr(self.original, "remote_" + meth), *args, **kwargs)
+        res.addBoth(lambda r: reactor.callLater(self.rtt, d.callback, r))
+        return d
+
+
+class TransferBenchmark(benchmark.BenchmarkTestCase):
+
+    if transfer is None:
+        skip = "buildbot-worker is not installed"
+
+    SIZE = 2 * 1024 * 1024
+    BLOCKSIZE = 16 * 1024
+    RTT = 0.02
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.basedir, 'wkdir'))
+        self.source = os.path.join(self.basedir, 'wkdir', 'source')
+        with open(self.source, 'wb') as f:
+            f.write(os.urandom(self.SIZE))
+        self.dest = os.path.join(self.basedir, 'dest')
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    @defer.inlineCallbacks
+    def runCommand(self, cmdclass, args, name):
+        cmd = cmdclass(FakeWorkerForBuilder(basedir=self.basedir),
+                       'fake-stepid', args)
+        start = time.time()
+        yield cmd.doStart()
+        self.report("%s (window=%d, rtt=%dms)"
+                    % (name, args['window'], self.RTT * 1000),
+                    time.time() - start, size=self.SIZE)
+        with open(self.source, 'rb') as f1, open(self.dest, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def benchmarkUpload(self, window):
+        writer = remotetransfer.FileWriter(self.dest, None, None)
+        return self.runCommand(transfer.WorkerFileUploadCommand, dict(
+            workdir='wkdir', workersrc='source',
+            writer=LatentRemote(writer, self.RTT),
+            maxsize=None, blocksize=self.BLOCKSIZE, keepstamp=False,
+            window=window), "upload")
+
+    def benchmarkDownload(self, window):
+        reader = remotetransfer.FileReader(open(self.source, 'rb'))
+        return self.runCommand(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.', workerdest='dest',
+            reader=LatentRemote(reader, self.RTT),
+            maxsize=None, blocksize=self.BLOCKSIZE, mode=None,
+            window=window), "download")
+
+    def test_upload_window_1(self):
+        return self.benchmarkUpload(1)
+
+    def test_upload_window_16(self):
+        return self.benchmarkUpload(16)
+
+    def test_download_window_1(self):
+        return self.benchmarkDownload(1)
+
+    def test_download_window_16(self):
+        return self.benchmarkDownload(16)
+
+
+class ReactorLatencyBenchmark(benchmark.BenchmarkTestCase):
+
+    """
+    Measure how long the reactor goes without running anything else while a
+    large upload is written to disk on the master.
+    """
+
+    SIZE = 256 * 1024 * 1024
+    BLOCKSIZE = 64 * 1024
+    TICK = 0.01
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    @defer.inlineCallbacks
+    def test_upload(self):
+        lags = []
+        last = [time.time()]
+
+        def tick():
+            now = time.time()
+            lags.append(now - last[0] - self.TICK)
+            last[0] = now
+        ticker = task.LoopingCall(tick)
+        ticker.start(self.TICK)
+
+        writer = remotetransfer.FileWriter(
+            os.path.join(self.basedir, 'dest'), None, None)
+        block = os.urandom(self.BLOCKSIZE)
+        start = time.time()
+        for _ in range(self.SIZE // self.BLOCKSIZE):
+            # a worker waits when a write is not acknowledged right away
+            yield writer.remote_write(block)
+            # and the next block only arrives in a later reactor turn
+            yield task.deferLater(reactor, 0, lambda: None)
+        yield writer.remote_close()
+        elapsed = time.time() - start
+        ticker.stop()
+
+        self.report("FileWriter upload", elapsed, size=self.SIZE)
+        lags.sort()
+        self.report("reactor lag, median", lags[len(lags) // 2])
+        self.report("reactor lag, max", lags[-1])
@@ -56,6 +56,29 @@ class RawTestsEndpoint(base.Endpoint):
         })
 
 
+class FakeStream(object):
+
+    def __init__(self, parts):
+        self.parts = list(parts)
+
+    def getNext(self):
+        return defer.succeed(self.parts.pop(0) if self.parts else None)
+
+
+class RawStreamTestsEndpoint(base.Endpoint):
+    isCollection = False
+    isRaw = True
+    isStreamable = True
+    pathPatterns = "/rawstreamtest"
+
+    def getStream(self, resultSpec, kwargs):
+        return defer.succeed({
+            "filename": "test.txt",
+            "mime-type": "text/test",
+            'stream': FakeStream([u'val', u'ue'])
+        })
+
+
 class FailEndpoint(base.Endpoint):
     isCollection = False
     pathPatterns = "/test/fail"
@@ -82,7 +105,8 @@ class TestEndpoint(base.Endpoint):
 class Test(base.ResourceType):
     name = "test"
     plural = "tests"
-    endpoints = [TestsEndpoint, TestEndpoint, FailEndpoint, RawTestsEndpoint]
+    endpoints = [TestsEndpoint, TestEndpoint, FailEndpoint, RawTestsEndpoint,
+                 RawStreamTestsEndpoint]
 
     class EntityType(types.Entity):
         id = types.Integer()
@@ -331,7 +331,8 @@ class FakeUpdates(service.AsyncService):
 
     @defer.inlineCallbacks
     def setBuildProperties(self, buildid, properties):
-        for k, v, s in properties.getProperties().asList():
+        dirty = properties.getProperties().takeDirtyProperties()
+        for k, (v, s) in sorted(iteritems(dirty)):
             self.properties.append((buildid, k, v, s))
             yield self.setBuildProperty(buildid, k, v, s)
 
@@ -342,6 +343,15 @@ class FakeUpdates(service.AsyncService):
                               validation.IdentifierValidator(50))
         return defer.succeed((10, 1, name))
 
+    def addSteps(self, buildid, names):
+        validation.verifyType(self.testcase, 'buildid', buildid,
+                              validation.IntValidator())
+        for name in names:
+            validation.verifyType(self.testcase, 'name', name,
+                                  validation.IdentifierValidator(50))
+        return defer.succeed([(10 + i, 1 + i, name)
+                              for i, name in enumerate(names)])
+
     def addStepURL(self, stepid, name, url):
         validation.verifyType(self.testcase, 'stepid', stepid,
                               validation.IntValidator())
@@ -876,8 +876,10 @@ class FakeChangesComponent(FakeDBComponent):
         chdicts = [self._chdict(self.changes[id]) for id in ids[-count:]]
         return defer.succeed(chdicts)
 
-    def getChanges(self):
+    def getChanges(self, resultSpec=None):
         chdicts = [self._chdict(v) for v in itervalues(self.changes)]
+        if resultSpec is not None:
+            chdicts = self.applyResultSpec(chdicts, resultSpec)
         return defer.succeed(chdicts)
 
     def getChangesCount(self):
@@ -1913,11 +1915,26 @@ class FakeBuildsComponent(FakeDBComponent):
         else:
             return defer.succeed({})
 
+    def getBuildPropertiesForBuilds(self, bids):
+        return defer.succeed(dict(
+            (bid, self.builds[bid]['properties'].copy()
+             if bid in self.builds else {})
+            for bid in bids))
+
     def setBuildProperty(self, bid, name, value, source):
         assert bid in self.builds
         self.builds[bid]['properties'][name] = (value, source)
         return defer.succeed(None)
 
+    def setBuildProperties(self, bid, properties):
+        assert bid in self.builds
+        props = self.builds[bid]['properties']
+        changed = {}
+        for name, (value, source) in iteritems(properties):
+            if props.get(name) != (value, source):
+                props[name] = changed[name] = (value, source)
+        return defer.succeed(changed)
+
 
 class FakeStepsComponent(FakeDBComponent):
 
@@ -1969,7 +1986,7 @@ class FakeStepsComponent(FakeDBComponent):
                 return defer.succeed(self._row2dict(row))
             return defer.succeed(None)
 
-    def getSteps(self, buildid):
+    def getSteps(self, buildid, resultSpec=None):
         ret = []
 
         for row in self.steps.itervalues():
@@ -1978,6 +1995,15 @@ class FakeStepsComponent(FakeDBComponent):
             ret.append(self._row2dict(row))
 
         ret.sort(key=lambda r: r['number'])
+        if resultSpec is not None:
+            ret = self.applyResultSpec(ret, resultSpec)
+        return defer.succeed(ret)
+
+    def getStepsForBuilds(self, buildids):
+        buildids = set(buildids)
+        ret = [self._row2dict(row) for row in itervalues(self.steps)
+               if row['buildid'] in buildids]
+        ret.sort(key=lambda r: (r['buildid'], r['number']))
         return defer.succeed(ret)
 
     def addStep(self, buildid, name, state_string, _reactor=reactor):
@@ -2014,6 +2040,13 @@ class FakeStepsComponent(FakeDBComponent):
 
         return defer.succeed((id, number, name))
 
+    @defer.inlineCallbacks
+    def addSteps(self, buildid, names, state_string):
+        added = []
+        for name in names:
+            added.append((yield self.addStep(buildid, name, state_string)))
+        defer.returnValue(added)
+
     def startStep(self, stepid, _reactor=reactor):
         b = self.steps.get(stepid)
         if b:
@@ -2110,6 +2143,13 @@ class FakeLogsComponent(FakeDBComponent):
             for row in itervalues(self.logs)
             if row['stepid'] == stepid])
 
+    def getLogsForSteps(self, stepids):
+        stepids = set(stepids)
+        ret = [self._row2dict(row) for row in itervalues(self.logs)
+               if row['stepid'] in stepids]
+        ret.sort(key=lambda r: (r['stepid'], r['id']))
+        return defer.succeed(ret)
+
     def getLogLines(self, logid, first_line, last_line):
         if logid not in self.logs or first_line > last_line:
             return defer.succeed('')
@@ -2117,6 +2157,16 @@ class FakeLogsComponent(FakeDBComponent):
         rv = lines[first_line:last_line + 1]
         return defer.succeed(u'\n'.join(rv) + u'\n' if rv else u'')
 
+    def getLogLinesBatch(self, logid, first_line, max_chunks):
+        # the fake stores lines rather than chunks, so each line counts as
+        # a chunk
+        lines = self.log_lines.get(logid, [])
+        rv = lines[first_line:first_line + max_chunks]
+        if not rv:
+            return defer.succeed((u'', None))
+        return defer.succeed((u'\n'.join(rv) + u'\n',
+                              first_line + len(rv) - 1))
+
     def addLog(self, stepid, name, slug, type):
         id = self._newId()
         self.logs[id] = dict(id=id, stepid=stepid,
@@ -23,6 +23,7 @@ from zope.interface import implementer
 
 from buildbot import config
 from buildbot import interfaces
+from buildbot.schedulers.dispatcher import ChangeDispatcher
 from buildbot.status import build
 from buildbot.test.fake import bworkermanager
 from buildbot.test.fake import fakedata
@@ -179,6 +180,8 @@ class FakeMaster(service.MasterService):
         self.masterid = master_id
         self.workers = bworkermanager.FakeWorkerManager()
         self.workers.setServiceParent(self)
+        self.change_dispatcher = ChangeDispatcher()
+        self.change_dispatcher.setServiceParent(self)
         self.log_rotation = FakeLogRotation()
         self.db = mock.Mock()
         self.next_objectid = 0
@@ -33,11 +33,14 @@ class ChangeFilter(unittest.TestCase):
     def setfilter(self, **kwargs):
         self.filt = filter.ChangeFilter(**kwargs)
 
+    def matches(self, change):
+        return self.filt.filter_change(change)
+
     def yes(self, change, msg):
-        self.results.append((self.filt.filter_change(change), True, msg))
+        self.results.append((self.matches(change), True, msg))
 
     def no(self, change, msg):
-        self.results.append((self.filt.filter_change(change), False, msg))
+        self.results.append((self.matches(change), False, msg))
 
     def check(self):
         errs = []
@@ -141,3 +144,74 @@ class ChangeFilter(unittest.TestCase):
             Change(properties={'event.type': 'patch-uploaded'}), "non matching property")
         self.no(Change(properties={}), "no property")
         self.check()
+
+
+class ChangeFilterIndex(ChangeFilter):
+
+    # run all of the ChangeFilter tests through an index, among other filters
+
+    def matches(self, change):
+        index = filter.ChangeFilterIndex()
+        index.add('before', filter.ChangeFilter(branch='nomatch'))
+        index.add('filt', self.filt)
+        index.add('after', filter.ChangeFilter(project_re='nomatch'))
+        return 'filt' in index.match(change)
+
+    def test_match_order(self):
+        index = filter.ChangeFilterIndex()
+        index.add('c', filter.ChangeFilter(branch_re='ma'))
+        index.add('a', None)
+        index.add('b', filter.ChangeFilter(branch=['master', 'dev']))
+        index.add('d', filter.ChangeFilter(branch='dev'))
+        self.assertEqual(index.match(Change(branch='master')), ['c', 'a', 'b'])
+        index.remove('a')
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.match(Change(branch='master')), ['c', 'b'])
+        self.assertEqual(index.match(Change(branch='dev')), ['b', 'd'])
+
+    def test_match_patterns(self):
+        index = filter.ChangeFilterIndex()
+        index.add('rel', filter.ChangeFilter(branch_re='rel-'))
+        index.add('rel2', filter.ChangeFilter(branch_re='rel-'))
+        index.add('backref', filter.ChangeFilter(branch_re=r'(.)\1'))
+        index.add('named', filter.ChangeFilter(branch_re='(?P<a>x)'))
+        index.add('flags', filter.ChangeFilter(
+            branch_re=re.compile('REL', re.I)))
+        self.assertEqual(index.match(Change(branch='rel-1')),
+                         ['rel', 'rel2', 'flags'])
+        # the outcome is remembered, so ask again
+        self.assertEqual(index.match(Change(branch='rel-1')),
+                         ['rel', 'rel2', 'flags'])
+        self.assertEqual(index.match(Change(branch='aab')), ['backref'])
+        self.assertEqual(index.match(Change(branch='xy')), ['named'])
+        self.assertEqual(index.match(Change(branch=None)), [])
+
+    def test_match_callables_only_for_candidates(self):
+        calls = []
+
+        def fn(branch):
+            calls.append(branch)
+            return True
+        index = filter.ChangeFilterIndex()
+        index.add('a', filter.ChangeFilter(project='p', branch_fn=fn))
+        self.assertEqual(index.match(Change(project='q', branch='b')), [])
+        self.assertEqual(calls, [])
+        self.assertEqual(index.match(Change(project='p', branch='b')), ['a'])
+        self.assertEqual(calls, ['b'])
+
+    def test_match_exception(self):
+        index = filter.ChangeFilterIndex()
+        index.add('a', filter.ChangeFilter(filter_fn=lambda c: 1 / 0))
+        index.add('b', filter.ChangeFilter())
+        self.assertEqual(index.match(Change()), ['b'])
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+
+    def test_match_subclass(self):
+        class MyFilter(filter.ChangeFilter):
+
+            def filter_change(self, change):
+                return change.branch == 'mine'
+        index = filter.ChangeFilterIndex()
+        index.add('a', MyFilter(branch='other'))
+        self.assertEqual(index.match(Change(branch='mine')), ['a'])
+        self.assertEqual(index.match(Change(branch='other')), [])
@@ -636,6 +636,19 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                          dict(db=dict(db_url='abcd', db_poll_interval=10)))
         self.assertResults(db=dict(db_url='abcd'))
 
+    def test_load_db_pool_sizes(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', pool_size=8,
+                                      bulk_pool_size=0)))
+        self.assertResults(db=dict(db_url='abcd', pool_size=8,
+                                   bulk_pool_size=0))
+
+    def test_load_db_pool_size_invalid(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', pool_size=0)))
+        self.assertConfigError(self.errors,
+                               "c['db']['pool_size'] must be an integer")
+
     def test_load_db_unk_keys(self):
         self.cfg.load_db(self.filename,
                          dict(db=dict(db_url='abcd', db_poll_interval=10, bar='bar')))
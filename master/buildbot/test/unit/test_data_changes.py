@@ -95,12 +95,17 @@ class ChangesEndpoint(endpoint.EndpointMixin, unittest.TestCase):
 
     @defer.inlineCallbacks
     def test_getRecentChanges(self):
+        getRecentChanges = mock.Mock(
+            wraps=self.master.db.changes.getRecentChanges)
+        self.patch(self.master.db.changes, 'getRecentChanges',
+                   getRecentChanges)
         resultSpec = resultspec.ResultSpec(limit=1, order=['-changeid'])
         changes = yield self.callGet(('changes',), resultSpec=resultSpec)
 
         self.validateData(changes[0])
         self.assertEqual(changes[0]['changeid'], 14)
         self.assertEqual(len(changes), 1)
+        getRecentChanges.assert_called_once_with(1)
 
     @defer.inlineCallbacks
     def test_getChangesOtherOrder(self):
@@ -116,8 +121,9 @@ class ChangesEndpoint(endpoint.EndpointMixin, unittest.TestCase):
             limit=1, offset=1, order=['-changeid'])
         changes = yield self.callGet(('changes',), resultSpec=resultSpec)
 
-        # limit not implemented for other offset
-        self.assertEqual(len(changes), 2)
+        self.validateData(changes[0])
+        self.assertEqual(changes[0]['changeid'], 13)
+        self.assertEqual(len(changes), 1)
 
 
 class Change(interfaces.InterfaceTests, unittest.TestCase):
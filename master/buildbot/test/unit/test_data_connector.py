@@ -25,6 +25,7 @@ from buildbot.data import connector
 from buildbot.data import exceptions
 from buildbot.data import resultspec
 from buildbot.data import types
+from buildbot.process import metrics
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import interfaces
 
@@ -209,6 +210,20 @@ class DataConnector(unittest.TestCase):
             ep.get.assert_called_once_with(mock.ANY, {})
         return d
 
+    @defer.inlineCallbacks
+    def test_get_counts_python_fallback(self):
+        ep = self.patchFooListPattern()
+        ep.isCollection = True
+        countEvent = mock.Mock()
+        self.patch(metrics, 'MetricCountEvent', countEvent)
+
+        yield self.data.get(('foo',))
+        self.assertFalse(countEvent.log.called)
+
+        yield self.data.get(('foo',), order=['-val'], limit=2)
+        countEvent.log.assert_called_once_with(
+            "DataConnector.resultspec-fallback.FoosEndpoint")
+
     def test_control(self):
         ep = self.patchFooPattern()
         ep.control = mock.Mock(name='MyEndpoint.control')
@@ -200,3 +200,16 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
 
         self.assertEqual(logchunk,
                          {'filename': expFilename, 'mime-type': u"text/plain", 'raw': expContent})
+
+        # and batch by batch, as the REST API streams it
+        self.patch(logchunks.RawLogStream, 'BATCH_CHUNKS', 3)
+        ep, kwargs = self.matcher[path]
+        data = yield ep.getStream(resultspec.ResultSpec(), kwargs)
+        parts = []
+        while True:
+            part = yield data['stream'].getNext()
+            if part is None:
+                break
+            parts.append(part)
+        self.assertTrue(len(parts) > 1)
+        self.assertEqual(u''.join(parts), expContent)
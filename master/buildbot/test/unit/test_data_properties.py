@@ -128,32 +128,46 @@ class Properties(interfaces.InterfaceTests, unittest.TestCase):
             fakedb.Build(id=1234, buildrequestid=5, masterid=3, workerid=42),
         ])
 
-        self.master.db.builds.setBuildProperty = mock.Mock(
-            wraps=self.master.db.builds.setBuildProperty)
+        self.master.db.builds.setBuildProperties = mock.Mock(
+            wraps=self.master.db.builds.setBuildProperties)
         props = processProperties.fromDict(
             dict(a=(1, 't'), b=(['abc', 9], 't')))
         yield self.rtype.setBuildProperties(1234, props)
-        self.master.db.builds.setBuildProperty.assert_has_calls([
-            mock.call(1234, u'a', 1, u't'),
-            mock.call(1234, u'b', ['abc', 9], u't')])
+        self.master.db.builds.setBuildProperties.assert_called_once_with(
+            1234, {u'a': (1, u't'), u'b': (['abc', 9], u't')})
         self.master.mq.assertProductions([
             (('builds', '1234', 'properties', 'update'),
              {u'a': (1, u't'), u'b': (['abc', 9], u't')}),
         ])
         # sync without changes: no db write
-        self.master.db.builds.setBuildProperty.reset_mock()
+        self.master.db.builds.setBuildProperties.reset_mock()
         self.master.mq.clearProductions()
         yield self.rtype.setBuildProperties(1234, props)
-        self.master.db.builds.setBuildProperty.assert_not_called()
+        self.master.db.builds.setBuildProperties.assert_not_called()
         self.master.mq.assertProductions([])
 
         # sync with one changes: one db write
         props.setProperty('b', 2, 'step')
-        self.master.db.builds.setBuildProperty.reset_mock()
         yield self.rtype.setBuildProperties(1234, props)
 
-        self.master.db.builds.setBuildProperty.assert_called_with(
-            1234, u'b', 2, u'step')
+        self.master.db.builds.setBuildProperties.assert_called_once_with(
+            1234, {u'b': (2, u'step')})
         self.master.mq.assertProductions([
             (('builds', '1234', 'properties', 'update'), {u'b': (2, u'step')})
         ])
+
+        # setting a property to the value it has: no update event
+        props.setProperty('a', 1, 't')
+        self.master.mq.clearProductions()
+        yield self.rtype.setBuildProperties(1234, props)
+        self.master.mq.assertProductions([])
+
+    @defer.inlineCallbacks
+    def test_setBuildProperties_failure(self):
+        self.master.db.builds.setBuildProperties = mock.Mock(
+            return_value=defer.fail(RuntimeError('db down')))
+        props = processProperties.fromDict(dict(a=(1, 't')))
+        yield self.assertFailure(self.rtype.setBuildProperties(1234, props),
+                                 RuntimeError)
+        # the properties are written by the next flush
+        self.assertEqual(props.dirty, set([u'a']))
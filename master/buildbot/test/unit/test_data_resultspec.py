@@ -138,6 +138,22 @@ class ResultSpec(unittest.TestCase):
             resultspec.ResultSpec(order=['-ln', '-fn']).apply(data),
             exp)
 
+    def test_apply_ordering_mixed(self):
+        data = mklist(('fn', 'ln'),
+                      ('cedric', 'willis'),
+                      ('albert', 'engelbert'),
+                      ('bruce', 'willis'),
+                      ('dwayne', 'montague'))
+        exp = base.ListResult(mklist(('fn', 'ln'),
+                                     ('albert', 'engelbert'),
+                                     ('dwayne', 'montague'),
+                                     ('cedric', 'willis'),
+                                     ('bruce', 'willis')), total=4)
+        random.shuffle(data)
+        self.assertListResultEqual(
+            resultspec.ResultSpec(order=['ln', '-fn']).apply(data),
+            exp)
+
     def test_apply_filter(self):
         data = mklist('name', 'albert', 'bruce', 'cedric', 'dwayne')
         f = resultspec.Filter(field='name', op='gt', values=['bruce'])
@@ -230,6 +246,20 @@ class ResultSpec(unittest.TestCase):
         self.assertRaises(AssertionError, lambda:
                           resultspec.ResultSpec(filters=[f]).apply(data))
 
+    def test_apply_fields_prepaginated(self):
+        data = base.ListResult(mklist(('x', 'y'), (1, 2), (3, 4)),
+                               offset=2, total=10, limit=2)
+        self.assertListResultEqual(
+            resultspec.ResultSpec(fields=['x']).apply(data),
+            base.ListResult(mklist('x', 1, 3), offset=2, total=10, limit=2))
+
+    def test_isFullyApplied(self):
+        self.assertTrue(resultspec.ResultSpec(fields=['x']).isFullyApplied())
+        self.assertFalse(resultspec.ResultSpec(order=['x']).isFullyApplied())
+        self.assertFalse(resultspec.ResultSpec(limit=1).isFullyApplied())
+        self.assertFalse(resultspec.ResultSpec(
+            filters=[resultspec.Filter('x', 'eq', [1])]).isFullyApplied())
+
     def test_popProperties(self):
         expected = ['prop1', 'prop2']
         rs = resultspec.ResultSpec(properties=[
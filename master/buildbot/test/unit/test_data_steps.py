@@ -195,6 +195,28 @@ class Step(interfaces.InterfaceTests, unittest.TestCase):
             'hidden': False,
         })
 
+    def test_signature_addSteps(self):
+        @self.assertArgSpecMatches(
+            self.master.data.updates.addSteps,  # fake
+            self.rtype.addSteps)  # real
+        def addSteps(self, buildid, names):
+            pass
+
+    @defer.inlineCallbacks
+    def test_addSteps(self):
+        added = yield self.rtype.addSteps(buildid=10,
+                                          names=[u'name', u'name'])
+        self.assertEqual([(number, name) for _, number, name in added],
+                         [(0, u'name'), (1, u'name_1')])
+        productions = [(key, msg['name'])
+                       for key, msg in self.master.mq.productions]
+        self.master.mq.clearProductions()
+        self.assertEqual(sorted(productions), sorted(
+            [(('builds', '10', 'steps', str(stepid), 'new'), name)
+             for stepid, _, name in added] +
+            [(('steps', str(stepid), 'new'), name)
+             for stepid, _, name in added]))
+
     @defer.inlineCallbacks
     def test_fake_newStep(self):
         self.assertEqual(
@@ -120,11 +120,21 @@ class Tests(interfaces.InterfaceTests):
         def getBuildProperties(self, bid):
             pass
 
+    def test_signature_getBuildPropertiesForBuilds(self):
+        @self.assertArgSpecMatches(self.db.builds.getBuildPropertiesForBuilds)
+        def getBuildPropertiesForBuilds(self, bids):
+            pass
+
     def test_signature_setBuildProperty(self):
         @self.assertArgSpecMatches(self.db.builds.setBuildProperty)
         def setBuildProperty(self, bid, name, value, source):
             pass
 
+    def test_signature_setBuildProperties(self):
+        @self.assertArgSpecMatches(self.db.builds.setBuildProperties)
+        def setBuildProperties(self, bid, properties):
+            pass
+
     # method tests
 
     @defer.inlineCallbacks
@@ -293,6 +303,53 @@ class Tests(interfaces.InterfaceTests):
         props = yield self.db.builds.getBuildProperties(50)
         self.assertEqual(props, {'prop': (45, 'test_source')})
 
+    @defer.inlineCallbacks
+    def testsetBuildProperties(self):
+        yield self.insertTestData(self.backgroundData + self.threeBuilds)
+        changed = yield self.db.builds.setBuildProperties(
+            50, {u'a': (1, u'test'), u'b': ([2, u'x'], u'test')})
+        self.assertEqual(changed, {u'a': (1, u'test'),
+                                   u'b': ([2, u'x'], u'test')})
+        props = yield self.db.builds.getBuildProperties(50)
+        self.assertEqual(props, {u'a': (1, u'test'),
+                                 u'b': ([2, u'x'], u'test')})
+
+        # only the new and changed properties are written, and returned
+        changed = yield self.db.builds.setBuildProperties(
+            50, {u'a': (1, u'test'), u'b': (3, u'test'),
+                 u'c': (4, u'other')})
+        self.assertEqual(changed, {u'b': (3, u'test'), u'c': (4, u'other')})
+        props = yield self.db.builds.getBuildProperties(50)
+        self.assertEqual(props, {u'a': (1, u'test'), u'b': (3, u'test'),
+                                 u'c': (4, u'other')})
+        # other builds are not affected
+        props = yield self.db.builds.getBuildProperties(51)
+        self.assertEqual(props, {})
+
+    @defer.inlineCallbacks
+    def testgetBuildPropertiesForBuilds(self):
+        yield self.insertTestData(self.backgroundData + self.threeBuilds)
+        yield self.db.builds.setBuildProperties(
+            50, {u'a': (1, u'test'), u'b': ([2, u'x'], u'test')})
+        yield self.db.builds.setBuildProperty(52, u'a', 3, u'other')
+        props = yield self.db.builds.getBuildPropertiesForBuilds([50, 51, 52])
+        self.assertEqual(props, {
+            50: {u'a': (1, u'test'), u'b': ([2, u'x'], u'test')},
+            51: {},
+            52: {u'a': (3, u'other')},
+        })
+
+    @defer.inlineCallbacks
+    def testsetBuildPropertiesMany(self):
+        yield self.insertTestData(self.backgroundData + self.threeBuilds)
+        props = dict((u'p%d' % i, (i, u'test')) for i in range(300))
+        yield self.db.builds.setBuildProperties(50, props)
+        props[u'p299'] = (u'changed', u'test')
+        changed = yield self.db.builds.setBuildProperties(50, props)
+        self.assertEqual(changed, {u'p299': (u'changed', u'test')})
+        got = yield self.db.builds.getBuildProperties(50)
+        self.assertEqual(got, props)
+
 
 class RealTests(Tests):
 
@@ -21,6 +21,7 @@ from twisted.internet import defer
 from twisted.internet import task
 from twisted.trial import unittest
 
+from buildbot.data import resultspec
 from buildbot.db import builds
 from buildbot.db import changes
 from buildbot.db import sourcestamps
@@ -283,7 +284,7 @@ class Tests(interfaces.InterfaceTests):
 
     def test_signature_getChanges(self):
         @self.assertArgSpecMatches(self.db.changes.getChanges)
-        def getChanges(self):
+        def getChanges(self, resultSpec=None):
             pass
 
     def insert7Changes(self):
@@ -366,6 +367,18 @@ class Tests(interfaces.InterfaceTests):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_getChanges_resultSpec(self):
+        yield self.insertTestData(self.change13_rows + self.change14_rows)
+        rs = resultspec.ResultSpec(
+            filters=[resultspec.Filter('author', 'eq', [u'warner'])],
+            order=['-changeid'], limit=1)
+        rs.fieldMapping = {'changeid': 'changes.changeid',
+                           'author': 'changes.author'}
+        changes = yield self.db.changes.getChanges(resultSpec=rs)
+        self.assertEqual([c['changeid'] for c in changes], [14])
+        self.assertEqual(changes[0]['author'], u'warner')
+
     def test_signature_getLatestChangeid(self):
         @self.assertArgSpecMatches(self.db.changes.getLatestChangeid)
         def getLatestChangeid(self):
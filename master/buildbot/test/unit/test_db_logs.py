@@ -21,6 +21,7 @@ from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot.db import logs
+from buildbot.process import cache
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import connector_component
@@ -108,11 +109,21 @@ class Tests(interfaces.InterfaceTests):
         def getLogs(self, stepid=None):
             pass
 
+    def test_signature_getLogsForSteps(self):
+        @self.assertArgSpecMatches(self.db.logs.getLogsForSteps)
+        def getLogsForSteps(self, stepids):
+            pass
+
     def test_signature_getLogLines(self):
         @self.assertArgSpecMatches(self.db.logs.getLogLines)
         def getLogLines(self, logid, first_line, last_line):
             pass
 
+    def test_signature_getLogLinesBatch(self):
+        @self.assertArgSpecMatches(self.db.logs.getLogLinesBatch)
+        def getLogLinesBatch(self, logid, first_line, max_chunks):
+            pass
+
     def test_signature_addLog(self):
         @self.assertArgSpecMatches(self.db.logs.addLog)
         def addLog(self, stepid, name, slug, type):
@@ -194,6 +205,25 @@ class Tests(interfaces.InterfaceTests):
             validation.verifyDbDict(self, 'logdict', logdict)
         self.assertEqual(sorted([ld['id'] for ld in logdicts]), [201, 202])
 
+    @defer.inlineCallbacks
+    def test_getLogsForSteps(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.Step(id=103, buildid=30, number=3, name='three'),
+            fakedb.Log(id=201, stepid=102, name=u'stdio', slug=u'stdio',
+                       complete=0, num_lines=200, type=u's'),
+            fakedb.Log(id=202, stepid=101, name=u'dbg.log', slug=u'dbg_log',
+                       complete=1, num_lines=300, type=u't'),
+            fakedb.Log(id=203, stepid=101, name=u'stdio', slug=u'stdio',
+                       complete=0, num_lines=200, type=u's'),
+            fakedb.Log(id=204, stepid=103, name=u'stdio', slug=u'stdio',
+                       complete=0, num_lines=200, type=u's'),
+        ])
+        logdicts = yield self.db.logs.getLogsForSteps([102, 101])
+        for logdict in logdicts:
+            validation.verifyDbDict(self, 'logdict', logdict)
+        self.assertEqual([(ld['stepid'], ld['id']) for ld in logdicts],
+                         [(101, 202), (101, 203), (102, 201)])
+
     @defer.inlineCallbacks
     def test_getLogLines(self):
         yield self.insertTestData(self.backgroundData + self.testLogLines)
@@ -202,6 +232,25 @@ class Tests(interfaces.InterfaceTests):
         # check line number reversal
         self.assertEqual((yield self.db.logs.getLogLines(201, 6, 3)), '')
 
+    @defer.inlineCallbacks
+    def test_getLogLinesBatch(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        expLines = ['line zero', 'line 1' + "x" * 200, 'line TWO', '',
+                    'line 2**2', 'another line', 'yet another line']
+        for first_line in range(0, 7):
+            got, next_line = [], first_line
+            while True:
+                lines, last_line = yield self.db.logs.getLogLinesBatch(
+                    201, next_line, 2)
+                if last_line is None:
+                    self.assertEqual(lines, '')
+                    break
+                self.assertTrue(last_line >= next_line)
+                got.append(lines)
+                next_line = last_line + 1
+            self.assertEqual(''.join(got),
+                             '\n'.join(expLines[first_line:] + ['']))
+
     @defer.inlineCallbacks
     def test_getLogLines_empty(self):
         yield self.insertTestData(self.backgroundData + [
@@ -320,6 +369,48 @@ class RealTests(Tests):
             'content': 'abc\ndef\nghi\njkl',
             'compressed': 0})
 
+    @defer.inlineCallbacks
+    def test_appendLog_batched(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        logid = yield self.db.logs.addLog(
+            stepid=102, name=u'another', slug=u'another', type=u's')
+        batches = []
+        thdAppendLogs = self.db.logs.thdAppendLogs
+
+        def countBatches(conn, appends):
+            batches.append(len(appends))
+            return thdAppendLogs(conn, appends)
+        self.patch(self.db.logs, 'thdAppendLogs', countBatches)
+
+        # all of these are made before the first batch is written
+        results = yield defer.gatherResults([
+            self.db.logs.appendLog(201, u'abc\n'),
+            self.db.logs.appendLog(logid, u'xyz\n'),
+            self.db.logs.appendLog(201, u'def\nghi\n'),
+            self.db.logs.appendLog(999, u'missing\n'),
+            self.db.logs.appendLog(logid, u'XYZ\n'),
+        ])
+        self.assertEqual(results, [(7, 7), (0, 0), (8, 9), None, (1, 1)])
+        # the first append is written right away, the others are coalesced
+        self.assertEqual(batches, [1, 4])
+        self.assertEqual((yield self.db.logs.getLogLines(201, 6, 9)),
+                         u"yet another line\nabc\ndef\nghi\n")
+        self.assertEqual((yield self.db.logs.getLogLines(logid, 0, 1)),
+                         u"xyz\nXYZ\n")
+        self.assertEqual((yield self.db.logs.getLog(logid))['num_lines'], 2)
+
+    @defer.inlineCallbacks
+    def test_appendLog_batched_failure(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        d1 = self.db.logs.appendLog(201, u'abc\n')
+        d2 = self.db.logs.appendLog(201, u'no newline')
+        d3 = self.db.logs.appendLog(201, u'def\n')
+        self.assertEqual((yield d1), (7, 7))
+        yield self.assertFailure(d2, AssertionError)
+        self.assertEqual((yield d3), (8, 8))
+        self.assertEqual((yield self.db.logs.getLogLines(201, 7, 8)),
+                         u"abc\ndef\n")
+
     @defer.inlineCallbacks
     def test_addLogLines_huge_lines(self):
         yield self.insertTestData(self.backgroundData + self.testLogLines)
@@ -329,6 +420,58 @@ class RealTests(Tests):
             line = yield self.db.logs.getLogLines(201, lineno, lineno)
             self.assertEqual(len(line), 65537)
 
+    @defer.inlineCallbacks
+    def test_getLogLines_line_index(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        # the line index is used when reading bypasses the chunk cache
+        self.patch(logs.LogsConnectorComponent, 'MAX_CACHED_CHUNKS', 0)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 1, 3)),
+                         'line 1' + 'x' * 200 + '\nline TWO\n\n')
+        # the boundary chunks are now indexed..
+        self.assertEqual(sorted(self.db.logs._lineIndex.keys()),
+                         [(201, 0, 1), (201, 2, 4)])
+        self.assertEqual(list(self.db.logs._lineIndex.get((201, 2, 4))),
+                         [0, 9, 10, 20])
+        # ..and the index gives the same answer the second time
+        self.assertEqual((yield self.db.logs.getLogLines(201, 1, 3)),
+                         'line 1' + 'x' * 200 + '\nline TWO\n\n')
+        self.assertEqual((yield self.db.logs.getLogLines(201, 3, 4)),
+                         '\nline 2**2\n')
+
+    @defer.inlineCallbacks
+    def test_getLogLines_chunk_cache(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.master.caches = cache.CacheManager()
+        self.db.master.caches.config = {'logchunks': 10}
+        self.db.logs = logs.LogsConnectorComponent(self.db)
+        yield self.checkTestLogLines()
+        yield self.checkTestLogLines()
+        metrics = self.db.master.caches.get_metrics()['logchunks']
+        self.assertEqual(metrics['misses'], 4)
+        self.assertTrue(metrics['hits'] > 0)
+
+    @defer.inlineCallbacks
+    def test_getLogLines_chunk_cache_stale(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.master.caches = cache.CacheManager()
+        self.db.master.caches.config = {'logchunks': 10}
+        self.db.logs = logs.LogsConnectorComponent(self.db)
+        # simulate a chunk cached before compressLog merged lines 2-6
+        stale = logs.DecompressedChunk(2, 3, b'line TWO\n')
+        self.db.logs.getChunk.cache.put((201, 2), stale)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 3, 4)),
+                         '\nline 2**2\n')
+
+    @defer.inlineCallbacks
+    def test_getLogLines_many_chunks(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.patch(logs.LogsConnectorComponent, 'MAX_CACHED_CHUNKS', 1)
+        yield self.checkTestLogLines()
+
+    def test_lineOffsets(self):
+        self.assertEqual(list(logs.lineOffsets(b'')), [0, 1])
+        self.assertEqual(list(logs.lineOffsets(b'ab\n\ncd')), [0, 3, 4, 7])
+
     def test_splitBigChunk_unicode_misalignment(self):
         unaligned = (u'a ' + u'\N{SNOWMAN}' * 30000 + '\n').encode('utf-8')
         # the first 65536 bytes of that line are not valid utf-8
@@ -15,6 +15,7 @@
 import os
 import time
 
+import mock
 import sqlalchemy as sa
 
 from twisted.internet import defer
@@ -76,6 +77,35 @@ class Basic(unittest.TestCase):
         return self.expect_failure(self.pool.do(raise_something), RuntimeError,
                                    expect_logged_error=True)
 
+    def test_do_bulk(self):
+        def add(conn, addend1, addend2):
+            rp = conn.execute("SELECT %d + %d" % (addend1, addend2))
+            return rp.scalar()
+        d = self.pool.do_bulk(add, 10, 11)
+
+        @d.addCallback
+        def check(res):
+            self.assertEqual(res, 21)
+        return d
+
+    def test_single_connection_shares_lanes(self):
+        # an in-memory database must see the same connection from both lanes
+        self.assertIdentical(self.pool._bulk_pool, self.pool._pool)
+
+    @defer.inlineCallbacks
+    def test_do_records_histograms(self):
+        histogramEvent = mock.Mock()
+        self.patch(pool.metrics, 'MetricHistogramEvent', histogramEvent)
+
+        def noop(conn):
+            pass
+        yield self.pool.do(noop)
+        events = [call[0][0] for call in histogramEvent.log.call_args_list]
+        self.assertEqual(sorted(events), [
+            'DBThreadPool.execute.test_db_pool.test_do_records_histograms',
+            'DBThreadPool.queue-wait.test_db_pool.test_do_records_histograms',
+        ])
+
     def test_do_with_engine(self):
         def add(engine, addend1, addend2):
             rp = engine.execute("SELECT %d + %d" % (addend1, addend2))
@@ -151,6 +181,31 @@ class Stress(unittest.TestCase):
     del test_inserts
 
 
+class Lanes(unittest.TestCase):
+
+    def makePool(self, optimal_thread_pool_size, **kwargs):
+        engine = sa.create_engine('sqlite://')
+        engine.optimal_thread_pool_size = optimal_thread_pool_size
+        p = pool.DBThreadPool(engine, reactor=reactor, **kwargs)
+        self.addCleanup(p.shutdown)
+        return p
+
+    def test_defaults(self):
+        p = self.makePool(15)
+        self.assertEqual(p._pool.max, 13)
+        self.assertEqual(p._bulk_pool.max, 2)
+
+    def test_configured(self):
+        p = self.makePool(15, pool_size=8, bulk_pool_size=4)
+        self.assertEqual(p._pool.max, 8)
+        self.assertEqual(p._bulk_pool.max, 4)
+
+    def test_no_bulk_lane(self):
+        p = self.makePool(15, bulk_pool_size=0)
+        self.assertEqual(p._pool.max, 15)
+        self.assertIdentical(p._bulk_pool, p._pool)
+
+
 class BasicWithDebug(Basic):
 
     # same thing, but with debug=True
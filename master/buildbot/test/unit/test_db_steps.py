@@ -20,6 +20,7 @@ from twisted.internet import defer
 from twisted.internet import task
 from twisted.trial import unittest
 
+from buildbot.data import resultspec
 from buildbot.db import steps
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
@@ -95,7 +96,12 @@ class Tests(interfaces.InterfaceTests):
 
     def test_signature_getSteps(self):
         @self.assertArgSpecMatches(self.db.steps.getSteps)
-        def getSteps(self, buildid):
+        def getSteps(self, buildid, resultSpec=None):
+            pass
+
+    def test_signature_getStepsForBuilds(self):
+        @self.assertArgSpecMatches(self.db.steps.getStepsForBuilds)
+        def getStepsForBuilds(self, buildids):
             pass
 
     def test_signature_addStep(self):
@@ -103,6 +109,11 @@ class Tests(interfaces.InterfaceTests):
         def addStep(self, buildid, name, state_string):
             pass
 
+    def test_signature_addSteps(self):
+        @self.assertArgSpecMatches(self.db.steps.addSteps)
+        def addSteps(self, buildid, names, state_string):
+            pass
+
     def test_signature_startStep(self):
         @self.assertArgSpecMatches(self.db.steps.startStep)
         def addStep(self, stepid):
@@ -171,12 +182,29 @@ class Tests(interfaces.InterfaceTests):
          for stepdict in stepdicts]
         self.assertEqual(stepdicts, self.stepDicts[:3])
 
+    @defer.inlineCallbacks
+    def test_getSteps_resultSpec(self):
+        yield self.insertTestData(self.backgroundData + self.stepRows)
+        rs = resultspec.ResultSpec(order=['-number'], limit=2)
+        rs.fieldMapping = {'number': 'steps.number'}
+        stepdicts = yield self.db.steps.getSteps(buildid=30, resultSpec=rs)
+        self.assertEqual([sd['id'] for sd in stepdicts], [72, 71])
+
     @defer.inlineCallbacks
     def test_getSteps_none(self):
         yield self.insertTestData(self.backgroundData + self.stepRows)
         stepdicts = yield self.db.steps.getSteps(buildid=33)
         self.assertEqual(stepdicts, [])
 
+    @defer.inlineCallbacks
+    def test_getStepsForBuilds(self):
+        yield self.insertTestData(self.backgroundData + self.stepRows)
+        stepdicts = yield self.db.steps.getStepsForBuilds([31, 30, 33])
+        for stepdict in stepdicts:
+            validation.verifyDbDict(self, 'stepdict', stepdict)
+        self.assertEqual(stepdicts[:3], self.stepDicts)
+        self.assertEqual([sd['id'] for sd in stepdicts[3:]], [73])
+
     @defer.inlineCallbacks
     def test_addStep_getStep(self):
         clock = task.Clock()
@@ -233,6 +261,43 @@ class Tests(interfaces.InterfaceTests):
         self.assertEqual(stepdict['number'], number)
         self.assertEqual(stepdict['name'], name)
 
+    @defer.inlineCallbacks
+    def test_addStep_several(self):
+        yield self.insertTestData(self.backgroundData + [self.stepRows[0]])
+        added = []
+        for name in [u'new', u'new', u'one', u'new']:
+            stepid, number, name = yield self.db.steps.addStep(
+                buildid=30, name=name, state_string=u'new')
+            added.append((number, name))
+        self.assertEqual(added, [(1, u'new'), (2, u'new_1'), (3, u'one_1'),
+                                 (4, u'new_2')])
+
+    @defer.inlineCallbacks
+    def test_addSteps(self):
+        yield self.insertTestData(self.backgroundData + [self.stepRows[0]])
+        added = yield self.db.steps.addSteps(
+            buildid=30, names=[u'new', u'one', u'new'], state_string=u'new')
+        self.assertEqual([(number, name) for _, number, name in added],
+                         [(1, u'new'), (2, u'one_1'), (3, u'new_1')])
+        for stepid, number, name in added:
+            stepdict = yield self.db.steps.getStep(stepid=stepid)
+            validation.verifyDbDict(self, 'stepdict', stepdict)
+            self.assertEqual((stepdict['buildid'], stepdict['number'],
+                              stepdict['name'], stepdict['state_string']),
+                             (30, number, name, u'new'))
+
+        # steps are still numbered on from there
+        stepid, number, name = yield self.db.steps.addStep(
+            buildid=30, name=u'new', state_string=u'new')
+        self.assertEqual((number, name), (4, u'new_2'))
+
+    @defer.inlineCallbacks
+    def test_addSteps_empty(self):
+        yield self.insertTestData(self.backgroundData)
+        added = yield self.db.steps.addSteps(
+            buildid=30, names=[], state_string=u'new')
+        self.assertEqual(added, [])
+
     @defer.inlineCallbacks
     def test_setStepStateString(self):
         yield self.insertTestData(self.backgroundData + [self.stepRows[2]])
@@ -324,6 +389,19 @@ class RealTests(Tests):
         self.assertEqual(stepdict['number'], number)
         self.assertEqual(stepdict['name'], name)
 
+    @defer.inlineCallbacks
+    def test_addStep_steps_added_elsewhere(self):
+        yield self.insertTestData(self.backgroundData)
+        yield self.db.steps.addStep(buildid=30, name=u'new',
+                                    state_string=u'new')
+        # the next number and name, behind the back of the component
+        yield self.insertTestData([
+            fakedb.Step(id=80, number=1, name=u'new_1', buildid=30),
+        ])
+        stepid, number, name = yield self.db.steps.addStep(
+            buildid=30, name=u'new', state_string=u'new')
+        self.assertEqual((number, name), (2, u'new_2'))
+
 
 class TestFakeDB(unittest.TestCase, Tests):
 
@@ -80,6 +80,16 @@ class RealTests(tuplematching.TupleMatchingMixin, Tests):
         self.mq.produce(('abc',), dict(x=1))
         cb.assert_called_once_with(('abc',), dict(x=1))
 
+    @defer.inlineCallbacks
+    def test_produce_order(self):
+        calls = []
+        yield self.mq.startConsuming(lambda k, d: calls.append(1), ('a', None))
+        yield self.mq.startConsuming(lambda k, d: calls.append(2), ('a', 'b'))
+        yield self.mq.startConsuming(lambda k, d: calls.append(3), (None, 'b'))
+        yield self.mq.startConsuming(lambda k, d: calls.append(4), ('a', 'c'))
+        self.mq.produce(('a', 'b'), 'x')
+        self.assertEqual(calls, [1, 2, 3])
+
     @defer.inlineCallbacks
     def test_stopConsuming_twice(self):
         cb = mock.Mock()
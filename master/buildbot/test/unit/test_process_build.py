@@ -709,6 +709,13 @@ class TestBuild(unittest.TestCase):
         self.assertEqual(self.master.data.updates.properties,
                          [(43, u'foo', 'bar', u'test')])
 
+        # only properties set since the last flush are written
+        b.setProperty("baz", "qux", "test")
+        yield b._flushProperties(result)
+        self.assertEqual(self.master.data.updates.properties,
+                         [(43, u'foo', 'bar', u'test'),
+                          (43, u'baz', 'qux', u'test')])
+
     def create_mock_steps(self, names):
         steps = []
 
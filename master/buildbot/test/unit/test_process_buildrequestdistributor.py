@@ -799,6 +799,58 @@ class TestMaybeStartBuilds(TestBRDBase):
         yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
                                                      exp_claims=[11], exp_builds=[('test-worker1', [11])])
 
+    # unclaimed request queue
+
+    @defer.inlineCallbacks
+    def test_queue_follows_messages(self):
+        self.addWorkers({'test-worker1': 1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77,
+                                submitted_at=130000),
+        ]
+        yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
+                                                     exp_claims=[10], exp_builds=[('test-worker1', [10])])
+        queue = self.brd._unclaimedQueues[77]
+        self.assertEqual(len(queue), 0)
+
+        yield self.master.db.insertTestData([
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=77,
+                                submitted_at=135000),
+        ])
+        msg = yield self.master.data.get(('buildrequests', '11'))
+        self.brd._buildRequestEvent(('buildrequests', '11', 'new'), msg)
+        self.assertEqual([brd['buildrequestid'] for brd in queue.sorted()],
+                         [11])
+
+        msg = dict(msg, claimed=True)
+        self.brd._buildRequestEvent(('buildrequests', '11', 'claimed'), msg)
+        self.assertEqual(len(queue), 0)
+
+    @defer.inlineCallbacks
+    def test_queue_not_reloaded(self):
+        self.addWorkers({'test-worker1': 1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77,
+                                submitted_at=130000),
+        ]
+        yield self.master.db.insertTestData(rows)
+        queue = yield self.brd.getUnclaimedQueue(self.bldr)
+
+        # a request added behind the distributor's back is not seen until
+        # the queue is reconciled with the database
+        yield self.master.db.insertTestData([
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=77,
+                                submitted_at=135000),
+        ])
+        queue = yield self.brd.getUnclaimedQueue(self.bldr)
+        self.assertEqual([brd['buildrequestid'] for brd in queue.sorted()],
+                         [10])
+
+        queue.syncedAt -= self.brd.RECONCILE_INTERVAL + 1
+        queue = yield self.brd.getUnclaimedQueue(self.bldr)
+        self.assertEqual([brd['buildrequestid'] for brd in queue.sorted()],
+                         [10, 11])
+
     # nextWorker
     @defer.inlineCallbacks
     def do_test_nextWorker(self, nextWorker, exp_choice=None):
@@ -921,3 +973,68 @@ class TestMaybeStartBuilds(TestBRDBase):
         result = self.do_test_nextBuild(nextBuild)
         self.assertEqual(1, len(self.flushLoggedErrors(RuntimeError)))
         return result
+
+
+class TestUnclaimedBuildRequestQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = buildrequestdistributor.UnclaimedBuildRequestQueue()
+
+    def brdict(self, brid, submitted_at):
+        return dict(buildrequestid=brid, submitted_at=submitted_at)
+
+    def brids(self):
+        return [brd['buildrequestid'] for brd in self.queue.sorted()]
+
+    def test_ordering(self):
+        self.queue.reset([self.brdict(3, 300), self.brdict(1, 100)])
+        self.queue.add(self.brdict(2, 200))
+        self.assertEqual(self.brids(), [1, 2, 3])
+        self.assertEqual(self.queue.oldest()['buildrequestid'], 1)
+        self.assertEqual(len(self.queue), 3)
+
+    def test_remove(self):
+        self.queue.reset([self.brdict(1, 100), self.brdict(2, 200)])
+        self.queue.remove(1)
+        self.queue.remove(99)  # unknown brids are ignored
+        self.assertEqual(self.queue.oldest()['buildrequestid'], 2)
+        self.assertEqual(self.queue.get(1), None)
+        self.assertEqual(self.brids(), [2])
+
+    def test_readd(self):
+        self.queue.reset([self.brdict(1, 100), self.brdict(2, 200)])
+        self.queue.remove(1)
+        self.queue.add(self.brdict(1, 100))
+        self.queue.add(self.brdict(1, 100))
+        self.assertEqual(self.brids(), [1, 2])
+
+    def test_oldest_exclude(self):
+        self.queue.reset([self.brdict(1, 100), self.brdict(2, 200)])
+        self.assertEqual(
+            self.queue.oldest(exclude=set([1]))['buildrequestid'], 2)
+        self.assertEqual(self.queue.oldest(exclude=set([1, 2])), None)
+        # excluded entries are still queued
+        self.assertEqual(self.brids(), [1, 2])
+
+    def test_compaction(self):
+        self.queue.reset([self.brdict(i, i) for i in range(100)])
+        for i in range(99):
+            self.queue.remove(i)
+        self.assertTrue(len(self.queue._heap) <= 2 * len(self.queue) + 16)
+        self.assertEqual(self.brids(), [99])
+
+    def test_sync_replays_changes(self):
+        self.queue.add(self.brdict(1, 100))
+        self.queue.beginSync()
+        # messages arriving while the database is being read
+        self.queue.add(self.brdict(3, 300))
+        self.queue.remove(2)
+        self.queue.finishSync([self.brdict(1, 100), self.brdict(2, 200)], 10)
+        self.assertEqual(self.brids(), [1, 3])
+        self.assertEqual(self.queue.syncedAt, 10)
+
+    def test_invalidate(self):
+        self.queue.beginSync()
+        self.queue.finishSync([], 10)
+        self.queue.invalidate()
+        self.assertEqual(self.queue.syncedAt, None)
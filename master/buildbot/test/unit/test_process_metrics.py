@@ -245,6 +245,18 @@ class TestReports(unittest.TestCase):
         self.assertEqual("Timer time_foo: 1", handler.report())
         self.assertEqual({"timers": {"time_foo": 1}}, handler.asDict())
 
+    def testMetricHistogramReport(self):
+        handler = metrics.MetricHistogramHandler(None)
+        handler.handle({}, metrics.MetricHistogramEvent('hist_foo', 0.002))
+        handler.handle({}, metrics.MetricHistogramEvent('hist_foo', 0.004))
+
+        self.assertEqual("Histogram hist_foo: count 2, average 0.003",
+                         handler.report())
+        d = handler.asDict()['histograms']['hist_foo']
+        self.assertEqual(d['count'], 2)
+        self.assertEqual(dict(d['buckets'])[0.0025], 1)
+        self.assertEqual(dict(d['buckets'])[0.005], 1)
+
     def testMetricAlarmReport(self):
         handler = metrics.MetricAlarmHandler(None)
         handler.handle({}, metrics.MetricAlarmEvent(
@@ -984,6 +984,25 @@ class TestProperties(unittest.TestCase):
         self.assertEqual(self.props.getProperty('x'), 24)
         self.assertEqual(self.props.getPropertySource('x'), 'old')
 
+    def testTakeDirtyProperties(self):
+        self.props.setProperty("a", 1, "old")
+        self.props.setProperty("b", 2, "old")
+        self.assertEqual(self.props.takeDirtyProperties(),
+                         {'a': (1, 'old'), 'b': (2, 'old')})
+        self.assertEqual(self.props.takeDirtyProperties(), {})
+
+        self.props.setProperty("b", 3, "new")
+        newprops = Properties()
+        newprops.setProperty('c', 4, "new", runtime=True)
+        newprops.setProperty('d', 5, "new")
+        self.props.updateFromPropertiesNoRuntime(newprops)
+        self.assertEqual(self.props.takeDirtyProperties(),
+                         {'b': (3, 'new'), 'd': (5, 'new')})
+
+        self.props.updateFromProperties(newprops)
+        self.assertEqual(self.props.takeDirtyProperties(),
+                         {'c': (4, 'new'), 'd': (5, 'new')})
+
     def test_setProperty_notJsonable(self):
         self.assertRaises(TypeError, self.props.setProperty,
                           "project", ConstantRenderable('testing'), "test")
@@ -155,6 +155,70 @@ class TestRunCommand(unittest.TestCase, Tests):
         cmd.addHeader('some header')
         self.assertEqual(log.header, 'some header')
 
+    def test_remoteUpdate_segments(self):
+        cmd = self.remoteCommandClass('ping', {}, collectStdout=True)
+        stdio = logfile.FakeLogFile('stdio', 'dummy')
+        other = logfile.FakeLogFile('other', 'dummy')
+        cmd.useLog(stdio)
+        cmd.useLog(other)
+        cmd.remoteUpdate({'segments': [
+            ('stdout', 'out1 '), ('stderr', 'err '), ('header', 'hdr'),
+            (('log', 'other'), 'log data'), ('stdout', 'out2'),
+        ]})
+        self.assertEqual(stdio.stdout, 'out1 out2')
+        self.assertEqual(stdio.stderr, 'err ')
+        self.assertEqual(stdio.header, 'hdr')
+        self.assertEqual(other.stdout, 'log data')
+        self.assertEqual(cmd.stdout, 'out1 out2')
+        self.assertNotIn('segments', cmd.updates)
+
+    def test_RemoteShellCommand_segments(self):
+        cmd = remotecommand.RemoteShellCommand('workdir', 'shell')
+        step = mock.Mock()
+        step.workerVersionIsOlderThan = lambda command, minversion: False
+        step.workerVersion = lambda command, oldversion=None: '3.2'
+        conn = mock.Mock()
+        conn.remoteStartCommand = mock.Mock(return_value=None)
+
+        cmd.run(step, conn, 'builder')
+
+        self.assertEqual(cmd.args['segments'], True)
+
+    def test_collectStdout(self):
+        cmd = self.remoteCommandClass('ping', {}, collectStdout=True,
+                                      collectStderr=True)
+        for i in range(3):
+            cmd.addStdout('out%d ' % i)
+            cmd.addStderr('err%d ' % i)
+        self.assertEqual(cmd.stdout, 'out0 out1 out2 ')
+        self.assertEqual(cmd.stderr, 'err0 err1 err2 ')
+
+    def test_collectStdout_not_collected(self):
+        cmd = self.makeRemoteCommand()
+        cmd.addStdout('some stdout')
+        self.assertEqual(cmd.stdout, '')
+
+    def test_collectStdout_assign(self):
+        cmd = self.remoteCommandClass('ping', {}, collectStdout=True)
+        cmd.addStdout('abc')
+        cmd.stdout += 'def'
+        cmd.addStdout('ghi')
+        self.assertEqual(cmd.stdout, 'abcdefghi')
+
+    def test_collectMaxSize(self):
+        self.patch(self.remoteCommandClass, 'collectMaxSize', 10)
+        cmd = self.remoteCommandClass('ping', {}, collectStdout=True)
+        cmd.addStdout('0123456')
+        cmd.addStdout('789abcdef')
+        self.assertEqual(cmd.stdout, '0123456789')
+
+    def test_collectSpillSize(self):
+        self.patch(self.remoteCommandClass, 'collectSpillSize', 4)
+        cmd = self.remoteCommandClass('ping', {}, collectStdout=True)
+        cmd.addStdout('0123456')
+        cmd.addStdout('789')
+        self.assertEqual(cmd.stdout, '0123456789')
+
     def test_RemoteShellCommand_usePTY_on_worker_2_16(self):
         cmd = remotecommand.RemoteShellCommand('workdir', 'shell')
 
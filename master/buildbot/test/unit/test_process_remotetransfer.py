@@ -13,14 +13,39 @@
 #
 # Copyright Buildbot Team Members
 import os
+import shutil
 import stat
+import tarfile
 import tempfile
+import zlib
+from cStringIO import StringIO
 
 from mock import Mock
 
+from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot.process import remotetransfer
+from buildbot.test.fake.reactor import NonThreadPool
+from buildbot.test.fake.reactor import TestReactor
+
+
+class ManualThreadPool(NonThreadPool):
+
+    """
+    A thread pool that runs each call only when the test says so.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kw):
+        self.pending.append((onResult, func, args, kw))
+
+    def runOne(self):
+        onResult, func, args, kw = self.pending.pop(0)
+        NonThreadPool.callInThreadWithCallback(
+            self, onResult, func, *args, **kw)
 
 
 # Test buildbot.steps.remotetransfer.FileWriter class.
@@ -63,3 +88,360 @@ class TestFileWriter(unittest.TestCase):
         mockedMakedirs.assert_called_once_with(absdir)
         mockedMkstemp.assert_called_once_with(dir=absdir)
         mockedFdopen.assert_called_once_with(7, 'wb')
+
+
+class TestFileWriterThreads(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.destfile = os.path.join(self.basedir, 'dest')
+        self.pool = ManualThreadPool()
+        self.patch(remotetransfer, '_threadPool', self.pool)
+        self.patch(remotetransfer, 'reactor', TestReactor())
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def runAll(self):
+        while self.pool.pending:
+            self.pool.runOne()
+
+    def test_operations_in_order(self):
+        writer = remotetransfer.FileWriter(self.destfile, None, None)
+        self.assertEqual(writer.remote_write('abc'), None)
+        self.assertEqual(writer.remote_write('def'), None)
+        d = writer.remote_close()
+        # only one operation is handed to the pool at a time
+        self.assertEqual(len(self.pool.pending), 1)
+        self.runAll()
+        self.assertTrue(d.called)
+        with open(self.destfile) as f:
+            self.assertEqual(f.read(), 'abcdef')
+
+    def test_backpressure(self):
+        writer = remotetransfer.FileWriter(self.destfile, None, None)
+        writer.maxBuffered = 4
+        self.assertEqual(writer.remote_write('abc'), None)
+        d = writer.remote_write('def')
+        self.assertFalse(d.called)
+        self.assertEqual(writer.buffered, 6)
+        self.pool.runOne()
+        self.assertFalse(d.called)
+        self.pool.runOne()
+        self.assertTrue(d.called)
+        self.assertEqual(writer.buffered, 0)
+
+    def test_maxsize(self):
+        writer = remotetransfer.FileWriter(self.destfile, 4, None)
+        writer.remote_write('abc')
+        writer.remote_write('def')
+        writer.remote_close()
+        self.runAll()
+        with open(self.destfile) as f:
+            self.assertEqual(f.read(), 'abcd')
+
+    def test_write_error_reported_on_close(self):
+        writer = remotetransfer.FileWriter(self.destfile, None, None)
+        self.patch(writer, '_write', Mock(side_effect=IOError("disk full")))
+        self.assertEqual(writer.remote_write('abc'), None)
+        d = writer.remote_close()
+        self.runAll()
+        return self.assertFailure(d, IOError)
+
+
+class TestResumableFileWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.destfile = os.path.join(self.basedir, 'dest')
+        self.patch(remotetransfer, '_threadPool', NonThreadPool())
+        self.patch(remotetransfer, 'reactor', TestReactor())
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeWriter(self, maxsize=None):
+        return remotetransfer.ResumableFileWriter(self.destfile, maxsize, None)
+
+    @defer.inlineCallbacks
+    def upload(self, writer, blocks, resumeAt=0):
+        hasher = remotetransfer.BlockHasher()
+        sums = yield writer.remote_getBlockChecksums(4)
+        for block in blocks[:resumeAt]:
+            hasher.add(hasher.checksum(block))
+        self.assertEqual(sums[:resumeAt], hasher.checksums)
+        yield writer.remote_resumeAt(resumeAt)
+        for block in blocks[resumeAt:]:
+            checksum = hasher.checksum(block)
+            hasher.add(checksum)
+            yield writer.remote_write(block, checksum)
+        defer.returnValue(hasher.hexdigest())
+
+    @defer.inlineCallbacks
+    def test_upload(self):
+        writer = self.makeWriter()
+        digest = yield self.upload(writer, ['abcd', 'efgh', 'ij'])
+        yield writer.remote_close(digest)
+        with open(self.destfile) as f:
+            self.assertEqual(f.read(), 'abcdefghij')
+        self.assertEqual(os.listdir(self.basedir), ['dest'])
+
+    @defer.inlineCallbacks
+    def test_resume(self):
+        writer = self.makeWriter()
+        yield self.upload(writer, ['abcd', 'efgh', 'ij'])
+        yield writer.cancel()
+        self.assertFalse(os.path.exists(self.destfile))
+
+        writer = self.makeWriter()
+        sums = yield writer.remote_getBlockChecksums(4)
+        # the short last block is not kept
+        self.assertEqual(len(sums), 2)
+        digest = yield self.upload(writer, ['abcd', 'efgh', 'ijkl'],
+                                   resumeAt=2)
+        yield writer.remote_close(digest)
+        with open(self.destfile) as f:
+            self.assertEqual(f.read(), 'abcdefghijkl')
+
+    @defer.inlineCallbacks
+    def test_other_blocksize(self):
+        writer = self.makeWriter()
+        yield self.upload(writer, ['abcd', 'efgh'])
+        yield writer.cancel()
+
+        writer = self.makeWriter()
+        sums = yield writer.remote_getBlockChecksums(8)
+        self.assertEqual(sums, [])
+
+    @defer.inlineCallbacks
+    def test_corrupted_block(self):
+        writer = self.makeWriter()
+        yield writer.remote_getBlockChecksums(4)
+        yield writer.remote_resumeAt(0)
+        writer.remote_write('abcd', remotetransfer.BlockHasher.checksum('abce'))
+        yield self.assertFailure(writer.remote_close('digest'),
+                                 remotetransfer.TransferChecksumError)
+        self.assertFalse(os.path.exists(self.destfile))
+
+    @defer.inlineCallbacks
+    def test_wrong_digest(self):
+        writer = self.makeWriter()
+        yield self.upload(writer, ['abcd'])
+        yield self.assertFailure(writer.remote_close('0' * 64),
+                                 remotetransfer.TransferChecksumError)
+        self.assertEqual(os.listdir(self.basedir), [])
+
+    @defer.inlineCallbacks
+    def test_close_without_digest(self):
+        writer = self.makeWriter()
+        yield self.upload(writer, ['abcd'])
+        yield writer.remote_close()
+        self.assertFalse(os.path.exists(self.destfile))
+        self.assertTrue(os.path.exists(self.destfile + '.partial'))
+
+
+class TestContentStoreWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.storedir = os.path.join(self.basedir, 'store')
+        self.destdir = os.path.join(self.basedir, 'dest')
+        self.patch(remotetransfer, '_threadPool', NonThreadPool())
+        self.patch(remotetransfer, 'reactor', TestReactor())
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeWriter(self, destdir=None, maxsize=None, mode=None):
+        return remotetransfer.ContentStoreWriter(
+            destdir or self.destdir, maxsize, mode, self.storedir)
+
+    def digest(self, data):
+        return remotetransfer.BlockHasher.checksum(data)
+
+    def manifest(self, **files):
+        entries = [('', None, 0, 0o755)]
+        for name, data in sorted(files.items()):
+            entries.append((name, self.digest(data), len(data), 0o644))
+        return entries
+
+    @defer.inlineCallbacks
+    def upload(self, writer, manifest, **files):
+        missing = yield writer.remote_manifest(manifest)
+        contents = dict((self.digest(data), data) for data in files.values())
+        for digest in missing:
+            yield writer.remote_beginFile(digest)
+            yield writer.remote_write(contents[digest])
+            yield writer.remote_endFile()
+        yield writer.remote_close()
+        defer.returnValue(missing)
+
+    def assertFile(self, name, data):
+        with open(os.path.join(self.destdir, name), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    @defer.inlineCallbacks
+    def test_upload(self):
+        files = dict(a='aaa', b='bbb', c='aaa')
+        missing = yield self.upload(self.makeWriter(),
+                                    self.manifest(**files), **files)
+        # the same content is only sent once
+        self.assertEqual(sorted(missing),
+                         sorted([self.digest('aaa'), self.digest('bbb')]))
+        for name, data in files.items():
+            self.assertFile(name, data)
+        self.assertEqual(stat.S_IMODE(
+            os.stat(os.path.join(self.destdir, 'a')).st_mode), 0o644)
+
+    @defer.inlineCallbacks
+    def test_upload_again(self):
+        files = dict(a='aaa', b='bbb')
+        yield self.upload(self.makeWriter(), self.manifest(**files), **files)
+        shutil.rmtree(self.destdir)
+
+        files = dict(a='aaa', b='new')
+        missing = yield self.upload(self.makeWriter(),
+                                    self.manifest(**files), **files)
+        self.assertEqual(missing, [self.digest('new')])
+        self.assertFile('a', 'aaa')
+        self.assertFile('b', 'new')
+        if hasattr(os, 'link'):
+            store = remotetransfer.ContentStoreWriter(
+                self.destdir, None, None, self.storedir)
+            self.assertEqual(
+                os.stat(os.path.join(self.destdir, 'a')).st_ino,
+                os.stat(store.storePath(self.digest('aaa'))).st_ino)
+
+    @defer.inlineCallbacks
+    def test_mode(self):
+        dest = os.path.join(self.destdir, 'file')
+        writer = self.makeWriter(destdir=dest, mode=0o600)
+        yield self.upload(writer, [('', self.digest('x'), 1, 0o755)], f='x')
+        with open(dest) as f:
+            self.assertEqual(f.read(), 'x')
+        self.assertEqual(stat.S_IMODE(os.stat(dest).st_mode), 0o600)
+
+    @defer.inlineCallbacks
+    def test_corrupted_content(self):
+        writer = self.makeWriter()
+        digest = self.digest('aaa')
+        yield writer.remote_manifest([('a', digest, 3, 0o644)])
+        yield writer.remote_beginFile(digest)
+        yield writer.remote_write('aab')
+        yield self.assertFailure(writer.remote_endFile(),
+                                 remotetransfer.TransferChecksumError)
+        self.assertFalse(os.path.exists(writer.storePath(digest)))
+
+    @defer.inlineCallbacks
+    def test_maxsize(self):
+        writer = self.makeWriter(maxsize=4)
+        yield self.assertFailure(
+            writer.remote_manifest(self.manifest(a='aaa', b='bbb')),
+            ValueError)
+
+    @defer.inlineCallbacks
+    def test_content_larger_than_manifest(self):
+        writer = self.makeWriter()
+        digest = self.digest('aaa')
+        yield writer.remote_manifest([('a', digest, 3, 0o644)])
+        yield writer.remote_beginFile(digest)
+        yield writer.remote_write('aaa')
+        yield writer.remote_write('a' * 1000)
+        yield self.assertFailure(writer.remote_endFile(), ValueError)
+
+    @defer.inlineCallbacks
+    def test_maxsize_content_sent_again(self):
+        writer = self.makeWriter(maxsize=4)
+        digest = self.digest('aaa')
+        yield writer.remote_manifest([('a', digest, 3, 0o644)])
+        yield writer.remote_beginFile(digest)
+        yield writer.remote_write('aab')
+        yield self.assertFailure(writer.remote_endFile(),
+                                 remotetransfer.TransferChecksumError)
+        # sending the content again goes over the maxsize
+        yield writer.remote_beginFile(digest)
+        yield writer.remote_write('aaa')
+        yield self.assertFailure(writer.remote_endFile(), ValueError)
+        self.assertFalse(os.path.exists(writer.storePath(digest)))
+
+    @defer.inlineCallbacks
+    def test_outside_destdir(self):
+        writer = self.makeWriter()
+        yield self.assertFailure(
+            writer.remote_manifest([('../x', self.digest('x'), 1, 0o644)]),
+            ValueError)
+
+
+class TestFileReader(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(remotetransfer, '_threadPool', NonThreadPool())
+        self.patch(remotetransfer, 'reactor', TestReactor())
+
+    @defer.inlineCallbacks
+    def test_resumeAt(self):
+        reader = remotetransfer.FileReader(StringIO('abcdefghij'))
+        checksum = remotetransfer.BlockHasher.checksum
+        kept = yield reader.remote_resumeAt(
+            4, [checksum('abcd'), checksum('xxxx'), checksum('ijkl')])
+        self.assertEqual(kept, 1)
+        self.assertEqual(reader.remote_readBlock(4),
+                         ('efgh', checksum('efgh')))
+        self.assertEqual(reader.remote_readBlock(4), ('ij', checksum('ij')))
+        self.assertEqual(reader.remote_readBlock(4), ('', None))
+        expected = remotetransfer.BlockHasher(
+            [checksum('abcd'), checksum('efgh'), checksum('ij')])
+        self.assertEqual(reader.remote_digest(), expected.hexdigest())
+
+
+class TestDirectoryWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.destroot = os.path.join(self.basedir, 'destroot')
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeArchive(self, mode='w'):
+        f = StringIO()
+        archive = tarfile.open(fileobj=f, name='fake.tar', mode=mode)
+        info = tarfile.TarInfo('test')
+        info.size = 5
+        archive.addfile(info, StringIO('hello'))
+        archive.close()
+        return f.getvalue()
+
+    @defer.inlineCallbacks
+    def uploadAndCheck(self, compress, data):
+        writer = remotetransfer.DirectoryWriter(
+            self.destroot, None, compress, None)
+        # send it in small blocks, to be extracted as they arrive
+        for i in range(0, len(data), 100):
+            yield writer.remote_write(data[i:i + 100])
+        yield writer.remote_unpack()
+        with open(os.path.join(self.destroot, 'test')) as f:
+            self.assertEqual(f.read(), 'hello')
+
+    def test_unpack(self):
+        return self.uploadAndCheck(None, self.makeArchive())
+
+    def test_unpack_gz(self):
+        return self.uploadAndCheck('gz', self.makeArchive('w:gz'))
+
+    def test_unpack_zlib(self):
+        return self.uploadAndCheck('zlib', zlib.compress(self.makeArchive(), 1))
+
+    @defer.inlineCallbacks
+    def test_unpack_corrupt(self):
+        writer = remotetransfer.DirectoryWriter(
+            self.destroot, None, None, None)
+        yield writer.remote_write('this is not a tar file' * 100)
+        yield self.assertFailure(writer.remote_unpack(), tarfile.TarError)
+
+    def test_cancel(self):
+        writer = remotetransfer.DirectoryWriter(
+            self.destroot, None, None, None)
+        writer.remote_write(self.makeArchive()[:100])
+        writer.cancel()
+        self.assertFalse(writer._extracted.called)
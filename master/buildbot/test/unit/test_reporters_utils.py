@@ -119,6 +119,15 @@ class TestDataUtils(unittest.TestCase, logging.LoggingMixin):
         build1 = res['builds'][0]
         self.assertEqual(
             build1['steps'][0]['logs'][0]['content']['content'], self.LOGCONTENT)
+        self.assertEqual(build1['steps'][1]['logs'], [])
+
+        # the steps and logs read in bulk are those the data API returns
+        steps = yield self.master.data.get(("builds", 20, "steps"))
+        self.assertEqual([dict((k, v) for k, v in s.items() if k != 'logs')
+                          for s in build1['steps']], steps)
+        logs = yield self.master.data.get(("steps", 120, "logs"))
+        self.assertEqual([dict((k, v) for k, v in l.items() if k != 'content')
+                          for l in build1['steps'][0]['logs']], logs)
 
     @defer.inlineCallbacks
     def test_getResponsibleUsers(self):
@@ -174,6 +183,55 @@ class TestDataUtils(unittest.TestCase, logging.LoggingMixin):
         res = yield utils.getPreviousBuild(self.master, build)
         self.assertEqual(res['buildid'], 18)
 
+    @defer.inlineCallbacks
+    def test_getPreviousBuildFirst(self):
+        self.setupDb()
+        build = yield self.master.data.get(("builds", 18))
+        res = yield utils.getPreviousBuild(self.master, build)
+        self.assertIsNone(res)
+
+    @defer.inlineCallbacks
+    def test_getPreviousBuildStillRunning(self):
+        self.setupDb()
+        self.db.insertTestData([
+            fakedb.Build(id=22, number=4, builderid=80, buildrequestid=12, workerid=13,
+                         masterid=92, results=None),
+            fakedb.Build(id=23, number=5, builderid=80, buildrequestid=12, workerid=13,
+                         masterid=92, results=SUCCESS),
+        ])
+        build = yield self.master.data.get(("builds", 23))
+        res = yield utils.getPreviousBuild(self.master, build)
+        self.assertEqual(res['buildid'], 22)
+
+    @defer.inlineCallbacks
+    def test_getPreviousBuildStillRunningBeforeRetry(self):
+        self.setupDb()
+        self.db.insertTestData([
+            fakedb.Build(id=22, number=4, builderid=80, buildrequestid=12, workerid=13,
+                         masterid=92, results=None),
+            fakedb.Build(id=23, number=5, builderid=80, buildrequestid=12, workerid=13,
+                         masterid=92, results=RETRY),
+            fakedb.Build(id=24, number=6, builderid=80, buildrequestid=12, workerid=13,
+                         masterid=92, results=SUCCESS),
+        ])
+        build = yield self.master.data.get(("builds", 24))
+        res = yield utils.getPreviousBuild(self.master, build)
+        self.assertEqual(res['buildid'], 22)
+
+    @defer.inlineCallbacks
+    def test_getPreviousBuildManyRetries(self):
+        self.setupDb()
+        # more retried builds than are read at once
+        retries = utils.PREVIOUS_BUILDS_WINDOW * 2 + 1
+        self.db.insertTestData([
+            fakedb.Build(id=22 + i, number=4 + i, builderid=80, buildrequestid=12,
+                         workerid=13, masterid=92,
+                         results=RETRY if i < retries else SUCCESS)
+            for i in range(retries + 1)])
+        build = yield self.master.data.get(("builds", 22 + retries))
+        res = yield utils.getPreviousBuild(self.master, build)
+        self.assertEqual(res['buildid'], 21)
+
 
 class TestURLUtils(unittest.TestCase):
 
@@ -0,0 +1,153 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+import mock
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from buildbot.changes.filter import ChangeFilter
+from buildbot.schedulers import dispatcher
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+
+
+class ChangeDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.master = fakemaster.make_master(testcase=self,
+                                             wantDb=True, wantMq=True)
+        # the messages here only carry the changeid
+        self.master.mq.verifyMessages = False
+        self.dispatcher = self.master.change_dispatcher
+        self.master.db.insertTestData([
+            fakedb.SourceStamp(id=92),
+            fakedb.Change(changeid=1, branch=u'master', project=u'proj',
+                          repository=u'repo', codebase=u''),
+            fakedb.Change(changeid=2, branch=u'dev', project=u'other',
+                          repository=u'repo', codebase=u''),
+        ])
+        self.received = []
+
+    @defer.inlineCallbacks
+    def subscribe(self, name, change_filter=None):
+        sub = yield self.dispatcher.startConsuming(
+            lambda change: self.received.append((name, change.number)),
+            change_filter=change_filter)
+        defer.returnValue(sub)
+
+    def sendChange(self, changeid):
+        self.master.mq.callConsumer(('changes', str(changeid), 'new'),
+                                    dict(changeid=changeid))
+
+    @defer.inlineCallbacks
+    def test_consumes_once(self):
+        yield self.subscribe('a')
+        yield self.subscribe('b')
+        self.assertEqual([q.filter for q in self.master.mq.qrefs],
+                         [('changes', None, 'new')])
+
+    @defer.inlineCallbacks
+    def test_loads_change_once(self):
+        getChange = mock.Mock(wraps=self.master.db.changes.getChange)
+        self.patch(self.master.db.changes, 'getChange', getChange)
+        for name in 'abc':
+            yield self.subscribe(name)
+        self.sendChange(1)
+        self.assertEqual(getChange.call_count, 1)
+        self.assertEqual(self.received, [('a', 1), ('b', 1), ('c', 1)])
+
+    @defer.inlineCallbacks
+    def test_filters(self):
+        yield self.subscribe('master', ChangeFilter(branch='master'))
+        yield self.subscribe('dev-other', ChangeFilter(branch=['dev', 'x'],
+                                                       project='other'))
+        yield self.subscribe('dev-proj', ChangeFilter(branch='dev',
+                                                      project='proj'))
+        yield self.subscribe('re', ChangeFilter(project_re='o.*'))
+        yield self.subscribe('all')
+        self.sendChange(1)
+        self.sendChange(2)
+        self.assertEqual(self.received, [
+            ('master', 1), ('all', 1),
+            ('dev-other', 2), ('re', 2), ('all', 2),
+        ])
+
+    @defer.inlineCallbacks
+    def test_stopConsuming(self):
+        a = yield self.subscribe('a', ChangeFilter(branch='master'))
+        b = yield self.subscribe('b')
+        a.stopConsuming()
+        self.sendChange(1)
+        self.assertEqual(self.received, [('b', 1)])
+        self.assertEqual(len(self.dispatcher._filters), 1)
+
+        # the last subscription stops consuming the messages altogether
+        b.stopConsuming()
+        self.assertEqual(self.master.mq.qrefs, [])
+        yield self.subscribe('c')
+        self.assertEqual(len(self.master.mq.qrefs), 1)
+
+    @defer.inlineCallbacks
+    def test_stopConsuming_while_loading(self):
+        chdict = yield self.master.db.changes.getChange(1)
+        d = defer.Deferred()
+        self.patch(self.master.db.changes, 'getChange', lambda changeid: d)
+        a = yield self.subscribe('a')
+        yield self.subscribe('b')
+        self.sendChange(1)
+        a.stopConsuming()
+        d.callback(chdict)
+        self.assertEqual(self.received, [('b', 1)])
+
+    @defer.inlineCallbacks
+    def test_stopConsuming_from_callback(self):
+        subs = []
+
+        def stopOther(change):
+            self.received.append(('a', change.number))
+            subs[1].stopConsuming()
+        subs.append((yield self.dispatcher.startConsuming(stopOther)))
+        subs.append((yield self.subscribe('b')))
+        self.sendChange(1)
+        self.assertEqual(self.received, [('a', 1)])
+
+    @defer.inlineCallbacks
+    def test_callback_exception(self):
+        yield self.dispatcher.startConsuming(lambda change: 1 / 0)
+        yield self.subscribe('b')
+        self.sendChange(1)
+        self.assertEqual(self.received, [('b', 1)])
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+
+    @defer.inlineCallbacks
+    def test_metrics(self):
+        histogramEvent = mock.Mock()
+        countEvent = mock.Mock()
+        self.patch(dispatcher.metrics, 'MetricHistogramEvent', histogramEvent)
+        self.patch(dispatcher.metrics, 'MetricCountEvent', countEvent)
+        yield self.subscribe('master', ChangeFilter(branch='master'))
+        yield self.subscribe('dev', ChangeFilter(branch='dev'))
+        yield self.subscribe('other', ChangeFilter(branch='master',
+                                                   project='other'))
+        self.sendChange(1)
+        self.assertEqual(
+            sorted(call[0][0] for call in histogramEvent.log.call_args_list),
+            ['ChangeDispatcher.dispatch', 'ChangeDispatcher.filter',
+             'ChangeDispatcher.load'])
+        self.assertEqual(
+            sorted(call[0] for call in countEvent.log.call_args_list), [
+                ('ChangeDispatcher.delivered', 1),
+                ('ChangeDispatcher.subscriptions', 3),
+            ])
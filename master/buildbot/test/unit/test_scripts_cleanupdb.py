@@ -123,7 +123,7 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
         # we reuse RealDatabaseMixin to setup the db
         yield self.setUpRealDatabase(table_names=['logs', 'logchunks', 'steps', 'builds', 'builders',
                                                   'masters', 'buildrequests', 'buildsets',
-                                                  'workers'])
+                                                  'workers', 'objects', 'object_state'])
         master = fakemaster.make_master()
         master.config.db['db_url'] = self.db_url
         self.db = DBConnector(self.basedir)
@@ -166,6 +166,76 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
         self.assertDictAlmostEqual(
             lengths, {'raw': 5999, 'bz2': 44, 'lz4': 40, 'gz': 31})
 
+    @defer.inlineCallbacks
+    def setUpCleanupDb(self):
+        yield self.setUpRealDatabase(table_names=['logs', 'logchunks', 'steps', 'builds', 'builders',
+                                                  'masters', 'buildrequests', 'buildsets',
+                                                  'workers', 'objects', 'object_state'])
+        master = fakemaster.make_master()
+        master.config.db['db_url'] = self.db_url
+        self.db = DBConnector(self.basedir)
+        self.db.setServiceParent(master)
+        self.db.pool = self.db_pool
+        yield self.insertTestData(test_db_logs.Tests.backgroundData)
+
+    @defer.inlineCallbacks
+    def getLogSize(self, logid):
+        def thd(conn):
+            tbl = self.db.model.logchunks
+            q = sa.select([tbl.c.content])
+            q = q.where(tbl.c.logid == logid)
+            return sum([len(row.content) for row in conn.execute(q)])
+        size = yield self.db.pool.do(thd)
+        defer.returnValue(size)
+
+    @defer.inlineCallbacks
+    def test_cleanup_resume(self):
+        yield self.setUpCleanupDb()
+        LOGDATA = "xx\n" * 2000
+        logids = []
+        for name in "xyz":
+            logid = yield self.db.logs.addLog(102, name, name, "s")
+            yield self.db.logs.appendLog(logid, LOGDATA)
+            logids.append(logid)
+
+        # pretend that an earlier run was interrupted after the first log
+        objectid = yield self.db.state.getObjectId(
+            'cleanupdb', 'buildbot.scripts.cleanupdb')
+        yield self.db.state.setState(objectid, 'last_logid', logids[0])
+
+        self.createMasterCfg("c['logCompressionMethod'] = 'gz'")
+        res = yield cleanupdb._cleanupDatabase(mkconfig(basedir='basedir'))
+        self.assertEqual(res, 0)
+        self.assertInStdout("resuming after log %d" % (logids[0],))
+        self.assertInStdout("MB/s")
+
+        sizes = []
+        for logid in logids:
+            sizes.append((yield self.getLogSize(logid)))
+        self.assertEqual(sizes[0], 5999)
+        self.assertTrue(sizes[1] < 100)
+        self.assertTrue(sizes[2] < 100)
+
+        # a completed run starts over the next time
+        self.assertEqual((yield self.db.state.getState(objectid, 'last_logid')),
+                         0)
+
+    @defer.inlineCallbacks
+    def test_cleanup_no_resume(self):
+        yield self.setUpCleanupDb()
+        logid = yield self.db.logs.addLog(102, "x", "x", "s")
+        yield self.db.logs.appendLog(logid, "xx\n" * 2000)
+        objectid = yield self.db.state.getObjectId(
+            'cleanupdb', 'buildbot.scripts.cleanupdb')
+        yield self.db.state.setState(objectid, 'last_logid', logid)
+
+        self.createMasterCfg("c['logCompressionMethod'] = 'gz'")
+        config = mkconfig(basedir='basedir')
+        config['no-resume'] = True
+        res = yield cleanupdb._cleanupDatabase(config)
+        self.assertEqual(res, 0)
+        self.assertTrue((yield self.getLogSize(logid)) < 100)
+
     def assertDictAlmostEqual(self, d1, d2):
         # The test shows each methods return different size
         # but we still make a fuzzy comparaison to resist if underlying libraries
@@ -77,6 +77,38 @@ class TestUpgradeMasterOptions(OptionsMixin, unittest.TestCase):
         self.assertOptions(opts, exp)
 
 
+class TestCleanupDBOptions(OptionsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpOptions()
+
+    def parse(self, *args):
+        self.opts = runner.CleanupDBOptions()
+        self.opts.parseOptions(args)
+        return self.opts
+
+    def test_synopsis(self):
+        opts = runner.CleanupDBOptions()
+        self.assertIn('buildbot cleanupdb', opts.getSynopsis())
+
+    def test_defaults(self):
+        opts = self.parse()
+        exp = dict(quiet=False, jobs=4)
+        exp['no-resume'] = False
+        self.assertOptions(opts, exp)
+
+    def test_short(self):
+        opts = self.parse('-q', '-j', '8')
+        exp = dict(quiet=True, jobs=8)
+        self.assertOptions(opts, exp)
+
+    def test_long(self):
+        opts = self.parse('--quiet', '--jobs=2', '--no-resume')
+        exp = dict(quiet=True, jobs=2)
+        exp['no-resume'] = True
+        self.assertOptions(opts, exp)
+
+
 class TestCreateMasterOptions(OptionsMixin, unittest.TestCase):
 
     def setUp(self):
@@ -23,6 +23,7 @@ from cStringIO import StringIO
 
 from mock import Mock
 
+from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot import config
@@ -33,6 +34,7 @@ from buildbot.process.results import FAILURE
 from buildbot.process.results import SKIPPED
 from buildbot.process.results import SUCCESS
 from buildbot.steps import transfer
+from buildbot.test.fake.reactor import NonThreadPool
 from buildbot.test.fake.remotecommand import Expect
 from buildbot.test.fake.remotecommand import ExpectRemoteRef
 from buildbot.test.util import steps
@@ -44,12 +46,13 @@ from buildbot.worker_transition import DeprecatedWorkerNameWarning
 
 
 def uploadString(string, timestamp=None):
+    @defer.inlineCallbacks
     def behavior(command):
         writer = command.args['writer']
-        writer.remote_write(string + "\n")
-        writer.remote_close()
+        yield writer.remote_write(string + "\n")
+        yield writer.remote_close()
         if timestamp:
-            writer.remote_utime(timestamp)
+            yield writer.remote_utime(timestamp)
     return behavior
 
 
@@ -66,15 +69,48 @@ def downloadString(memoizer, timestamp=None):
     return behavior
 
 
+def uploadChecksummedString(string):
+    @defer.inlineCallbacks
+    def behavior(command):
+        writer = command.args['writer']
+        hasher = remotetransfer.BlockHasher()
+        yield writer.remote_getBlockChecksums(command.args['blocksize'])
+        yield writer.remote_resumeAt(0)
+        checksum = hasher.checksum(string)
+        hasher.add(checksum)
+        yield writer.remote_write(string, checksum)
+        yield writer.remote_close(hasher.hexdigest())
+    return behavior
+
+
+def uploadContents(**files):
+    # a file uploaded on its own has an empty name
+    @defer.inlineCallbacks
+    def behavior(command):
+        writer = command.args['writer']
+        checksum = remotetransfer.BlockHasher.checksum
+        contents = dict((checksum(data), data) for data in files.values())
+        manifest = [(name, checksum(data), len(data), 0o644)
+                    for name, data in sorted(files.items())]
+        missing = yield writer.remote_manifest(manifest)
+        for digest in missing:
+            yield writer.remote_beginFile(digest)
+            yield writer.remote_write(contents[digest])
+            yield writer.remote_endFile()
+        yield writer.remote_close()
+    return behavior
+
+
 def uploadTarFile(filename, **members):
+    @defer.inlineCallbacks
     def behavior(command):
         f = StringIO()
         archive = tarfile.TarFile(fileobj=f, name=filename, mode='w')
         for name, content in iteritems(members):
             archive.addfile(tarfile.TarInfo(name), StringIO(content))
         writer = command.args['writer']
-        writer.remote_write(f.getvalue())
-        writer.remote_unpack()
+        yield writer.remote_write(f.getvalue())
+        yield writer.remote_unpack()
     return behavior
 
 
@@ -84,10 +120,11 @@ class UploadError(object):
         self.behavior = behavior
         self.writer = None
 
+    @defer.inlineCallbacks
     def __call__(self, command):
         self.writer = command.args['writer']
         self.writer.cancel = Mock(wraps=self.writer.cancel)
-        self.behavior(command)
+        yield self.behavior(command)
         raise RuntimeError('uh oh')
 
 
@@ -97,6 +134,7 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         fd, self.destfile = tempfile.mkstemp()
         os.close(fd)
         os.unlink(self.destfile)
+        self.patch(remotetransfer, '_threadPool', NonThreadPool())
         return self.setUpBuildStep()
 
     def tearDown(self):
@@ -143,6 +181,91 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    def testConstructorWindow(self):
+        self.assertRaises(config.ConfigErrors, lambda:
+                          transfer.FileUpload(workersrc=__file__, masterdest='xyz', window=0))
+
+    def testWindow(self):
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile,
+                                window=8))
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False, window=8,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        d = self.runStep()
+        return d
+
+    def testWindowWorker3_0(self):
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile,
+                                window=8),
+            worker_version={'*': '3.0'})
+
+        # older workers don't pipeline, so 'window' is not sent at all
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        d = self.runStep()
+        return d
+
+    def testChecksums(self):
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile,
+                                checksums=True))
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                checksums=True,
+                writer=ExpectRemoteRef(remotetransfer.ResumableFileWriter)))
+            + Expect.behavior(uploadChecksummedString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        d = self.runStep()
+
+        @d.addCallback
+        def checkFile(_):
+            with open(self.destfile) as f:
+                self.assertEqual(f.read(), "Hello world!")
+        return d
+
+    def testChecksumsWorker3_3(self):
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile,
+                                checksums=True),
+            worker_version={'*': '3.3'})
+
+        # older workers get a plain upload
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        return self.runStep()
+
     def testTimestamp(self):
         self.setupStep(
             transfer.FileUpload(workersrc=__file__, masterdest=self.destfile, keepstamp=True))
@@ -291,6 +414,7 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         if os.path.exists(self.destdir):
             shutil.rmtree(self.destdir)
 
+        self.patch(remotetransfer, '_threadPool', NonThreadPool())
         return self.setUpBuildStep()
 
     def tearDown(self):
@@ -316,6 +440,40 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    def testCompressZlib(self):
+        self.setupStep(
+            transfer.DirectoryUpload(workersrc="srcdir", masterdest=self.destdir,
+                                     compress='zlib'))
+
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                workersrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress='zlib', maxsize=None,
+                writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS,
+                           state_string="uploading srcdir")
+        return self.runStep()
+
+    def testCompressZlibWorker3_0(self):
+        self.setupStep(
+            transfer.DirectoryUpload(workersrc="srcdir", masterdest=self.destdir,
+                                     compress='zlib'),
+            worker_version={'*': '3.0'})
+
+        # older workers don't know zlib, so they get gz
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                workersrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress='gz', maxsize=None,
+                writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS,
+                           state_string="uploading srcdir")
+        return self.runStep()
+
     def testWorker2_16(self):
         self.setupStep(
             transfer.DirectoryUpload(
@@ -425,6 +583,7 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
         if os.path.exists(self.destdir):
             shutil.rmtree(self.destdir)
 
+        self.patch(remotetransfer, '_threadPool', NonThreadPool())
         return self.setUpBuildStep()
 
     def tearDown(self):
@@ -433,6 +592,77 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
 
         return self.tearDownBuildStep()
 
+    def testConstructorCasdirKeepstamp(self):
+        self.assertRaises(config.ConfigErrors, lambda:
+                          transfer.MultipleFileUpload(
+                              workersrcs=["srcfile"], masterdest=self.destdir,
+                              casdir='cas', keepstamp=True))
+
+    def testCasdir(self):
+        casdir = os.path.abspath('casdir')
+        self.addCleanup(shutil.rmtree, casdir, True)
+        self.setupStep(
+            transfer.MultipleFileUpload(workersrcs=["srcfile", "srcdir"],
+                                        masterdest=self.destdir,
+                                        casdir=casdir))
+
+        self.expectCommands(
+            Expect('stat', dict(file="srcfile",
+                                workdir='wkdir'))
+            + Expect.update('stat', [stat.S_IFREG, 99, 99])
+            + 0,
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False, dedup=True,
+                writer=ExpectRemoteRef(remotetransfer.ContentStoreWriter)))
+            + Expect.behavior(uploadContents(**{'': "Hello world!"}))
+            + 0,
+            Expect('stat', dict(file="srcdir",
+                                workdir='wkdir'))
+            + Expect.update('stat', [stat.S_IFDIR, 99, 99])
+            + 0,
+            Expect('uploadDirectory', dict(
+                workersrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress=None, maxsize=None, dedup=True,
+                writer=ExpectRemoteRef(remotetransfer.ContentStoreWriter)))
+            + Expect.behavior(uploadContents(test="Hello world!",
+                                             other="Other"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, state_string="uploading 2 files")
+        d = self.runStep()
+
+        @d.addCallback
+        def checkFiles(_):
+            for path in (('srcfile',), ('srcdir', 'test'),
+                         ('srcdir', 'other')):
+                self.assertTrue(
+                    os.path.exists(os.path.join(self.destdir, *path)))
+        return d
+
+    def testCasdirWorker3_4(self):
+        self.setupStep(
+            transfer.MultipleFileUpload(workersrcs=["srcfile"],
+                                        masterdest=self.destdir,
+                                        casdir='casdir'),
+            worker_version={'*': '3.4'})
+
+        # older workers send the files as usual
+        self.expectCommands(
+            Expect('stat', dict(file="srcfile",
+                                workdir='wkdir'))
+            + Expect.update('stat', [stat.S_IFREG, 99, 99])
+            + 0,
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, state_string="uploading 1 file")
+        return self.runStep()
+
     def testEmpty(self):
         self.setupStep(
             transfer.MultipleFileUpload(workersrcs=[], masterdest=self.destdir))
@@ -817,6 +1047,51 @@ class TestFileDownload(steps.BuildStepMixin, unittest.TestCase):
 
         return d
 
+    def testWindow(self):
+        master_file = __file__
+        self.setupStep(
+            transfer.FileDownload(
+                mastersrc=master_file, workerdest=self.destfile, window=4))
+
+        read = []
+
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                workerdest=self.destfile, workdir='wkdir',
+                blocksize=16384, maxsize=None, mode=None, window=4,
+                reader=ExpectRemoteRef(remotetransfer.FileReader)))
+            + Expect.behavior(downloadString(read.append))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS,
+            state_string="downloading to {0}".format(
+                os.path.basename(self.destfile)))
+        return self.runStep()
+
+    def testChecksums(self):
+        master_file = __file__
+        self.setupStep(
+            transfer.FileDownload(
+                mastersrc=master_file, workerdest=self.destfile,
+                checksums=True))
+
+        read = []
+
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                workerdest=self.destfile, workdir='wkdir',
+                blocksize=16384, maxsize=None, mode=None, checksums=True,
+                reader=ExpectRemoteRef(remotetransfer.FileReader)))
+            + Expect.behavior(downloadString(read.append))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS,
+            state_string="downloading to {0}".format(
+                os.path.basename(self.destfile)))
+        return self.runStep()
+
     def testBasicWorker2_16(self):
         master_file = __file__
         self.setupStep(
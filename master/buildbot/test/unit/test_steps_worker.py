@@ -242,6 +242,29 @@ class TestRemoveDirectory(steps.BuildStepMixin, unittest.TestCase):
                            state_string="Deleted")
         return self.runStep()
 
+    def test_background_parallel(self):
+        self.setupStep(worker.RemoveDirectory(dir=["d", "e"], background=True,
+                                              parallel=True, threads=8))
+        self.expectCommands(
+            Expect('rmdir', {'dir': ['d', 'e'], 'background': True,
+                             'parallel': True, 'threads': 8})
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS,
+                           state_string="Deleted")
+        return self.runStep()
+
+    def test_background_old_worker(self):
+        self.setupStep(worker.RemoveDirectory(dir="d", background=True),
+                       worker_version={'*': '3.2'})
+        self.expectCommands(
+            Expect('rmdir', {'dir': 'd'})
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS,
+                           state_string="Deleted")
+        return self.runStep()
+
 
 class TestMakeDirectory(steps.BuildStepMixin, unittest.TestCase):
 
@@ -0,0 +1,85 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+from twisted.trial import unittest
+
+from buildbot.util.accumulator import Accumulator
+
+
+class TestAccumulator(unittest.TestCase):
+
+    def test_empty(self):
+        acc = Accumulator()
+        self.assertEqual(acc.getvalue(), '')
+        self.assertEqual(len(acc), 0)
+
+    def test_append(self):
+        acc = Accumulator()
+        for chunk in ['abc', '', 'def', 'g']:
+            acc.append(chunk)
+        self.assertEqual(acc.getvalue(), 'abcdefg')
+        self.assertEqual(len(acc), 7)
+        self.assertFalse(acc.truncated)
+
+    def test_append_after_getvalue(self):
+        acc = Accumulator()
+        acc.append('abc')
+        acc.append('def')
+        self.assertEqual(acc.getvalue(), 'abcdef')
+        acc.append('gh')
+        self.assertEqual(acc.getvalue(), 'abcdefgh')
+
+    def test_maxSize(self):
+        acc = Accumulator(maxSize=5)
+        acc.append('abc')
+        self.assertFalse(acc.truncated)
+        acc.append('def')
+        acc.append('ghi')
+        self.assertEqual(acc.getvalue(), 'abcde')
+        self.assertEqual(len(acc), 5)
+        self.assertTrue(acc.truncated)
+
+    def test_spill(self):
+        acc = Accumulator(spillSize=4)
+        acc.append('abc')
+        self.assertEqual(acc._file, None)
+        acc.append('def')
+        self.assertNotEqual(acc._file, None)
+        acc.append('ghi')
+        self.assertEqual(acc.getvalue(), 'abcdefghi')
+        acc.append('j')
+        self.assertEqual(acc.getvalue(), 'abcdefghij')
+        acc.close()
+
+    def test_spill_unicode(self):
+        acc = Accumulator(spillSize=2)
+        acc.append(u'\N{SNOWMAN}\N{SNOWMAN}')
+        acc.append(u'\N{COMET}')
+        self.assertEqual(acc.getvalue(), u'\N{SNOWMAN}\N{SNOWMAN}\N{COMET}')
+        self.assertEqual(len(acc), 3)
+        acc.close()
+
+    def test_spill_bytes(self):
+        acc = Accumulator(spillSize=2)
+        acc.append(b'\x00\xff\x01')
+        self.assertEqual(acc.getvalue(), b'\x00\xff\x01')
+        acc.close()
+
+    def test_spill_and_maxSize(self):
+        acc = Accumulator(maxSize=6, spillSize=2)
+        acc.append('abcd')
+        acc.append('efgh')
+        self.assertEqual(acc.getvalue(), 'abcdef')
+        self.assertTrue(acc.truncated)
+        acc.close()
@@ -88,3 +88,27 @@ class Matcher(unittest.TestCase):
         self.m[('abc', 'efg')] = 3
         self.assertEqual(self.m[('abc', 'def')], (2, {}))
         self.assertEqual(self.m[('abc', 'efg')], (3, {}))
+
+    def test_literal_before_capture(self):
+        self.m[('A', ':a')] = 'capture'
+        self.m[('A', 'list')] = 'literal'
+        self.assertEqual(self.m[('A', 'list')], ('literal', {}))
+        self.assertEqual(self.m[('A', 'x')], ('capture', dict(a='x')))
+
+    def test_backtracking(self):
+        self.m[('A', 'b', 'C')] = 'literal'
+        self.m[('A', 'i:a', 'D')] = 'ident'
+        self.m[('A', ':x', 'E', ':y')] = 'any'
+        self.assertEqual(self.m[('A', 'b', 'D')], ('ident', dict(a='b')))
+        self.assertEqual(self.m[('A', 'b', 'E', 'f')],
+                         ('any', dict(x='b', y='f')))
+        self.assertRaises(KeyError, lambda: self.m[('A', 'b', 'F')])
+
+    def test_empty_path(self):
+        self.m[()] = 'root'
+        self.m[('A',)] = 'A'
+        self.assertEqual(self.m[()], ('root', {}))
+
+    def test_no_such_type_flag(self):
+        self.m[('A', 'x:a')] = 'AB'
+        self.assertRaises(AssertionError, lambda: self.m[('A', 'b')])
@@ -28,3 +28,47 @@ class MatchTuple(tuplematching.TupleMatchingMixin, unittest.TestCase):
                          % (routingKey,
                             'should match' if shouldMatch else "shouldn't match",
                             filter))
+
+
+class TupleTrie(tuplematching.TupleMatchingMixin, unittest.TestCase):
+
+    # called by the TupleMatchingMixin methods
+
+    def do_test_match(self, routingKey, shouldMatch, filter):
+        trie = tuplematch.TupleTrie()
+        trie.add(filter, 'value')
+        result = trie.match(routingKey) == ['value']
+        self.assertEqual(shouldMatch, result, '%r %s %r'
+                         % (routingKey,
+                            'should match' if shouldMatch else "shouldn't match",
+                            filter))
+
+    def test_match_order(self):
+        trie = tuplematch.TupleTrie()
+        trie.add(('a', None), 1)
+        trie.add(('a', 'b'), 2)
+        trie.add((None, 'b'), 3)
+        trie.add(('a', None), 4)
+        trie.add(('x', 'b'), 5)
+        self.assertEqual(trie.match(('a', 'b')), [1, 2, 3, 4])
+        self.assertEqual(trie.match(('a', 'c')), [1, 4])
+        self.assertEqual(trie.match(('a',)), [])
+
+    def test_remove(self):
+        trie = tuplematch.TupleTrie()
+        v1, v2 = object(), object()
+        trie.add(('a', None), v1)
+        trie.add(('a', None), v2)
+        trie.remove(('a', None), v1)
+        self.assertEqual(trie.match(('a', 'b')), [v2])
+        trie.remove(('a', None), v2)
+        self.assertEqual(trie.match(('a', 'b')), [])
+        # empty branches are pruned
+        self.assertEqual(trie._roots, {})
+
+    def test_remove_missing(self):
+        trie = tuplematch.TupleTrie()
+        trie.add(('a', 'b'), 1)
+        self.assertRaises(ValueError, trie.remove, ('a', 'b'), 2)
+        self.assertRaises(ValueError, trie.remove, ('a', 'c'), 1)
+        self.assertRaises(ValueError, trie.remove, ('a',), 1)
@@ -25,6 +25,7 @@ import mock
 from twisted.internet import defer
 from twisted.trial import unittest
 
+from buildbot.process import metrics
 from buildbot.test.fake import endpoint
 from buildbot.test.util import www
 from buildbot.util import json
@@ -304,6 +305,15 @@ class V2RootResource_REST(www.WwwTestMixin, unittest.TestCase):
             responseCode=200,
             headers={"content-disposition": ['attachment; filename=test.txt']})
 
+    @defer.inlineCallbacks
+    def test_raw_stream(self):
+        yield self.render_resource(self.rsrc, '/rawstreamtest')
+        self.assertRequest(
+            content="value",
+            contentType='text/test; charset=utf-8',
+            responseCode=200,
+            headers={"content-disposition": ['attachment; filename=test.txt']})
+
     @defer.inlineCallbacks
     def test_api_head(self):
         get = yield self.render_resource(self.rsrc, '/test', method='GET')
@@ -454,6 +464,18 @@ class V2RootResource_REST(www.WwwTestMixin, unittest.TestCase):
                                                key=lambda v: v['info']),
                                   total=8, orderSignificant=True)
 
+    @defer.inlineCallbacks
+    def test_api_collection_counts_python_fallback(self):
+        countEvent = mock.Mock()
+        self.patch(metrics, 'MetricCountEvent', countEvent)
+        yield self.render_resource(self.rsrc, '/test')
+        self.assertFalse(countEvent.log.called)
+
+        # the test endpoint leaves ordering to ResultSpec.apply
+        yield self.render_resource(self.rsrc, '/test?order=info')
+        countEvent.log.assert_called_once_with(
+            "DataConnector.resultspec-fallback.TestsEndpoint")
+
     @defer.inlineCallbacks
     def test_api_collection_order_on_unselected(self):
         yield self.render_resource(self.rsrc, '/test?field=id&order=info')
@@ -807,3 +829,44 @@ class ContentTypeParser(unittest.TestCase):
     def test_text(self):
         self.assertEqual(
             rest.ContentTypeParser("text/plain; Charset=UTF-8").gettype(), "text/plain")
+
+
+class StreamProducer(unittest.TestCase):
+
+    def setUp(self):
+        self.request = mock.Mock()
+        self.stream = endpoint.FakeStream([u'a', u'b', u'c'])
+        self.producer = rest.StreamProducer(self.stream, self.request)
+
+    @defer.inlineCallbacks
+    def test_produce(self):
+        yield self.producer.produce()
+        self.request.registerProducer.assert_called_with(self.producer, True)
+        self.assertEqual(self.request.write.call_args_list,
+                         [mock.call(b'a'), mock.call(b'b'), mock.call(b'c')])
+        self.request.unregisterProducer.assert_called_with()
+
+    def test_pause_resume(self):
+        written = []
+
+        def write(data):
+            written.append(data)
+            # the request buffer is full after each write
+            self.producer.pauseProducing()
+        self.request.write = write
+        d = self.producer.produce()
+        self.assertEqual(written, [b'a'])
+        self.producer.resumeProducing()
+        self.assertEqual(written, [b'a', b'b'])
+        self.producer.resumeProducing()
+        self.producer.resumeProducing()
+        self.assertEqual(written, [b'a', b'b', b'c'])
+        return d
+
+    def test_stop(self):
+        self.request.write = lambda data: self.producer.pauseProducing()
+        d = self.producer.produce()
+        self.producer.stopProducing()
+        self.assertEqual(self.stream.parts, [u'b', u'c'])
+        self.request.unregisterProducer.assert_called_with()
+        return d
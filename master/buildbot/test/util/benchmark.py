@@ -0,0 +1,47 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+
+from twisted.python import log
+from twisted.trial import unittest
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    # benchmarks take a while and their results are only interesting to a
+    # human, so they only run when asked to
+    if 'BUILDBOT_BENCHMARK' not in os.environ:
+        skip = "set BUILDBOT_BENCHMARK to run benchmarks"
+
+    def report(self, name, elapsed, count=None, size=None):
+        msg = "%s: %.3fs" % (name, elapsed)
+        if count:
+            msg += ", %.1fus/op" % (elapsed * 1e6 / count)
+        if size:
+            msg += ", %.1fMB/s" % (size / (1024 * 1024) / elapsed)
+        log.msg(msg)
+        print(msg)
+
+    def timeit(self, name, fn, count=1, size=None):
+        start = time.time()
+        for _ in range(count):
+            fn()
+        elapsed = time.time() - start
+        self.report(name, elapsed, count=count, size=size)
+        return elapsed
@@ -44,6 +44,7 @@ class FakeRequest(object):
     redirected_to = None
     rendered_resource = None
     failure = None
+    producer = None
     method = 'GET'
     path = '/req.path'
     responseCode = 200
@@ -70,6 +71,12 @@ class FakeRequest(object):
     def redirect(self, url):
         self.redirected_to = url
 
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
     def render(self, rsrc):
         rendered_resource = rsrc
         self.deferred.callback(rendered_resource)
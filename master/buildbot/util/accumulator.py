@@ -0,0 +1,92 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+from future.utils import text_type
+
+import tempfile
+
+
+class Accumulator(object):
+
+    """
+    Collect a stream of string chunks in linear time.
+
+    Chunks are kept in a list and only joined when the value is asked for.
+    If C{maxSize} is given, data past that many characters is dropped and
+    C{truncated} is set.  If C{spillSize} is given, the data is moved to a
+    temporary file once it grows past that many characters, so that huge
+    outputs do not have to be held in memory while they are collected.
+    """
+
+    def __init__(self, maxSize=None, spillSize=None):
+        self.maxSize = maxSize
+        self.spillSize = spillSize
+        self.size = 0
+        self.truncated = False
+        self._chunks = []
+        self._file = None
+        self._text = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, data):
+        if not data:
+            return
+        if self.maxSize is not None:
+            if self.size >= self.maxSize:
+                self.truncated = True
+                return
+            if self.size + len(data) > self.maxSize:
+                data = data[:self.maxSize - self.size]
+                self.truncated = True
+        if self._text is None:
+            self._text = isinstance(data, text_type)
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(self._encode(data))
+            return
+        self._chunks.append(data)
+        if self.spillSize is not None and self.size > self.spillSize:
+            self._spill()
+
+    def getvalue(self):
+        if self._file is not None:
+            self._file.seek(0)
+            data = self._file.read()
+            self._file.seek(0, 2)
+            return data.decode('utf-8') if self._text else data
+        if not self._chunks:
+            return u'' if self._text else ''
+        if len(self._chunks) > 1:
+            # keep the joined value, so that reading it repeatedly is cheap
+            self._chunks = [self._chunks[0][:0].join(self._chunks)]
+        return self._chunks[0]
+
+    def close(self):
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _encode(self, data):
+        if isinstance(data, text_type):
+            return data.encode('utf-8')
+        return data
+
+    def _spill(self):
+        self._file = tempfile.TemporaryFile(prefix='buildbot-accumulator-')
+        for chunk in self._chunks:
+            self._file.write(self._encode(chunk))
+        self._chunks = []
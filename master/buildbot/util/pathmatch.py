@@ -25,8 +25,33 @@ def ident(x):
     raise TypeError
 
 
+class _Node(object):
+
+    def __init__(self):
+        # child nodes for literal path elements
+        self.literals = {}
+        # (type_fn, arg_name, child node) for captured path elements
+        self.captures = []
+        self.hasValue = False
+        self.value = None
+
+
 class Matcher(object):
 
+    """
+    Map path patterns to values.
+
+    Patterns are tuples of path elements.  An element of the form
+    C{[t]:name} captures the corresponding path element as keyword argument
+    C{name}, converted by the type function for C{t}, if given; any other
+    element must match literally.
+
+    The patterns are compiled into a trie with one level per path element,
+    so that a lookup costs time proportional to the length of the path
+    rather than to the number of patterns.  Literal elements are tried
+    before captures, and typed captures before untyped ones.
+    """
+
     def __init__(self):
         self._patterns = {}
         self._dirty = True
@@ -46,38 +71,64 @@ class Matcher(object):
         if self._dirty:
             self._compile()
 
-        patterns = self._by_length.get(len(path), {})
-        for pattern in patterns:
-            kwargs = {}
-            for pattern_elt, path_elt in zip(pattern, path):
-                mo = self.path_elt_re.match(pattern_elt)
-                if mo:
-                    type_flag, arg_name = mo.groups()
-                    if type_flag:
-                        try:
-                            type_fn = self.type_fns[type_flag]
-                        except Exception:
-                            assert type_flag in self.type_fns, \
-                                "no such type flag %s" % type_flag
-                        try:
-                            path_elt = type_fn(path_elt)
-                        except Exception:
-                            break
-                    kwargs[arg_name] = path_elt
-                else:
-                    if pattern_elt != path_elt:
-                        break
-            else:
-                # complete match
-                return patterns[pattern], kwargs
-        else:
+        kwargs = {}
+        node = self._match(self._root, path, 0, kwargs)
+        if node is None:
             raise KeyError('No match for %r' % (path,))
+        return node.value, kwargs
+
+    def _match(self, node, path, i, kwargs):
+        if i == len(path):
+            return node if node.hasValue else None
+        path_elt = path[i]
+        child = node.literals.get(path_elt)
+        if child is not None:
+            found = self._match(child, path, i + 1, kwargs)
+            if found is not None:
+                return found
+        for type_fn, arg_name, child in node.captures:
+            if type_fn is None:
+                value = path_elt
+            else:
+                try:
+                    value = type_fn(path_elt)
+                except Exception:
+                    continue
+            found = self._match(child, path, i + 1, kwargs)
+            if found is not None:
+                kwargs[arg_name] = value
+                return found
+        return None
 
     def iterPatterns(self):
         return list(iteritems(self._patterns))
 
     def _compile(self):
-        self._by_length = {}
-        for k, v in self.iterPatterns():
-            l = len(k)
-            self._by_length.setdefault(l, {})[k] = v
+        self._root = _Node()
+        for pattern, value in self.iterPatterns():
+            node = self._root
+            for pattern_elt in pattern:
+                mo = self.path_elt_re.match(pattern_elt)
+                if mo:
+                    node = self._captureChild(node, *mo.groups())
+                else:
+                    node = node.literals.setdefault(pattern_elt, _Node())
+            node.hasValue = True
+            node.value = value
+        self._dirty = False
+
+    def _captureChild(self, node, type_flag, arg_name):
+        if type_flag:
+            assert type_flag in self.type_fns, \
+                "no such type flag %s" % type_flag
+            type_fn = self.type_fns[type_flag]
+        else:
+            type_fn = None
+        for capture in node.captures:
+            if capture[:2] == (type_fn, arg_name):
+                return capture[2]
+        child = _Node()
+        node.captures.append((type_fn, arg_name, child))
+        # typed captures are tried first, since they are pickier
+        node.captures.sort(key=lambda capture: capture[0] is None)
+        return child
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import itertools
+from operator import itemgetter
 
 
 def matchTuple(routingKey, filter):
@@ -23,3 +24,107 @@ def matchTuple(routingKey, filter):
         if f is not None and f != k:
             return False
     return True
+
+
+class _TrieNode(object):
+
+    __slots__ = ['children', 'wildcard', 'values']
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.values = []
+
+    def isEmpty(self):
+        return not (self.children or self.wildcard or self.values)
+
+
+class TupleTrie(object):
+
+    """
+    A collection of values, each registered with a filter as accepted by
+    L{matchTuple}.  The filters are kept in a trie keyed by tuple position,
+    with a separate branch for C{None} wildcards, so that finding the values
+    matching a routing key costs time proportional to the number of matching
+    branches rather than to the number of filters.
+
+    Matching values are returned in the order in which they were added.
+    """
+
+    def __init__(self):
+        self._roots = {}
+        self._seq = itertools.count()
+
+    def add(self, filter, value):
+        node = self._roots.get(len(filter))
+        if node is None:
+            node = self._roots[len(filter)] = _TrieNode()
+        for f in filter:
+            if f is None:
+                if node.wildcard is None:
+                    node.wildcard = _TrieNode()
+                node = node.wildcard
+            else:
+                child = node.children.get(f)
+                if child is None:
+                    child = node.children[f] = _TrieNode()
+                node = child
+        node.values.append((next(self._seq), value))
+
+    def remove(self, filter, value):
+        """
+        Remove a value added with the given filter; raises ValueError if it
+        is not present.
+        """
+        node = self._roots.get(len(filter))
+        path = []
+        for f in filter:
+            if node is None:
+                break
+            path.append((node, f))
+            node = node.wildcard if f is None else node.children.get(f)
+        if node is None:
+            raise ValueError("%r is not registered with filter %r"
+                             % (value, filter))
+        for i, (_, v) in enumerate(node.values):
+            if v is value:
+                del node.values[i]
+                break
+        else:
+            raise ValueError("%r is not registered with filter %r"
+                             % (value, filter))
+
+        # prune the branches that are now empty
+        while path and node.isEmpty():
+            parent, f = path.pop()
+            if f is None:
+                parent.wildcard = None
+            else:
+                del parent.children[f]
+            node = parent
+        if node.isEmpty():
+            del self._roots[len(filter)]
+
+    def match(self, routingKey):
+        node = self._roots.get(len(routingKey))
+        if node is None:
+            return []
+        nodes = [node]
+        for k in routingKey:
+            next_nodes = []
+            for node in nodes:
+                child = node.children.get(k)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.wildcard is not None:
+                    next_nodes.append(node.wildcard)
+            if not next_nodes:
+                return []
+            nodes = next_nodes
+        if len(nodes) == 1:
+            return [v for _, v in nodes[0].values]
+        values = []
+        for node in nodes:
+            values.extend(node.values)
+        values.sort(key=itemgetter(0))
+        return [v for _, v in values]
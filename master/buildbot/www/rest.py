@@ -23,8 +23,10 @@ import re
 from contextlib import contextmanager
 
 from twisted.internet import defer
+from twisted.internet.interfaces import IPushProducer
 from twisted.python import log
 from twisted.web.error import Error
+from zope.interface import implementer
 
 from buildbot.data import exceptions
 from buildbot.data import resultspec
@@ -96,6 +98,52 @@ JSONRPC_CODES = dict(parse_error=-32700,
                      internal_error=-32603)
 
 
+@implementer(IPushProducer)
+class StreamProducer(object):
+
+    """
+    Write the parts of a stream (see L{buildbot.data.logchunks.RawLogStream})
+    to a request, fetching the next part only when the request is ready for
+    more data.
+    """
+
+    def __init__(self, stream, request):
+        self.stream = stream
+        self.request = request
+        self.paused = None
+        self.stopped = False
+
+    @defer.inlineCallbacks
+    def produce(self):
+        self.request.registerProducer(self, True)
+        try:
+            while not self.stopped:
+                if self.paused is not None:
+                    yield self.paused
+                    continue
+                part = yield self.stream.getNext()
+                if part is None or self.stopped:
+                    break
+                self.request.write(part.encode('utf-8'))
+        finally:
+            self.request.unregisterProducer()
+
+    # IPushProducer
+
+    def pauseProducing(self):
+        if self.paused is None:
+            self.paused = defer.Deferred()
+
+    def resumeProducing(self):
+        paused, self.paused = self.paused, None
+        if paused is not None:
+            paused.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+
 class V2RootResource(resource.Resource):
 
     # For GETs, this API follows http://jsonapi.org.  The getter API does not
@@ -320,12 +368,19 @@ class V2RootResource(resource.Resource):
         return rspec
 
     def encodeRaw(self, data, request):
+        self.encodeRawHeaders(data, request)
+        request.write(data['raw'].encode('utf-8'))
+        return
+
+    def encodeRawStream(self, data, request):
+        self.encodeRawHeaders(data, request)
+        return StreamProducer(data['stream'], request).produce()
+
+    def encodeRawHeaders(self, data, request):
         request.setHeader("content-type",
                           data['mime-type'].encode() + '; charset=utf-8')
         request.setHeader("content-disposition",
                           'attachment; filename=' + data['filename'].encode())
-        request.write(data['raw'].encode('utf-8'))
-        return
 
     @defer.inlineCallbacks
     def renderRest(self, request):
@@ -340,18 +395,26 @@ class V2RootResource(resource.Resource):
             ep, kwargs = self.getEndpoint(request)
 
             rspec = self.decodeResultSpec(request, ep)
-            data = yield ep.get(rspec, kwargs)
+            if ep.isStreamable:
+                data = yield ep.getStream(rspec, kwargs)
+            else:
+                data = yield ep.get(rspec, kwargs)
             if data is None:
                 writeError(("not found while getting from %s with "
                             "arguments %s and %s") % (repr(ep), repr(rspec),
                                                       str(kwargs)), errcode=404)
                 return
 
+            if ep.isStreamable:
+                yield self.encodeRawStream(data, request)
+                return
+
             if ep.isRaw:
                 self.encodeRaw(data, request)
                 return
 
             # post-process any remaining parts of the resultspec
+            rspec.countFallback(ep)
             data = rspec.apply(data)
 
             # annotate the result with some metadata
@@ -186,6 +186,7 @@ setup_args = {
         "buildbot.test",
         "buildbot.test.util",
         "buildbot.test.fake",
+        "buildbot.test.benchmark",
         "buildbot.test.fuzz",
         "buildbot.test.integration",
         "buildbot.test.regressions",
@@ -58,9 +58,18 @@ class WorkerForBuilderBase(service.Service):
 
     bf = None
 
+    # updates are sent to the master right away while fewer than
+    # maxUpdatesInFlight 'update' calls are waiting for an answer; beyond
+    # that they are queued, and sent together (up to maxUpdatesPerCall in a
+    # call) as soon as an answer comes back
+    maxUpdatesInFlight = 2
+    maxUpdatesPerCall = 64
+
     def __init__(self, name):
         # service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self.pendingUpdates = []
+        self.updatesInFlight = 0
 
     def __repr__(self):
         return "<WorkerForBuilder '%s' at %d>" % (self.name, id(self))
@@ -108,6 +117,7 @@ class WorkerForBuilderBase(service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self.pendingUpdates = []
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -140,6 +150,8 @@ class WorkerForBuilderBase(service.Service):
         self.command = factory(self, stepId, args)
 
         log.msg(" startCommand:%s [id %s]" % (command, stepId))
+        # updates left over from an earlier command are not for this step
+        self.pendingUpdates = []
         self.remoteStep = stepref
         self.remoteStep.notifyOnDisconnect(self.lostRemoteStep)
         d = self.command.doStart()
@@ -173,9 +185,9 @@ class WorkerForBuilderBase(service.Service):
     def sendUpdate(self, data):
         """This sends the status update to the master-side
         L{buildbot.process.step.RemoteCommand} object, giving it a sequence
-        number in the process. It adds the update to a queue, and asks the
-        master to acknowledge the update so it can be removed from that
-        queue."""
+        number in the process. It adds the update to a queue, which is sent
+        to the master at once unless too many earlier updates are still
+        waiting for the master to acknowledge them."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
@@ -186,12 +198,30 @@ class WorkerForBuilderBase(service.Service):
         # master still expects to receive. Provide it to avoid significant
         # interoperability issues between new workers and old masters.
         if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
+            self.pendingUpdates.append([data, 0])
+            self.sendPendingUpdates()
+
+    def sendPendingUpdates(self, force=False):
+        """Send the queued updates in as few calls as allowed, or all of them
+        right away if C{force} is true."""
+        if not self.remoteStep:
+            self.pendingUpdates = []
+            return
+        while self.pendingUpdates and (
+                force or self.updatesInFlight < self.maxUpdatesInFlight):
+            updates = self.pendingUpdates[:self.maxUpdatesPerCall]
+            del self.pendingUpdates[:self.maxUpdatesPerCall]
+            self.updatesInFlight += 1
             d = self.remoteStep.callRemote("update", updates)
+            d.addBoth(self._updateAnswered)
             d.addCallback(self.ackUpdate)
             d.addErrback(self._ackFailed, "WorkerForBuilder.sendUpdate")
 
+    def _updateAnswered(self, res):
+        self.updatesInFlight -= 1
+        self.sendPendingUpdates()
+        return res
+
     def ackUpdate(self, acknum):
         self.activity()  # update the "last activity" timer
 
@@ -219,6 +249,8 @@ class WorkerForBuilderBase(service.Service):
             log.msg(" but we weren't running, quitting silently")
             return
         if self.remoteStep:
+            # the last updates must reach the master before 'complete'
+            self.sendPendingUpdates(force=True)
             self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
             d = self.remoteStep.callRemote("complete", failure)
             d.addCallback(self.ackComplete)
@@ -36,7 +36,7 @@ from buildbot_worker.interfaces import IWorkerCommand
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "3.0"
+command_version = "3.5"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -79,6 +79,17 @@ command_version = "3.0"
 #      uploadDirectory commands.
 #    * "slavedest" command argument renamed to "workerdest" in downloadFile
 #      command.
+#  >= 3.1: uploadFile, uploadDirectory and downloadFile accept 'window', the
+#          number of blocks to keep in flight; uploadDirectory sends the
+#          archive while it is built, and accepts compress='zlib'
+#  >= 3.2: shell accepts 'segments', and then sends interleaved stdout,
+#          stderr, header and logfile data in one 'segments' update
+#  >= 3.3: rmdir accepts 'threads', 'parallel' and 'background' to remove
+#          trees in-process with a pool of threads
+#  >= 3.4: uploadFile and downloadFile accept 'checksums', to check every
+#          block and the whole file, and resume interrupted transfers
+#  >= 3.5: uploadFile and uploadDirectory accept 'dedup', to send a manifest
+#          of file digests and then only the files the master is missing
 
 
 @implementer(IWorkerCommand)
@@ -19,11 +19,14 @@ import shutil
 import sys
 
 from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
 from twisted.internet import threads
 from twisted.python import log
 from twisted.python import runtime
 
 from buildbot_worker import runprocess
+from buildbot_worker import util
 from buildbot_worker.commands import base
 from buildbot_worker.commands import utils
 
@@ -49,6 +52,54 @@ class MakeDirectory(base.Command):
             self.sendStatus({'rc': e.errno})
 
 
+# trash directories that are being removed in the background
+_backgroundRemovals = set()
+
+
+@defer.inlineCallbacks
+def removeInBackground(trash, threads, _reactor=reactor):
+    """
+    Remove the given trash directories after the command that moved them
+    aside has finished, along with any trash left next to them by an earlier
+    worker that did not get to finish.  Progress goes to the worker log.
+    """
+    trash = list(trash)
+    for parent in set(os.path.dirname(t) for t in trash):
+        for stale in glob.glob(os.path.join(parent, utils.TRASH_PREFIX + '*')):
+            if stale not in trash and stale not in _backgroundRemovals:
+                trash.append(stale)
+    if not trash:
+        return
+    _backgroundRemovals.update(trash)
+
+    remover = utils.TreeRemover(threads=threads, _reactor=_reactor)
+    # the reactor waits for the threads to be done before shutting down
+    trigger = _reactor.addSystemEventTrigger('before', 'shutdown',
+                                             remover.stop)
+
+    def progress():
+        log.msg("RemoveDirectory: removed %d files and %d directories "
+                "from %s so far" % (remover.files, remover.dirs,
+                                    ", ".join(trash)))
+    progressReporter = task.LoopingCall(progress)
+    progressReporter.clock = _reactor
+    progressReporter.start(RemoveDirectory.PROGRESS_INTERVAL, now=False)
+
+    try:
+        yield defer.gatherResults([remover.remove(t) for t in trash],
+                                  consumeErrors=True)
+    except Exception:
+        log.err(None, "RemoveDirectory: error removing %s in the background"
+                % (", ".join(trash),))
+    finally:
+        progressReporter.stop()
+        remover.stop()
+        _reactor.removeSystemEventTrigger(trigger)
+        _backgroundRemovals.difference_update(trash)
+    log.msg("RemoveDirectory: removed %d files and %d directories from %s"
+            % (remover.files, remover.dirs, ", ".join(trash)))
+
+
 class RemoveDirectory(base.Command):
 
     header = "rmdir"
@@ -56,8 +107,18 @@ class RemoveDirectory(base.Command):
     # args['dir'] is relative to Builder directory, and is required.
     requiredArgs = ['dir']
 
+    # how often to report how far an in-process removal got, in seconds
+    PROGRESS_INTERVAL = 10
+    # threads used for in-process removal when args['threads'] is not given
+    DEFAULT_THREADS = 4
+
     def setup(self, args):
         self.logEnviron = args.get('logEnviron', True)
+        self.background = args.get('background', False)
+        self.parallel = args.get('parallel', False)
+        self.threads = args.get('threads')
+        self.remover = None
+        self.backgroundRemoval = None
 
     @defer.inlineCallbacks
     def start(self):
@@ -67,20 +128,106 @@ class RemoveDirectory(base.Command):
         self.timeout = args.get('timeout', 120)
         self.maxTime = args.get('maxTime', None)
         self.rc = 0
-        if isinstance(dirnames, list):
-            assert len(dirnames) != 0
+        if not isinstance(dirnames, list):
+            dirnames = [dirnames]
+        assert len(dirnames) != 0
+
+        if self.background or self.parallel or self.threads:
+            # remove the trees in this process, with a pool of threads
+            results = yield self.removeInProcess(dirnames)
+        else:
+            results = []
             for dirname in dirnames:
                 res = yield self.removeSingleDir(dirname)
-                # Even if single removal of single file/dir consider it as
-                # failure of whole command, but continue removing other files
-                # Send 'rc' to master to handle failure cases
-                if res != 0:
-                    self.rc = res
-        else:
-            self.rc = yield self.removeSingleDir(dirnames)
+                results.append(res)
+
+        # Even if single removal of single file/dir consider it as
+        # failure of whole command, but continue removing other files
+        # Send 'rc' to master to handle failure cases
+        for res in results:
+            if res != 0:
+                self.rc = res
 
         self.sendStatus({'rc': self.rc})
 
+    def interrupt(self):
+        self.interrupted = True
+        if self.remover is not None:
+            self.remover.stop()
+
+    @defer.inlineCallbacks
+    def removeInProcess(self, dirnames):
+        paths = [os.path.join(self.builder.basedir, dirname)
+                 for dirname in dirnames]
+        if self.background:
+            # rename the trees aside first, so that the build can go on
+            # right away, and remove them after the command has finished
+            trash = []
+            foreground = []
+            for path in paths:
+                try:
+                    trashdir = utils.moveAside(path)
+                except OSError as e:
+                    log.msg("RemoveDirectory: cannot move %s aside (%s), "
+                            "removing it in place" % (path, e))
+                    foreground.append(path)
+                    continue
+                if trashdir is not None:
+                    self.sendStatus({'header': "moved %s to %s, removing it "
+                                     "in the background\n" % (path, trashdir)})
+                    trash.append(trashdir)
+            self.backgroundRemoval = removeInBackground(
+                trash, self.threads or self.DEFAULT_THREADS,
+                _reactor=self._reactor)
+            paths = foreground
+            if not paths:
+                defer.returnValue([])
+
+        self.remover = utils.TreeRemover(
+            threads=self.threads or self.DEFAULT_THREADS,
+            _reactor=self._reactor)
+        startTime = util.now(self._reactor)
+
+        def progress():
+            self.sendStatus({'header': "removed %d files and %d directories "
+                             "so far\n" % (self.remover.files,
+                                           self.remover.dirs)})
+        progressReporter = task.LoopingCall(progress)
+        progressReporter.clock = self._reactor
+        progressReporter.start(self.PROGRESS_INTERVAL, now=False)
+
+        def removed(_):
+            if self.interrupted:
+                # the tree was left half removed, as when rm -rf is killed
+                return -1  # rc=-1
+            return 0  # rc=0
+
+        def failed(f):
+            self.sendStatus(
+                {'header': 'exception from TreeRemover\n' + f.getTraceback()})
+            return -1  # rc=-1
+
+        try:
+            if self.parallel:
+                results = yield defer.gatherResults([
+                    self.remover.remove(path).addCallbacks(removed, failed)
+                    for path in paths])
+            else:
+                results = []
+                for path in paths:
+                    res = yield self.remover.remove(path).addCallbacks(
+                        removed, failed)
+                    results.append(res)
+        finally:
+            progressReporter.stop()
+            self.remover.stop()
+
+        elapsed = util.now(self._reactor) - startTime
+        self.sendStatus({'header': "removed %d files and %d directories "
+                         "in %.1fs\n" % (self.remover.files, self.remover.dirs,
+                                         elapsed)})
+        defer.returnValue(results)
+
     def removeSingleDir(self, dirname):
         self.dir = os.path.join(self.builder.basedir, dirname)
         if runtime.platformType != "posix":
@@ -42,6 +42,7 @@ class WorkerShellCommand(base.Command):
             logfiles=args.get('logfiles', {}),
             usePTY=args.get('usePTY', False),
             logEnviron=args.get('logEnviron', True),
+            sendSegments=args.get('segments', False),
         )
         if args.get('interruptSignal'):
             c.interruptSignal = args['interruptSignal']
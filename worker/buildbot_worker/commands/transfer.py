@@ -13,18 +13,33 @@
 #
 # Copyright Buildbot Team Members
 
+import hashlib
 import os
+import stat
 import tarfile
-import tempfile
+import threading
+import zlib
+from collections import deque
 
 from twisted.internet import defer
+from twisted.internet import threads
+from twisted.python import failure
 from twisted.python import log
 
 from buildbot_worker.commands.base import Command
+from buildbot_worker.util import BlockHasher
+
+
+class TransferChecksumError(Exception):
+    pass
 
 
 class TransferCommand(Command):
 
+    # number of blocks to keep in flight; the master only sends 'window' to
+    # workers that understand it
+    window = 1
+
     def finished(self, res):
         if self.debug:
             log.msg('finished: stderr=%r, rc=%r' % (self.stderr, self.rc))
@@ -47,6 +62,62 @@ class TransferCommand(Command):
         # now we wait for the next trip around the loop.  It abandon the file
         # when it sees self.interrupted set.
 
+    def _loop(self, fire_when_done):
+        self._inflight = 0
+        self._filling = False
+        self._finished = False
+        self._fillWindow(fire_when_done)
+        return None
+
+    def _fillWindow(self, fire_when_done):
+        # Start transferring blocks until self.window of them are in flight.
+        # Remote calls and their answers are delivered in order, so the
+        # blocks still arrive (and are written) in sequence.
+        if self._filling:
+            # a block completed synchronously; the loop below carries on
+            return
+        self._filling = True
+        try:
+            while not self._finished and self._inflight < self.window:
+                try:
+                    res = self._transferBlock()
+                except Exception:
+                    self._inflight += 1
+                    self._blockFailed(failure.Failure(), fire_when_done)
+                    break
+                if res is None:
+                    # nothing to send until a block in flight completes
+                    break
+                if not isinstance(res, defer.Deferred):
+                    self._finished = self._finished or res
+                    continue
+                self._inflight += 1
+                res.addCallbacks(self._blockDone, self._blockFailed,
+                                 callbackArgs=(fire_when_done,),
+                                 errbackArgs=(fire_when_done,))
+        finally:
+            self._filling = False
+        if self._finished and not self._inflight and not fire_when_done.called:
+            fire_when_done.callback(None)
+
+    def _blockDone(self, finished, fire_when_done):
+        self._inflight -= 1
+        if finished:
+            self._finished = True
+        self._fillWindow(fire_when_done)
+
+    def _blockFailed(self, why, fire_when_done):
+        self._inflight -= 1
+        self._finished = True
+        if not fire_when_done.called:
+            fire_when_done.errback(why)
+
+    def _transferBlock(self):
+        """Start transferring the next block.  Return True when done, None
+        when the next block has to wait for the ones in flight, or a
+        Deferred that fires with True when done."""
+        raise NotImplementedError
+
 
 class WorkerFileUploadCommand(TransferCommand):
 
@@ -60,6 +131,15 @@ class WorkerFileUploadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['keepstamp']: whether to preserve file modified and accessed times
+        - ['window']:    number of blocks to send without waiting for the
+                         master to acknowledge them
+        - ['checksums']: send the checksum of every block, and the digest of
+                         the whole file; the writer is then a
+                         ResumableFileWriter, and the upload carries on after
+                         the blocks it already has from an earlier attempt
+        - ['dedup']:     send a manifest of the SHA-256 digests of the files
+                         first, and then only the files the master does not
+                         have yet; the writer is then a ContentStoreWriter
     """
     debug = False
     requiredArgs = ['workdir', 'workersrc', 'writer', 'blocksize']
@@ -71,6 +151,10 @@ class WorkerFileUploadCommand(TransferCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.keepstamp = args.get('keepstamp', False)
+        self.window = args.get('window', 1)
+        self.checksums = args.get('checksums', False)
+        self.dedup = args.get('dedup', False)
+        self.hasher = None
         self.stderr = None
         self.rc = 0
 
@@ -82,6 +166,8 @@ class WorkerFileUploadCommand(TransferCommand):
         self.path = os.path.join(self.builder.basedir,
                                  self.workdir,
                                  os.path.expanduser(self.filename))
+        if self.dedup:
+            return self._startDedup()
         accessed_modified = None
         try:
             if self.keepstamp:
@@ -101,11 +187,21 @@ class WorkerFileUploadCommand(TransferCommand):
         self.sendStatus({'header': "sending %s" % self.path})
 
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if self.checksums and self.fp is not None:
+            d0 = self._resume()
+            d0.addCallbacks(lambda _: self._loop(d), d.errback)
+        else:
+            self._reactor.callLater(0, self._loop, d)
 
         def _close_ok(res):
             self.fp = None
-            d1 = self.writer.callRemote("close")
+            if self.checksums:
+                if self.interrupted or self.hasher is None:
+                    # without a digest, the master keeps the partial file
+                    return self.writer.callRemote("close")
+                d1 = self.writer.callRemote("close", self.hasher.hexdigest())
+            else:
+                d1 = self.writer.callRemote("close")
 
             def _utime_ok(res):
                 return self.writer.callRemote("utime", accessed_modified)
@@ -130,19 +226,111 @@ class WorkerFileUploadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._writeBlock)
+    def _transferBlock(self):
+        if self.dedup:
+            return self._writeContentBlock()
+        return self._writeBlock()
 
-        def _done(finished):
-            if finished:
-                fire_when_done.callback(None)
-            else:
-                self._loop(fire_when_done)
+    def _startDedup(self):
+        self.fp = None
+        self.sendStatus({'header': "sending %s" % self.path})
 
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
-        return None
+        d = threads.deferToThreadPool(
+            self._reactor, self._reactor.getThreadPool(), self._makeManifest)
+        d.addCallbacks(self._uploadContents, self._manifestFailed)
+
+        def _err(f):
+            self.rc = 1
+            return f
+        d.addErrback(_err)
+        d.addBoth(self.finished)
+        return d
+
+    def _makeManifest(self):
+        """Return the manifest of the upload, a list of (relpath, digest,
+        size, mode) entries, and remember which file has which content."""
+        self.contents = {}
+        return [self._manifestEntry(self.path, '')]
+
+    def _manifestEntry(self, path, relpath):
+        st = os.stat(path)
+        if stat.S_ISDIR(st.st_mode):
+            return (relpath, None, 0, stat.S_IMODE(st.st_mode))
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    break
+                digest.update(data)
+        digest = digest.hexdigest()
+        self.contents.setdefault(digest, path)
+        return (relpath, digest, st.st_size, stat.S_IMODE(st.st_mode))
+
+    def _manifestFailed(self, why):
+        why.trap(IOError, OSError)
+        self.stderr = "Cannot read '%s' for upload" % self.path
+        self.rc = 1
+
+    @defer.inlineCallbacks
+    def _uploadContents(self, manifest):
+        missing = yield self.writer.callRemote('manifest', manifest)
+        files = len([e for e in manifest if e[1] is not None])
+        self.sendStatus({'header': "%d of %d files already on the master"
+                         % (files - len(missing), files)})
+        for digest in missing:
+            if self.interrupted:
+                return
+            self.fp = open(self.contents[digest], 'rb')
+            try:
+                yield self.writer.callRemote('beginFile', digest)
+                d = defer.Deferred()
+                self._loop(d)
+                yield d
+            finally:
+                self.fp.close()
+                self.fp = None
+            yield self.writer.callRemote('endFile')
+        if not self.interrupted:
+            yield self.writer.callRemote('close')
+
+    def _writeContentBlock(self):
+        if self.interrupted or self.fp is None:
+            return True
+        data = self.fp.read(self.blocksize)
+        if not data:
+            return True
+        d = self.writer.callRemote('write', data)
+        d.addCallback(lambda res: False)
+        return d
+
+    @defer.inlineCallbacks
+    def _resume(self):
+        checksums = yield self.writer.callRemote('getBlockChecksums',
+                                                 self.blocksize)
+        kept = yield threads.deferToThreadPool(
+            self._reactor, self._reactor.getThreadPool(),
+            self._matchBlocks, checksums)
+        yield self.writer.callRemote('resumeAt', kept)
+        if kept:
+            self.sendStatus({'header': "resuming after %d bytes"
+                             % (kept * self.blocksize)})
+
+    def _matchBlocks(self, checksums):
+        # skip the blocks the master already has, as long as they match
+        self.hasher = BlockHasher()
+        for expected in checksums:
+            if self.remaining is not None and self.remaining < self.blocksize:
+                break
+            data = self.fp.read(self.blocksize)
+            checksum = BlockHasher.checksum(data)
+            if len(data) < self.blocksize or checksum != expected:
+                self.fp.seek(-len(data), 1)
+                break
+            self.hasher.add(checksum)
+            if self.remaining is not None:
+                self.remaining -= len(data)
+        return len(self.hasher.checksums)
 
     def _writeBlock(self):
         """Write a block of data to the remote writer"""
@@ -175,12 +363,190 @@ class WorkerFileUploadCommand(TransferCommand):
         if self.remaining is not None:
             self.remaining = self.remaining - len(data)
             assert self.remaining >= 0
-        d = self.writer.callRemote('write', data)
+        if self.checksums:
+            checksum = BlockHasher.checksum(data)
+            self.hasher.add(checksum)
+            d = self.writer.callRemote('write', data, checksum)
+        else:
+            d = self.writer.callRemote('write', data)
         d.addCallback(lambda res: False)
         return d
 
 
+class _ArchiveStopped(Exception):
+    pass
+
+
+class _ZlibWriter(object):
+
+    """
+    Compress everything written to it with zlib at its fastest level.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.compressor = zlib.compressobj(1)
+
+    def write(self, data):
+        data = self.compressor.compress(data)
+        if data:
+            self.fileobj.write(data)
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+
+
+class ArchiveStream(object):
+
+    """
+    Build a tar archive of a directory in a separate thread, and hand it out
+    a block at a time as it is produced, so that the upload does not have to
+    wait for (and find room for) the whole archive.  At most C{maxBlocks}
+    blocks are kept waiting for the transfer, after which the archiving
+    thread waits too.
+    """
+
+    maxBlocks = 8
+
+    def __init__(self, path, compress, blocksize, _reactor):
+        self.path = path
+        self.compress = compress
+        self.blocksize = blocksize
+        self._reactor = _reactor
+
+        # used by the archiving thread
+        self._buf = []
+        self._buflen = 0
+        self._slots = threading.Semaphore(self.maxBlocks)
+        self._stopped = False
+        self._abandoned = False
+
+        # used in the reactor
+        self._blocks = deque()
+        self._readers = deque()
+        self._done = None
+
+        self._thread = threading.Thread(target=self._archive,
+                                        name='archive %s' % path)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # archiving thread
+
+    def _archive(self):
+        try:
+            if self.compress in ('bz2', 'gz'):
+                mode = 'w|' + self.compress
+            else:
+                mode = 'w|'
+            fileobj = self
+            if self.compress == 'zlib':
+                fileobj = _ZlibWriter(self)
+            archive = tarfile.open(mode=mode, fileobj=fileobj)
+            archive.add(self.path, '')
+            archive.close()
+            if fileobj is not self:
+                fileobj.close()
+            self._flush(force=True)
+            result = ''
+        except _ArchiveStopped:
+            # the tarfile stream still tries to finish the archive when it
+            # is garbage collected, and there is nobody to send that to
+            self._abandoned = True
+            return
+        except Exception:
+            result = failure.Failure()
+        self._reactor.callFromThread(self._finished, result)
+
+    def write(self, data):
+        if self._abandoned:
+            return
+        self._buf.append(data)
+        self._buflen += len(data)
+        self._flush()
+
+    def _flush(self, force=False):
+        while self._buflen >= self.blocksize or (force and self._buflen):
+            data = b''.join(self._buf)
+            block, rest = data[:self.blocksize], data[self.blocksize:]
+            self._buf = [rest] if rest else []
+            self._buflen = len(rest)
+            self._slots.acquire()
+            if self._stopped:
+                raise _ArchiveStopped()
+            self._reactor.callFromThread(self._produced, block)
+
+    # reactor
+
+    def _produced(self, block):
+        if self._stopped:
+            return
+        if self._readers:
+            self._slots.release()
+            self._readers.popleft().callback(block)
+        else:
+            self._blocks.append(block)
+
+    def _finished(self, result):
+        self._done = result
+        while self._readers:
+            d = self._readers.popleft()
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def read(self):
+        """
+        Get the next block of the archive.
+
+        @returns: Deferred firing with the block, or an empty string once
+        the archive is complete or archiving was stopped
+        """
+        if self._stopped:
+            return defer.succeed('')
+        if self._blocks:
+            self._slots.release()
+            return defer.succeed(self._blocks.popleft())
+        if isinstance(self._done, failure.Failure):
+            return defer.fail(self._done)
+        if self._done is not None:
+            return defer.succeed(self._done)
+        d = defer.Deferred()
+        self._readers.append(d)
+        return d
+
+    def stop(self):
+        """
+        Stop archiving, if the transfer ends before the archive does.  Reads
+        still waiting for a block get an empty string, as at the end of the
+        archive, and so do any later reads.
+        """
+        self._stopped = True
+        self._slots.release()
+        self._blocks.clear()
+        while self._readers:
+            self._readers.popleft().callback('')
+
+
 class WorkerDirectoryUploadCommand(WorkerFileUploadCommand):
+
+    """
+    Upload a directory from worker to build master, as a tar archive that
+    is built while it is sent
+    Arguments:
+
+        - ['workdir']:   base directory to use
+        - ['workersrc']:  name of the worker-side directory to read from
+        - ['writer']:    RemoteReference to a buildbot_worker.protocols.base.FileWriterProxy object
+        - ['maxsize']:   max size (in bytes) of the archive to write
+        - ['blocksize']: max size for each data block
+        - ['compress']:  None, 'gz', 'bz2' or 'zlib' (zlib at its fastest level)
+        - ['window']:    number of blocks to send without waiting for the
+                         master to acknowledge them
+        - ['dedup']:     send the files instead of an archive, as for
+                         uploadFile
+    """
     debug = False
     requiredArgs = ['workdir', 'workersrc', 'writer', 'blocksize']
 
@@ -191,8 +557,11 @@ class WorkerDirectoryUploadCommand(WorkerFileUploadCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.compress = args['compress']
+        self.window = args.get('window', 1)
+        self.dedup = args.get('dedup', False)
         self.stderr = None
         self.rc = 0
+        self.archive = None
 
     def start(self):
         if self.debug:
@@ -203,23 +572,12 @@ class WorkerDirectoryUploadCommand(WorkerFileUploadCommand):
                                  os.path.expanduser(self.dirname))
         if self.debug:
             log.msg("path: %r" % self.path)
+        if self.dedup:
+            return self._startDedup()
 
-        # Create temporary archive
-        fd, self.tarname = tempfile.mkstemp()
-        fileobj = os.fdopen(fd, 'wb')
-        if self.compress == 'bz2':
-            mode = 'w|bz2'
-        elif self.compress == 'gz':
-            mode = 'w|gz'
-        else:
-            mode = 'w'
-        archive = tarfile.open(name=self.tarname, mode=mode, fileobj=fileobj)
-        archive.add(self.path, '')
-        archive.close()
-        fileobj.close()
-
-        # Transfer it
-        self.fp = open(self.tarname, 'rb')
+        # Archive the directory while it is transferred
+        self.archive = ArchiveStream(self.path, self.compress,
+                                     self.blocksize, self._reactor)
 
         self.sendStatus({'header': "sending %s" % self.path})
 
@@ -239,9 +597,64 @@ class WorkerDirectoryUploadCommand(WorkerFileUploadCommand):
         d.addBoth(self.finished)
         return d
 
+    def _makeManifest(self):
+        self.contents = {}
+        if not os.path.isdir(self.path):
+            raise IOError("'%s' is not a directory" % self.path)
+        manifest = [self._manifestEntry(self.path, '')]
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            dirnames.sort()
+            reldir = os.path.relpath(dirpath, self.path)
+            for name in dirnames + sorted(filenames):
+                path = os.path.join(dirpath, name)
+                if not os.path.exists(path):
+                    # a dangling symlink
+                    continue
+                relpath = os.path.normpath(os.path.join(reldir, name))
+                manifest.append(self._manifestEntry(
+                    path, relpath.replace(os.sep, '/')))
+        return manifest
+
+    def _writeBlock(self):
+        """Write the next block of the archive to the remote writer"""
+
+        if self.interrupted or self.archive is None:
+            if self.debug:
+                log.msg('WorkerDirectoryUploadCommand._writeBlock(): end')
+            return True
+
+        d = self.archive.read()
+        d.addCallback(self._sendBlock)
+        return d
+
+    def _sendBlock(self, data):
+        if self.archive is None or not data:
+            return True
+
+        if self.remaining is not None:
+            if len(data) > self.remaining:
+                if self.stderr is None:
+                    self.stderr = 'Maximum filesize reached, truncating file \'%s\'' \
+                        % self.path
+                    self.rc = 1
+                data = data[:self.remaining]
+                # don't send anything after the truncated block
+                self.archive.stop()
+                self.archive = None
+                if not data:
+                    return True
+            self.remaining = self.remaining - len(data)
+
+        if self.debug:
+            log.msg('WorkerDirectoryUploadCommand._sendBlock(): '
+                    'len=%d' % len(data))
+        d = self.writer.callRemote('write', data)
+        d.addCallback(lambda res: False)
+        return d
+
     def finished(self, res):
-        self.fp.close()
-        os.remove(self.tarname)
+        if self.archive is not None:
+            self.archive.stop()
         return TransferCommand.finished(self, res)
 
 
@@ -257,6 +670,12 @@ class WorkerFileDownloadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['mode']:      access mode for the new file
+        - ['window']:    number of blocks to request without waiting for the
+                         previous ones to arrive
+        - ['checksums']: check every block, and the digest of the whole file,
+                         before moving it into place; the file is written to
+                         <workerdest>.partial until then, and a later
+                         download carries on after the blocks it kept
     """
     debug = False
     requiredArgs = ['workdir', 'workerdest', 'reader', 'blocksize']
@@ -268,6 +687,11 @@ class WorkerFileDownloadCommand(TransferCommand):
         self.bytes_remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.mode = args['mode']
+        self.window = args.get('window', 1)
+        self.checksums = args.get('checksums', False)
+        self.hasher = None
+        self.sumsfile = None
+        self.bytes_requested = 0
         self.stderr = None
         self.rc = 0
 
@@ -285,10 +709,13 @@ class WorkerFileDownloadCommand(TransferCommand):
             os.makedirs(dirname)
 
         try:
-            self.fp = open(self.path, 'wb')
+            if self.checksums:
+                self._openPartial()
+            else:
+                self.fp = open(self.path, 'wb')
             if self.debug:
                 log.msg("Opened '%s' for download" % self.path)
-            if self.mode is not None:
+            if self.mode is not None and not self.checksums:
                 # note: there is a brief window during which the new file
                 # will have the worker's default (umask) mode before we
                 # set the new one. Don't use this mode= feature to keep files
@@ -306,7 +733,14 @@ class WorkerFileDownloadCommand(TransferCommand):
                 log.msg("Cannot open file '%s' for download" % self.path)
 
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if self.checksums and self.fp is not None:
+            d0 = self.reader.callRemote('resumeAt', self.blocksize,
+                                        self.hasher.checksums)
+            d0.addCallback(self._resumeAt)
+            d0.addCallbacks(lambda _: self._loop(d), d.errback)
+            d.addCallback(self._checkDigest)
+        else:
+            self._reactor.callLater(0, self._loop, d)
 
         def _close(res):
             # close the file, but pass through any errors from _loop
@@ -318,19 +752,68 @@ class WorkerFileDownloadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._readBlock)
+    def _transferBlock(self):
+        return self._readBlock()
 
-        def _done(finished):
-            if finished:
-                fire_when_done.callback(None)
-            else:
-                self._loop(fire_when_done)
+    def _openPartial(self):
+        # the checksums of the blocks kept from an earlier download
+        self.partial = self.path + '.partial'
+        self.sumsname = self.partial + '.sums'
+        checksums = []
+        try:
+            with open(self.sumsname) as f:
+                lines = f.read().split()
+            if lines and lines[0] == str(self.blocksize):
+                size = os.path.getsize(self.partial)
+                checksums = lines[1:size // self.blocksize + 1]
+        except (IOError, OSError):
+            pass
+        if self.bytes_remaining is not None:
+            checksums = checksums[:self.bytes_remaining // self.blocksize]
+        self.fp = open(self.partial, 'r+b' if checksums else 'wb')
+        self.hasher = BlockHasher(checksums)
+
+    def _resumeAt(self, kept):
+        checksums = self.hasher.checksums[:kept]
+        self.hasher = BlockHasher(checksums)
+        self.fp.truncate(kept * self.blocksize)
+        self.fp.seek(0, 2)
+        self.sumsfile = open(self.sumsname, 'w')
+        self.sumsfile.write('%d\n' % self.blocksize)
+        self.sumsfile.write(''.join(c + '\n' for c in checksums))
+        self.sumsfile.flush()
+        if self.bytes_remaining is not None:
+            self.bytes_remaining -= kept * self.blocksize
+        if kept:
+            self.sendStatus({'header': "resuming after %d bytes"
+                             % (kept * self.blocksize)})
 
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
-        return None
+    def _checkDigest(self, res):
+        if self.interrupted:
+            # keep the partial file, for the next download to resume from
+            return res
+        d = self.reader.callRemote('digest')
+
+        @d.addCallback
+        def check(digest):
+            self.fp.close()
+            self.fp = None
+            self.sumsfile.close()
+            self.sumsfile = None
+            if digest != self.hasher.hexdigest():
+                os.unlink(self.partial)
+                os.unlink(self.sumsname)
+                self._checksumError("digest of '%s' does not match"
+                                    % self.path)
+            os.unlink(self.sumsname)
+            # on windows, os.rename does not automatically unlink
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            os.rename(self.partial, self.path)
+            if self.mode is not None:
+                os.chmod(self.path, self.mode)
+            return res
+        return d
 
     def _readBlock(self):
         """Read a block of data from the remote reader."""
@@ -341,21 +824,52 @@ class WorkerFileDownloadCommand(TransferCommand):
             return True
 
         length = self.blocksize
-        if self.bytes_remaining is not None and length > self.bytes_remaining:
-            length = self.bytes_remaining
+        if self.bytes_remaining is not None:
+            # don't ask for more than maxsize, counting the reads in flight
+            allowed = self.bytes_remaining - self.bytes_requested
+            if length > allowed:
+                length = allowed
 
         if length <= 0:
+            if self.bytes_requested:
+                # the reads in flight may still hit the end of the file
+                return None
             if self.stderr is None:
                 self.stderr = "Maximum filesize reached, truncating file '%s'" \
                     % self.path
                 self.rc = 1
             return True
         else:
-            d = self.reader.callRemote('read', length)
-            d.addCallback(self._writeData)
+            self.bytes_requested += length
+            if self.checksums:
+                d = self.reader.callRemote('readBlock', length)
+                d.addCallback(self._writeBlockData, length)
+            else:
+                d = self.reader.callRemote('read', length)
+                d.addCallback(self._writeData, length)
             return d
 
-    def _writeData(self, data):
+    def _writeBlockData(self, res, requested):
+        data, checksum = res
+        if data and BlockHasher.checksum(data) != checksum:
+            self._checksumError("block %d of '%s' is corrupted"
+                                % (len(self.hasher.checksums), self.path))
+        finished = self._writeData(data, requested)
+        if data:
+            # the data has to be in the file before its checksum is recorded
+            self.fp.flush()
+            self.hasher.add(checksum)
+            self.sumsfile.write(checksum + '\n')
+            self.sumsfile.flush()
+        return finished
+
+    def _checksumError(self, msg):
+        self.stderr = msg
+        self.rc = 1
+        raise TransferChecksumError(msg)
+
+    def _writeData(self, data, requested=0):
+        self.bytes_requested -= requested
         if self.debug:
             log.msg('WorkerFileDownloadCommand._readBlock(): readlen=%d' %
                     len(data))
@@ -371,5 +885,7 @@ class WorkerFileDownloadCommand(TransferCommand):
     def finished(self, res):
         if self.fp is not None:
             self.fp.close()
+        if self.sumsfile is not None:
+            self.sumsfile.close()
 
         return TransferCommand.finished(self, res)
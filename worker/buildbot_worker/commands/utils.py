@@ -15,10 +15,17 @@
 
 from future.utils import text_type
 
+import errno
 import os
+import stat
+import tempfile
 
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import threads
 from twisted.python import log
 from twisted.python import runtime
+from twisted.python import threadpool
 from twisted.python.procutils import which
 
 
@@ -101,3 +108,157 @@ else:
     # use rmtree on POSIX
     import shutil
     rmdirRecursive = shutil.rmtree
+
+
+# prefix of the directories that moveAside() renames trees into
+TRASH_PREFIX = '.buildbot-trash-'
+
+
+def moveAside(path):
+    """
+    Atomically rename path into a new trash directory next to it, so that a
+    new tree can be created at path right away.  Return the trash directory,
+    or None if path does not exist.
+    """
+    trash = tempfile.mkdtemp(prefix=TRASH_PREFIX,
+                             dir=os.path.dirname(path))
+    try:
+        os.rename(path, os.path.join(trash, os.path.basename(path)))
+    except OSError as e:
+        os.rmdir(trash)
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    return trash
+
+
+class TreeRemover(object):
+
+    """
+    Remove directory trees using a pool of threads, which work on several
+    directories at once.  Several trees can be removed at the same time with
+    the same remover.  The number of files and directories removed so far
+    can be read from C{files} and C{dirs} while it runs.
+    """
+
+    def __init__(self, threads=4, _reactor=reactor):
+        self.threads = threads
+        self._reactor = _reactor
+        self.files = 0
+        self.dirs = 0
+        self.stopped = False
+        self.pool = None
+        self._pending = 0
+        self._stopWaiters = []
+
+    def stop(self):
+        """
+        Stop removing files, and shut the threads down once they are idle.
+        Trees that are still being removed are left as they are; the
+        Deferreds from remove() fire once the work in progress is done.
+
+        @returns: Deferred firing once the threads have been shut down
+        """
+        self.stopped = True
+        d = defer.Deferred()
+        self._stopWaiters.append(d)
+        self._stopPool()
+        return d
+
+    def _stopPool(self):
+        if self._pending:
+            return
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+        waiters, self._stopWaiters = self._stopWaiters, []
+        for d in waiters:
+            d.callback(None)
+
+    def _deferToPool(self, f, *args):
+        if self.pool is None:
+            self.pool = threadpool.ThreadPool(minthreads=0,
+                                              maxthreads=self.threads,
+                                              name='TreeRemover')
+            self.pool.start()
+        self._pending += 1
+        d = threads.deferToThreadPool(self._reactor, self.pool, f, *args)
+
+        @d.addBoth
+        def done(res):
+            self._pending -= 1
+            if self.stopped:
+                self._stopPool()
+            return res
+        return d
+
+    @defer.inlineCallbacks
+    def remove(self, path):
+        """
+        Remove path, which may be a tree, a file or nothing at all.
+        """
+        if self.stopped:
+            return
+        try:
+            st = yield self._deferToPool(os.lstat, path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        if stat.S_ISDIR(st.st_mode):
+            yield self._removeTree(path)
+        else:
+            yield self._deferToPool(self._removeFile, path)
+            self.files += 1
+
+    @defer.inlineCallbacks
+    def _removeTree(self, path):
+        if self.stopped:
+            return
+        subdirs, files = yield self._deferToPool(self._clearDir, path)
+        self.files += files
+        try:
+            yield defer.gatherResults(
+                [self._removeTree(subdir) for subdir in subdirs],
+                consumeErrors=True)
+        except defer.FirstError as e:
+            e.subFailure.raiseException()
+        if not self.stopped:
+            yield self._deferToPool(os.rmdir, path)
+            self.dirs += 1
+
+    def _removeFile(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EPERM):
+                raise
+            # the directory is not writable, or (on Windows) the file is
+            # read-only
+            os.chmod(os.path.dirname(path), 0o700)
+            if os.name == 'nt':
+                os.chmod(path, 0o600)
+            os.remove(path)
+
+    def _clearDir(self, path):
+        # runs in a pool thread: remove everything in path but the
+        # subdirectories, and return those with the number of removed files
+        try:
+            names = os.listdir(path)
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EPERM):
+                raise
+            os.chmod(path, 0o700)
+            names = os.listdir(path)
+        subdirs = []
+        files = 0
+        for name in names:
+            if self.stopped:
+                break
+            fullname = os.path.join(path, name)
+            if stat.S_ISDIR(os.lstat(fullname).st_mode):
+                subdirs.append(fullname)
+            else:
+                self._removeFile(fullname)
+                files += 1
+        return subdirs, files
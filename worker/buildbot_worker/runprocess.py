@@ -37,7 +37,6 @@ from twisted.internet import defer
 from twisted.internet import error
 from twisted.internet import protocol
 from twisted.internet import reactor
-from twisted.internet import task
 from twisted.python import failure
 from twisted.python import log
 from twisted.python import runtime
@@ -49,6 +48,13 @@ from buildbot_worker.exceptions import AbandonChain
 if runtime.platformType == 'posix':
     from twisted.internet.process import Process
 
+try:
+    # only available on Linux
+    from twisted.internet import inotify
+    from twisted.python import filepath
+except ImportError:
+    inotify = None
+
 
 def win32_batch_quote(cmd_list):
     # Quote cmd_list to a string that is suitable for inclusion in a
@@ -86,8 +92,104 @@ def shell_quote(cmd_list):
         return " ".join([quote(e) for e in cmd_list])
 
 
+class _InotifyWatches(object):
+
+    """
+    The inotify instance shared by all of the LogFileWatchers in this
+    process.  Each directory is watched once, and its events are handed to
+    the watchers of the files in it.  An inotify instance per watcher would
+    soon run into the per-user limit on instances (128 by default).
+    """
+
+    def __init__(self):
+        self.notifier = None
+        # {dirname: {basename: set of watchers}}
+        self.watchers = {}
+
+    def add(self, watcher):
+        """
+        Start passing events for C{watcher.logfile} to C{watcher}.
+
+        @returns: True if inotify could be set up for it
+        """
+        dirname, basename = os.path.split(os.path.abspath(watcher.logfile))
+        try:
+            if self.notifier is None:
+                self.notifier = inotify.INotify()
+                self.notifier.startReading()
+            if dirname not in self.watchers:
+                self.notifier.watch(filepath.FilePath(dirname),
+                                    mask=(inotify.IN_MODIFY |
+                                          inotify.IN_CREATE |
+                                          inotify.IN_DELETE |
+                                          inotify.IN_MOVED_TO |
+                                          inotify.IN_MOVED_FROM),
+                                    callbacks=[self._event])
+                self.watchers[dirname] = {}
+        except Exception as e:
+            log.msg("LogFileWatcher cannot use inotify for %s (%s); "
+                    "polling instead" % (watcher.logfile, e))
+            if not self.watchers and self.notifier is not None:
+                self.notifier.loseConnection()
+                self.notifier = None
+            return False
+        self.watchers[dirname].setdefault(basename, set()).add(watcher)
+        return True
+
+    def remove(self, watcher):
+        dirname, basename = os.path.split(os.path.abspath(watcher.logfile))
+        files = self.watchers.get(dirname)
+        if files is None:
+            return
+        watchers = files.get(basename, set())
+        watchers.discard(watcher)
+        if not watchers:
+            files.pop(basename, None)
+        if not files:
+            del self.watchers[dirname]
+            try:
+                self.notifier.ignore(filepath.FilePath(dirname))
+            except KeyError:
+                # the directory is gone, and its watch with it
+                pass
+        if not self.watchers and self.notifier is not None:
+            self.notifier.loseConnection()
+            self.notifier = None
+
+    def _event(self, ignored, path, mask):
+        path = path.path
+        if not isinstance(path, str):
+            path = path.decode(sys.getfilesystemencoding())
+        if mask & inotify.IN_DELETE_SELF:
+            # a watched directory went away, and the notifier closes itself
+            # when that happens; everyone has to go back to polling
+            self._lost()
+            return
+        dirname, basename = os.path.split(path)
+        for watcher in list(self.watchers.get(dirname, {}).get(basename, ())):
+            watcher._inotifyEvent()
+
+    def _lost(self):
+        watchers = [w for files in self.watchers.values()
+                    for ws in files.values() for w in ws]
+        self.watchers = {}
+        self.notifier = None
+        for watcher in watchers:
+            watcher._inotifyLost()
+
+
 class LogFileWatcher(object):
-    POLL_INTERVAL = 2
+    # without inotify, the file is checked again after MIN_POLL_INTERVAL
+    # seconds while it is growing, backing off to MAX_POLL_INTERVAL while it
+    # is idle.  With inotify, the file is still checked every
+    # MAX_POLL_INTERVAL seconds, as some filesystems (NFS, for one) do not
+    # report changes
+    MIN_POLL_INTERVAL = 0.1
+    MAX_POLL_INTERVAL = 10
+    READ_SIZE = 128 * 1024
+    useInotify = True
+    _reactor = reactor
+    _inotifyWatches = _InotifyWatches()
 
     def __init__(self, command, name, logfile, follow=False):
         self.command = command
@@ -105,22 +207,78 @@ class LogFileWatcher(object):
         # added since we started watching
         self.follow = follow
 
-        # every 2 seconds we check on the file again
-        self.poller = task.LoopingCall(self.poll)
+        self.running = False
+        self.inotifying = False
+        self.pollTimer = None
+        self.pollInterval = self.MIN_POLL_INTERVAL
+
+        # how many times we looked at the file, and how many of those found
+        # nothing new
+        self.wakeups = 0
+        self.idleWakeups = 0
 
     def start(self):
-        self.poller.start(self.POLL_INTERVAL).addErrback(self._cleanupPoll)
+        self.running = True
+        if self.useInotify and inotify is not None:
+            self.inotifying = self._inotifyWatches.add(self)
+        self._wakeup()
+
+    def _inotifyEvent(self):
+        if self.running:
+            self._check()
+
+    def _inotifyLost(self):
+        # carry on polling, starting at the shortest interval
+        self.inotifying = False
+        if self.pollTimer is not None:
+            self.pollTimer.cancel()
+            self.pollTimer = None
+        self.pollInterval = self.MIN_POLL_INTERVAL
+        self._wakeup()
+
+    def _wakeup(self):
+        self.pollTimer = None
+        if not self.running:
+            return
+        gotData = self._check()
+        if not self.running:
+            return
+        if self.inotifying:
+            self.pollInterval = self.MAX_POLL_INTERVAL
+        elif gotData:
+            self.pollInterval = self.MIN_POLL_INTERVAL
+        else:
+            self.pollInterval = min(self.pollInterval * 2,
+                                    self.MAX_POLL_INTERVAL)
+        self.pollTimer = self._reactor.callLater(self.pollInterval,
+                                                 self._wakeup)
 
-    def _cleanupPoll(self, err):
-        log.err(err, msg="Polling error")
-        self.poller = None
+    def _check(self):
+        self.wakeups += 1
+        try:
+            gotData = self.poll()
+        except Exception:
+            log.err(None, "Polling error")
+            self.running = False
+            return False
+        if not gotData:
+            self.idleWakeups += 1
+        return gotData
 
     def stop(self):
-        self.poll()
-        if self.poller is not None:
-            self.poller.stop()
+        if self.running:
+            self.poll()
+            self.running = False
+        if self.pollTimer is not None:
+            self.pollTimer.cancel()
+            self.pollTimer = None
+        if self.inotifying:
+            self._inotifyWatches.remove(self)
+            self.inotifying = False
         if self.started:
             self.f.close()
+        log.msg("LogFileWatcher for %s: %d wakeups, %d idle"
+                % (self.logfile, self.wakeups, self.idleWakeups))
 
     def statFile(self):
         if os.path.exists(self.logfile):
@@ -129,16 +287,20 @@ class LogFileWatcher(object):
         return None
 
     def poll(self):
+        """
+        Send whatever was added to the file since the last call, and return
+        True if there was anything.
+        """
         if not self.started:
             s = self.statFile()
             if s == self.old_logfile_stats:
-                return  # not started yet
+                return False  # not started yet
             if not s:
                 # the file was there, but now it's deleted. Forget about the
                 # initial state, clearly the process has deleted the logfile
                 # in preparation for creating a new one.
                 self.old_logfile_stats = None
-                return  # no file to work with
+                return False  # no file to work with
             self.f = open(self.logfile, "rb")
             # if we only want new lines, seek to
             # where we stat'd so we only find new
@@ -147,10 +309,12 @@ class LogFileWatcher(object):
                 self.f.seek(s[2], 0)
             self.started = True
         self.f.seek(self.f.tell(), 0)
+        gotData = False
         while True:
-            data = self.f.read(10000)
+            data = self.f.read(self.READ_SIZE)
             if not data:
-                return
+                return gotData
+            gotData = True
             self.command.addLogfile(self.name, data)
 
 
@@ -246,10 +410,19 @@ class RunProcess(object):
     interruptSignal = "KILL"
     CHUNK_LIMIT = 128 * 1024
 
-    # Don't send any data until at least BUFFER_SIZE bytes have been collected
-    # or BUFFER_TIMEOUT elapsed
+    # Send the data once BUFFER_SIZE bytes have been collected, or once
+    # bufferTimeout seconds have passed since the first of them came in.
+    # bufferTimeout adapts to the output: sporadic output is sent after
+    # MIN_BUFFER_TIMEOUT, steady output is batched for up to BUFFER_TIMEOUT
     BUFFER_SIZE = 64 * 1024
-    BUFFER_TIMEOUT = 5
+    BUFFER_TIMEOUT = 1.0
+    MIN_BUFFER_TIMEOUT = 0.05
+
+    # limits on the output kept for keepStdout/keepStderr: data past
+    # KEEP_MAX_SIZE characters is dropped, and data past KEEP_SPILL_SIZE is
+    # kept in a temporary file rather than in memory
+    KEEP_MAX_SIZE = None
+    KEEP_SPILL_SIZE = None
 
     # For sending elapsed time:
     startTime = None
@@ -269,7 +442,7 @@ class RunProcess(object):
                  timeout=None, maxTime=None, sigtermTime=None,
                  initialStdin=None, keepStdout=False, keepStderr=False,
                  logEnviron=True, logfiles={}, usePTY=False,
-                 useProcGroup=True):
+                 useProcGroup=True, sendSegments=False):
         """
 
         @param keepStdout: if True, we keep a copy of all the stdout text
@@ -282,6 +455,10 @@ class RunProcess(object):
 
         @param useProcGroup: (default True) use a process group for non-PTY
             process invocations
+
+        @param sendSegments: if True, the master understands 'segments'
+            updates, so interleaved output from several logs can be sent in
+            one update
         """
 
         self.builder = builder
@@ -371,6 +548,8 @@ class RunProcess(object):
         self.buffered = deque()
         self.buflen = 0
         self.sendBuffersTimer = None
+        self.bufferTimeout = self.MIN_BUFFER_TIMEOUT
+        self.sendSegments = sendSegments
 
         assert usePTY in (True, False), \
             "Unexpected usePTY argument value: {!r}. Expected boolean.".format(
@@ -414,6 +593,18 @@ class RunProcess(object):
     def __repr__(self):
         return "<%s '%s'>" % (self.__class__.__name__, self.fake_command)
 
+    def _makeAccumulator(self):
+        return util.Accumulator(maxSize=self.KEEP_MAX_SIZE,
+                                spillSize=self.KEEP_SPILL_SIZE)
+
+    @property
+    def stdout(self):
+        return self._stdout.getvalue()
+
+    @property
+    def stderr(self):
+        return self._stderr.getvalue()
+
     def sendStatus(self, status):
         self.builder.sendUpdate(status)
 
@@ -421,9 +612,9 @@ class RunProcess(object):
         # return a Deferred which fires (with the exit code) when the command
         # completes
         if self.keepStdout:
-            self.stdout = ""
+            self._stdout = self._makeAccumulator()
         if self.keepStderr:
-            self.stderr = ""
+            self._stderr = self._makeAccumulator()
         self.deferred = defer.Deferred()
         try:
             self._startCommand()
@@ -645,58 +836,62 @@ class RunProcess(object):
         msg = self._collapseMsg(msg)
         self.sendStatus(msg)
 
+    def _sendSegments(self, segments):
+        """
+        Send segments, a list of (logname, chunks) tuples in the order the
+        data was produced, to the master
+        """
+        if self.sendSegments and len(segments) > 1:
+            self.sendStatus({'segments': [(logname, "".join(chunks))
+                                          for logname, chunks in segments]})
+            return
+        # older masters take one log per update, so interleaved output has to
+        # be sent as a series of updates
+        for logname, chunks in segments:
+            self._sendMessage({logname: chunks})
+
     def _bufferTimeout(self):
         self.sendBuffersTimer = None
+        # if more output came in while we waited, the process is producing
+        # output steadily, and we can afford to wait longer before sending
+        # the next batch; otherwise send the next output sooner
+        if len(self.buffered) > 1:
+            self.bufferTimeout = min(self.bufferTimeout * 2,
+                                     self.BUFFER_TIMEOUT)
+        else:
+            self.bufferTimeout = max(self.bufferTimeout / 2,
+                                     self.MIN_BUFFER_TIMEOUT)
         self._sendBuffers()
 
     def _sendBuffers(self):
         """
         Send all the content in our buffers.
         """
-        msg = {}
+        segments = []
         msg_size = 0
-        lastlog = None
-        logdata = []
         while self.buffered:
             # Grab the next bits from the buffer
             logname, data = self.buffered.popleft()
 
-            # If this log is different than the last one, then we have to send
-            # out the message so far.  This is because the message is
-            # transferred as a dictionary, which makes the ordering of keys
-            # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
-            # On our first pass through this loop lastlog is None
-            if lastlog is None:
-                lastlog = logname
-            elif logname != lastlog:
-                self._sendMessage(msg)
-                msg = {}
-                msg_size = 0
-            lastlog = logname
-
-            logdata = msg.setdefault(logname, [])
-
             # Chunkify the log data to make sure we're not sending more than
             # CHUNK_LIMIT at a time
             for chunk in self._chunkForSend(data):
                 if len(chunk) == 0:
                     continue
-                logdata.append(chunk)
+                if segments and segments[-1][0] == logname:
+                    segments[-1][1].append(chunk)
+                else:
+                    segments.append((logname, [chunk]))
                 msg_size += len(chunk)
                 if msg_size >= self.CHUNK_LIMIT:
                     # We've gone beyond the chunk limit, so send out our
                     # message.  At worst this results in a message slightly
                     # larger than (2*CHUNK_LIMIT)-1
-                    self._sendMessage(msg)
-                    msg = {}
-                    logdata = msg.setdefault(logname, [])
+                    self._sendSegments(segments)
+                    segments = []
                     msg_size = 0
         self.buflen = 0
-        if logdata:
-            self._sendMessage(msg)
+        self._sendSegments(segments)
         if self.sendBuffersTimer:
             if self.sendBuffersTimer.active():
                 self.sendBuffersTimer.cancel()
@@ -705,7 +900,7 @@ class RunProcess(object):
     def _addToBuffers(self, logname, data):
         """
         Add data to the buffer for logname
-        Start a timer to send the buffers if BUFFER_TIMEOUT elapses.
+        Start a timer to send the buffers after bufferTimeout seconds.
         If adding data causes the buffer size to grow beyond BUFFER_SIZE, then
         the buffers will be sent.
         """
@@ -714,17 +909,19 @@ class RunProcess(object):
         self.buflen += n
         self.buffered.append((logname, data))
         if self.buflen > self.BUFFER_SIZE:
+            self.bufferTimeout = min(self.bufferTimeout * 2,
+                                     self.BUFFER_TIMEOUT)
             self._sendBuffers()
         elif not self.sendBuffersTimer:
             self.sendBuffersTimer = self._reactor.callLater(
-                self.BUFFER_TIMEOUT, self._bufferTimeout)
+                self.bufferTimeout, self._bufferTimeout)
 
     def addStdout(self, data):
         if self.sendStdout:
             self._addToBuffers('stdout', data)
 
         if self.keepStdout:
-            self.stdout += data
+            self._stdout.append(data)
         if self.ioTimeoutTimer:
             self.ioTimeoutTimer.reset(self.timeout)
 
@@ -733,7 +930,7 @@ class RunProcess(object):
             self._addToBuffers('stderr', data)
 
         if self.keepStderr:
-            self.stderr += data
+            self._stderr.append(data)
         if self.ioTimeoutTimer:
             self.ioTimeoutTimer.reset(self.timeout)
 
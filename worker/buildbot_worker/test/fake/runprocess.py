@@ -107,7 +107,8 @@ class FakeRunProcess(object):
                               sendStdout=True, sendStderr=True, sendRC=True,
                               timeout=None, maxTime=None, sigtermTime=None, initialStdin=None,
                               keepStdout=False, keepStderr=False,
-                              logEnviron=True, logfiles={}, usePTY=False)
+                              logEnviron=True, logfiles={}, usePTY=False,
+                              sendSegments=False)
 
         if not self._expectations:
             raise AssertionError("unexpected instantiation: %s" % (kwargs,))
@@ -228,6 +228,25 @@ class FakeStep(object):
         self.finished_d.callback(None)
 
 
+class SlowRemoteStep(object):
+
+    "A master-side step reference that answers only when told to."
+
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, meth, *args):
+        d = defer.Deferred()
+        self.calls.append((meth, args, d))
+        return d
+
+    def notifyOnDisconnect(self, what):
+        pass
+
+    def dontNotifyOnDisconnect(self, what):
+        pass
+
+
 class TestWorkerForBuilder(command.CommandTestMixin, unittest.TestCase):
 
     @defer.inlineCallbacks
@@ -269,6 +288,54 @@ class TestWorkerForBuilder(command.CommandTestMixin, unittest.TestCase):
     def test_startBuild(self):
         return self.sb.callRemote("startBuild")
 
+    def test_sendUpdate_batches(self):
+        wfb = self.sb.original
+        step = wfb.remoteStep = SlowRemoteStep()
+        for i in range(5):
+            wfb.sendUpdate({'stdout': str(i)})
+
+        # two calls are in flight, the rest waits for an answer
+        self.assertEqual([args for _, args, _ in step.calls], [
+            ([[{'stdout': '0'}, 0]],),
+            ([[{'stdout': '1'}, 0]],),
+        ])
+        step.calls[0][2].callback(0)
+        self.assertEqual(step.calls[2][1], ([
+            [{'stdout': '2'}, 0],
+            [{'stdout': '3'}, 0],
+            [{'stdout': '4'}, 0],
+        ],))
+        self.assertEqual(wfb.pendingUpdates, [])
+
+    def test_sendUpdate_batch_size(self):
+        wfb = self.sb.original
+        self.patch(wfb, 'maxUpdatesInFlight', 1)
+        self.patch(wfb, 'maxUpdatesPerCall', 2)
+        step = wfb.remoteStep = SlowRemoteStep()
+        for i in range(4):
+            wfb.sendUpdate({'stdout': str(i)})
+
+        step.calls[0][2].callback(0)
+        self.assertEqual([len(args[0]) for _, args, _ in step.calls],
+                         [1, 2])
+        step.calls[1][2].callback(0)
+        self.assertEqual([len(args[0]) for _, args, _ in step.calls],
+                         [1, 2, 1])
+
+    def test_commandComplete_sends_pending_updates(self):
+        wfb = self.sb.original
+        step = wfb.remoteStep = SlowRemoteStep()
+        for i in range(4):
+            wfb.sendUpdate({'stdout': str(i)})
+        wfb.commandComplete(None)
+
+        self.assertEqual([meth for meth, _, _ in step.calls],
+                         ['update', 'update', 'update', 'complete'])
+        self.assertEqual(step.calls[2][1], ([
+            [{'stdout': '2'}, 0],
+            [{'stdout': '3'}, 0],
+        ],))
+
     def test_startCommand(self):
         # set up a fake step to receive updates
         st = FakeStep()
@@ -13,9 +13,11 @@
 #
 # Copyright Buildbot Team Members
 
+import glob
 import os
 import shutil
 
+from twisted.internet import defer
 from twisted.python import runtime
 from twisted.trial import unittest
 
@@ -87,6 +89,112 @@ class TestRemoveDirectory(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def makeTree(self, dirname, width=3, depth=3):
+        def fill(path, depth):
+            os.makedirs(path)
+            for i in range(width):
+                with open(os.path.join(path, 'file%d' % i), 'w') as f:
+                    f.write('data')
+            if depth:
+                for i in range(width):
+                    fill(os.path.join(path, 'dir%d' % i), depth - 1)
+        path = os.path.join(self.basedir, dirname)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        fill(path, depth)
+        return path
+
+    @defer.inlineCallbacks
+    def test_threads(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='workdir', threads=2,
+        ), True)
+        path = self.makeTree('workdir')
+        os.symlink(os.path.join('..', 'keep'), os.path.join(path, 'link'))
+        keep = os.path.join(self.basedir, 'keep')
+        with open(keep, 'w') as f:
+            f.write('data')
+        yield self.run_command()
+
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(keep))
+        self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+        self.assertEqual(self.cmd.remover.files, 3 * 40 + 1)
+        self.assertEqual(self.cmd.remover.dirs, 40)
+
+    if runtime.platformType != 'posix':
+        test_threads.skip = "symlinks are not supported"
+
+    @defer.inlineCallbacks
+    def test_threads_unwritable(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='workdir', threads=2,
+        ), True)
+        path = self.makeTree('workdir', depth=1)
+        os.chmod(os.path.join(path, 'dir0'), 0o500)
+        os.chmod(os.path.join(path, 'dir1'), 0)
+        yield self.run_command()
+
+        self.assertFalse(os.path.exists(path))
+        self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+
+    @defer.inlineCallbacks
+    def test_parallel(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir=['workdir', 'sourcedir', 'missing'], parallel=True,
+        ), True)
+        paths = [self.makeTree('workdir'), self.makeTree('sourcedir')]
+        yield self.run_command()
+
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+        self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+
+    @defer.inlineCallbacks
+    def test_threads_interrupted(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='workdir', threads=2,
+        ), True)
+        path = self.makeTree('workdir')
+        d = self.run_command()
+        self.cmd.interrupt()
+        yield d
+
+        self.assertTrue(os.path.exists(path))
+        self.assertIn({'rc': -1}, self.get_updates(), self.builder.show())
+
+    @defer.inlineCallbacks
+    def test_background(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='workdir', background=True,
+        ), True)
+        path = self.makeTree('workdir')
+        stale = self.makeTree(utils.TRASH_PREFIX + 'stale')
+        yield self.run_command()
+
+        # the tree is gone right away
+        self.assertFalse(os.path.exists(path))
+        self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+
+        # and the trash, including what an earlier worker left, goes later
+        yield self.cmd.backgroundRemoval
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(
+            glob.glob(os.path.join(self.basedir, utils.TRASH_PREFIX + '*')),
+            [])
+
+    @defer.inlineCallbacks
+    def test_background_missing(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='missing', background=True,
+        ), True)
+        yield self.run_command()
+
+        self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+        self.assertEqual(
+            glob.glob(os.path.join(self.basedir, utils.TRASH_PREFIX + '*')),
+            [])
+
 
 class TestCopyDirectory(CommandTestMixin, unittest.TestCase):
 
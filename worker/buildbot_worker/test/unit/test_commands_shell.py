@@ -50,4 +50,26 @@ class TestWorkerShellCommand(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_segments(self):
+        self.make_command(shell.WorkerShellCommand, dict(
+            command=['echo', 'hello'],
+            workdir='workdir',
+            segments=True,
+        ))
+
+        self.patch_runprocess(
+            Expect(['echo', 'hello'], self.basedir_workdir, sendSegments=True)
+            + {'stdout': 'hello\n'} + {'rc': 0}
+            + 0,
+        )
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates(
+                [{'stdout': 'hello\n'}, {'rc': 0}],
+                self.builder.show())
+        d.addCallback(check)
+        return d
+
     # TODO: test all functionality that WorkerShellCommand adds atop RunProcess
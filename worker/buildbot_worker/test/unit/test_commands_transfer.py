@@ -18,6 +18,7 @@ import os
 import shutil
 import sys
 import tarfile
+import zlib
 
 from twisted.internet import defer
 from twisted.internet import reactor
@@ -28,6 +29,7 @@ from twisted.trial import unittest
 from buildbot_worker.commands import transfer
 from buildbot_worker.test.fake.remote import FakeRemote
 from buildbot_worker.test.util.command import CommandTestMixin
+from buildbot_worker.util import BlockHasher
 
 
 class FakeMasterMethods(object):
@@ -53,7 +55,21 @@ class FakeMasterMethods(object):
         self.read = False
         self.data = b''
 
-    def remote_write(self, data):
+        self.pending_writes = 0
+        self.max_pending_writes = 0
+
+        # block checksums of an earlier upload, or of what has been read
+        self.checksums = []
+        self.corrupt_reads = False
+        self.digest = None
+
+        # contents a ContentStoreWriter already has
+        self.stored = set()
+        self.manifest = None
+
+    def remote_write(self, data, checksum=None):
+        if checksum is not None and checksum != BlockHasher.checksum(data):
+            self.add_update('bad checksum')
         if self.write_out_of_space_at is not None:
             self.write_out_of_space_at -= len(data)
             if self.write_out_of_space_at <= 0:
@@ -69,8 +85,15 @@ class FakeMasterMethods(object):
             self.data += data
 
         if self.delay_write:
+            self.pending_writes += 1
+            self.max_pending_writes = max(self.max_pending_writes,
+                                          self.pending_writes)
+
+            def written():
+                self.pending_writes -= 1
+                d.callback(None)
             d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, None)
+            reactor.callLater(0.01, written)
             return d
 
     def remote_read(self, length):
@@ -91,6 +114,57 @@ class FakeMasterMethods(object):
         else:
             return slice
 
+    def remote_getBlockChecksums(self, blocksize):
+        return self.checksums
+
+    def remote_resumeAt(self, *args):
+        # a writer is told how many blocks to keep; a reader is given a
+        # block size and the checksums of the blocks the worker has
+        if len(args) == 1:
+            self.add_update('resumeAt %d' % args[0])
+            return
+        blocksize, checksums = args
+        kept = 0
+        for checksum in checksums:
+            block = self.data[kept * blocksize:(kept + 1) * blocksize]
+            if len(block) < blocksize or \
+                    BlockHasher.checksum(block) != checksum:
+                break
+            self.checksums.append(checksum)
+            kept += 1
+        self.data = self.data[kept * blocksize:]
+        self.add_update('resumeAt %d' % kept)
+        return kept
+
+    def remote_readBlock(self, length):
+        data = self.remote_read(length)
+        if not data:
+            return (data, None)
+        checksum = BlockHasher.checksum(data)
+        self.checksums.append(checksum)
+        if self.corrupt_reads:
+            data = data[:-1] + b'!'
+        return (data, checksum)
+
+    def remote_digest(self):
+        return BlockHasher(self.checksums).hexdigest()
+
+    def remote_manifest(self, manifest):
+        self.add_update('manifest')
+        self.manifest = manifest
+        missing = []
+        for relpath, digest, size, mode in manifest:
+            if digest is not None and digest not in self.stored:
+                self.stored.add(digest)
+                missing.append(digest)
+        return missing
+
+    def remote_beginFile(self, digest):
+        self.add_update('beginFile')
+
+    def remote_endFile(self):
+        self.add_update('endFile')
+
     def remote_unpack(self):
         self.add_update('unpack')
         if self.unpack_fail:
@@ -99,8 +173,9 @@ class FakeMasterMethods(object):
     def remote_utime(self, accessed_modified):
         self.add_update('utime - %s' % accessed_modified[0])
 
-    def remote_close(self):
+    def remote_close(self, digest=None):
         self.add_update('close')
+        self.digest = digest
 
 
 class TestUploadFile(CommandTestMixin, unittest.TestCase):
@@ -281,6 +356,204 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_window(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.keep_data = True
+        self.fakemaster.delay_write = True
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            window=3,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'write 64', 'write 52', 'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(self.fakemaster.data,
+                             b"this is some data\n" * 10)
+            self.assertEqual(self.fakemaster.max_pending_writes, 3)
+        d.addCallback(check)
+        return d
+
+    def test_window_out_of_space(self):
+        self.fakemaster.write_out_of_space_at = 70
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, RuntimeError)
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'close',
+                {'rc': 1}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_checksums(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            checksums=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'resumeAt 0', 'write 64', 'write 64', 'write 52', 'close',
+                {'rc': 0}
+            ])
+            data = self.fakemaster.data
+            hasher = BlockHasher([BlockHasher.checksum(data[i:i + 64])
+                                  for i in range(0, len(data), 64)])
+            self.assertEqual(self.fakemaster.digest, hasher.hexdigest())
+        d.addCallback(check)
+        return d
+
+    def test_checksums_resume(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        data = open(self.datafile, mode="rb").read()
+        self.fakemaster.checksums = [BlockHasher.checksum(data[:64]),
+                                     BlockHasher.checksum(data[64:128]),
+                                     BlockHasher.checksum(b'not this')]
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            checksums=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'resumeAt 2', {'header': 'resuming after 128 bytes'},
+                'write 52', 'close',
+                {'rc': 0}
+            ])
+            hasher = BlockHasher(self.fakemaster.checksums[:2] +
+                                 [BlockHasher.checksum(data[128:])])
+            self.assertEqual(self.fakemaster.digest, hasher.hexdigest())
+        d.addCallback(check)
+        return d
+
+    def test_dedup(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        data = open(self.datafile, mode="rb").read()
+        digest = BlockHasher.checksum(data)
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=64,
+            keepstamp=False,
+            dedup=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'manifest',
+                {'header': '0 of 1 files already on the master'},
+                'beginFile', 'write 64', 'write 64', 'write 52', 'endFile',
+                'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(self.fakemaster.manifest,
+                             [('', digest, 180,
+                               os.stat(self.datafile).st_mode & 0o777)])
+        d.addCallback(check)
+        return d
+
+    def test_dedup_stored(self):
+        data = open(self.datafile, mode="rb").read()
+        self.fakemaster.stored.add(BlockHasher.checksum(data))
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=64,
+            keepstamp=False,
+            dedup=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'manifest',
+                {'header': '1 of 1 files already on the master'},
+                'close',
+                {'rc': 0}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_dedup_missing(self):
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='no-such-file',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=64,
+            keepstamp=False,
+            dedup=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            path = os.path.join(self.basedir, 'workdir', 'no-such-file')
+            self.assertUpdates([
+                {'header': 'sending %s' % path},
+                {'rc': 1,
+                 'stderr': "Cannot read '%s' for upload" % path}
+            ])
+        d.addCallback(check)
+        return d
+
 
 class TestWorkerDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
@@ -327,7 +600,10 @@ class TestWorkerDirectoryUpload(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
 
         def check_tarfile(_):
-            f = io.BytesIO(self.fakemaster.data)
+            data = self.fakemaster.data
+            if compress == 'zlib':
+                data = zlib.decompress(data)
+            f = io.BytesIO(data)
             a = tarfile.open(fileobj=f, name='check.tar', mode="r")
             exp_names = ['.', 'aa', 'bb']
             got_names = [n.rstrip('/') for n in a.getnames()]
@@ -340,6 +616,42 @@ class TestWorkerDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
         return d
 
+    def test_dedup(self):
+        os.makedirs(os.path.join(self.datadir, 'sub'))
+        open(os.path.join(self.datadir, 'sub', 'aa'), mode="wb").write(
+            b"lots of a" * 100)
+
+        self.make_command(transfer.WorkerDirectoryUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None,
+            dedup=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'manifest',
+                {'header': '1 of 3 files already on the master'},
+                'beginFile', 'write(s)', 'endFile', 'beginFile', 'endFile',
+                'close',
+                {'rc': 0}
+            ])
+            manifest = self.fakemaster.manifest
+            self.assertEqual([e[0] for e in manifest],
+                             ['', 'sub', 'aa', 'bb', 'sub/aa'])
+            self.assertEqual([e[1] is None for e in manifest],
+                             [True, True, False, False, False])
+            # the same content is only sent once
+            self.assertEqual(manifest[2][1], manifest[4][1])
+        d.addCallback(check)
+        return d
+
     # try it again with bz2 and gzip
     def test_simple_bz2(self):
         return self.test_simple('bz2')
@@ -347,6 +659,97 @@ class TestWorkerDirectoryUpload(CommandTestMixin, unittest.TestCase):
     def test_simple_gz(self):
         return self.test_simple('gz')
 
+    def test_simple_zlib(self):
+        return self.test_simple('zlib')
+
+    def test_window(self):
+        self.fakemaster.keep_data = True
+        self.fakemaster.delay_write = True
+
+        self.make_command(transfer.WorkerDirectoryUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'write(s)', 'unpack',
+                {'rc': 0}
+            ])
+            f = io.BytesIO(self.fakemaster.data)
+            a = tarfile.open(fileobj=f, name='check.tar', mode="r")
+            self.assertEqual(a.extractfile('aa').read(), b"lots of a" * 100)
+            a.close()
+            self.assertTrue(self.fakemaster.max_pending_writes > 1)
+        d.addCallback(check)
+        return d
+
+    def test_truncated(self):
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.WorkerDirectoryUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=512,
+            compress=None,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'write(s)', 'unpack',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'"
+                 % self.datadir}
+            ])
+            self.assertEqual(len(self.fakemaster.data), 1000)
+        d.addCallback(check)
+        return d
+
+    def test_window_truncated(self):
+        self.fakemaster.keep_data = True
+        self.fakemaster.delay_write = True
+        # enough data that the archive is still being built when the limit
+        # is reached, with more blocks being read
+        open(os.path.join(self.datadir, "cc"), mode="wb").write(
+            os.urandom(80000))
+
+        self.make_command(transfer.WorkerDirectoryUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=512,
+            compress=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'write(s)', 'unpack',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'"
+                 % self.datadir}
+            ])
+            self.assertEqual(len(self.fakemaster.data), 1000)
+        d.addCallback(check)
+        return d
+
     # except bz2 can't operate in stream mode on py24
     if sys.version_info[:2] <= (2, 4):
         test_simple_bz2.skip = "bz2 stream decompression not supported on Python-2.4"
@@ -505,6 +908,62 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_window(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.delay_read = True
+        self.fakemaster.data = test_data = b'1234' * 13
+
+        self.make_command(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.',
+            workerdest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=60,
+            blocksize=32,
+            mode=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # the reads in flight never ask for more than maxsize, and the
+            # file is not reported as truncated while they are pending
+            self.assertUpdates([
+                'read 32', 'read 28', 'read 8', 'close',
+                {'rc': 0}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile, mode="rb").read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_window_truncated(self):
+        self.fakemaster.data = test_data = b'tenchars--' * 10
+
+        self.make_command(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.',
+            workerdest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=50,
+            blocksize=16,
+            mode=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'read(s)', 'close',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'"
+                 % os.path.join(self.basedir, '.', 'data')}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile, mode="rb").read(), test_data[:50])
+        d.addCallback(check)
+        return d
+
     def test_interrupted(self):
         self.fakemaster.data = b'tenchars--' * 100  # 1k
         self.fakemaster.delay_read = True  # read veery slowly
@@ -537,3 +996,95 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
             ])
         dl.addCallback(check)
         return dl
+
+    def test_checksums(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data = b'1234' * 13
+
+        self.make_command(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.',
+            workerdest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=0o777,
+            checksums=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'resumeAt 0', 'read 32', 'read 32', 'read 32', 'close',
+                {'rc': 0}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile, mode="rb").read(), test_data)
+            self.assertEqual(os.listdir(self.basedir), ['data'])
+            if runtime.platformType != 'win32':
+                self.assertEqual(os.stat(datafile).st_mode & 0o777, 0o777)
+        d.addCallback(check)
+        return d
+
+    def test_checksums_resume(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data = b'1234' * 13
+        partial = os.path.join(self.basedir, 'data.partial')
+        with open(partial, 'wb') as f:
+            f.write(test_data[:40])
+        with open(partial + '.sums', 'w') as f:
+            f.write('32\n%s\n' % BlockHasher.checksum(test_data[:32]))
+
+        self.make_command(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.',
+            workerdest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            checksums=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'resumeAt 1', {'header': 'resuming after 32 bytes'},
+                'read 32', 'read 32', 'close',
+                {'rc': 0}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile, mode="rb").read(), test_data)
+            self.assertEqual(os.listdir(self.basedir), ['data'])
+        d.addCallback(check)
+        return d
+
+    def test_checksums_corrupted(self):
+        self.fakemaster.data = b'1234' * 13
+        self.fakemaster.corrupt_reads = True
+
+        self.make_command(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.',
+            workerdest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            checksums=True,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, transfer.TransferChecksumError)
+
+        def check(_):
+            self.assertUpdates([
+                'resumeAt 0', 'read(s)', 'close',
+                {'rc': 1,
+                 'stderr': "block 0 of '%s' is corrupted"
+                 % os.path.join(self.basedir, '.', 'data')}
+            ])
+            # what was checked so far is kept, for the next attempt
+            self.assertFalse(os.path.exists(
+                os.path.join(self.basedir, 'data')))
+        d.addCallback(check)
+        return d
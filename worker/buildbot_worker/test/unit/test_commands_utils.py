@@ -20,6 +20,7 @@ import shutil
 import sys
 
 import twisted.python.procutils
+from twisted.internet import defer
 from twisted.python import runtime
 from twisted.trial import unittest
 
@@ -140,3 +141,72 @@ class RmdirRecursive(unittest.TestCase):
             os.rmdir("noperms")
 
         self.assertFalse(os.path.exists(self.target))
+
+
+class TreeRemover(unittest.TestCase):
+
+    def setUp(self):
+        self.target = 'testdir'
+        if os.path.exists(self.target):
+            shutil.rmtree(self.target)
+        os.mkdir(self.target)
+        open(os.path.join(self.target, "a"), "w")
+        os.mkdir(os.path.join(self.target, "d"))
+        open(os.path.join(self.target, "d", "a"), "w")
+        os.mkdir(os.path.join(self.target, "d", "d"))
+        open(os.path.join(self.target, "d", "d", "a"), "w")
+
+    def tearDown(self):
+        if os.path.exists(self.target):
+            shutil.rmtree(self.target)
+
+    @defer.inlineCallbacks
+    def test_remove(self):
+        remover = utils.TreeRemover(threads=2)
+        yield remover.remove(self.target)
+        remover.stop()
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual((remover.files, remover.dirs), (3, 3))
+        self.assertEqual(remover.pool, None)
+
+    @defer.inlineCallbacks
+    def test_remove_file(self):
+        remover = utils.TreeRemover()
+        yield remover.remove(os.path.join(self.target, "a"))
+        yield remover.remove(os.path.join(self.target, "missing"))
+        remover.stop()
+        self.assertEqual(sorted(os.listdir(self.target)), ["d"])
+
+    @defer.inlineCallbacks
+    def test_stop(self):
+        remover = utils.TreeRemover()
+        remover.stop()
+        yield remover.remove(self.target)
+        self.assertTrue(os.path.exists(os.path.join(self.target, "d", "a")))
+        self.assertEqual(remover.pool, None)
+
+    @defer.inlineCallbacks
+    def test_stop_while_removing(self):
+        remover = utils.TreeRemover()
+        d = remover.remove(self.target)
+        stopped = remover.stop()
+        # the threads are only shut down once the calls in flight are done
+        self.assertNotEqual(remover.pool, None)
+        self.assertNoResult(stopped)
+        yield stopped
+        self.assertEqual(remover.pool, None)
+        yield d
+        self.assertTrue(os.path.exists(self.target))
+
+    def test_moveAside(self):
+        trash = utils.moveAside(self.target)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertTrue(os.path.basename(trash).startswith(utils.TRASH_PREFIX))
+        self.assertTrue(os.path.exists(os.path.join(trash, self.target, "a")))
+        shutil.rmtree(trash)
+
+    def test_moveAside_missing(self):
+        self.assertEqual(utils.moveAside("missing"), None)
+        self.assertEqual(
+            [n for n in os.listdir('.') if n.startswith(utils.TRASH_PREFIX)],
+            [])
@@ -17,6 +17,7 @@ from __future__ import print_function
 
 import os
 import re
+import shutil
 import signal
 import sys
 import time
@@ -142,6 +143,33 @@ class TestRunProcess(BasedirMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def testKeepStdoutMaxSize(self):
+        b = FakeWorkerForBuilder(self.basedir)
+        s = runprocess.RunProcess(
+            b, stdoutCommand('hello'), self.basedir, keepStdout=True)
+        s.KEEP_MAX_SIZE = 3
+
+        d = s.start()
+
+        def check(ign):
+            self.failUnless({'stdout': nl('hello\n')} in b.updates, b.show())
+            self.failUnlessEquals(s.stdout, 'hel')
+        d.addCallback(check)
+        return d
+
+    def testKeepStdoutSpill(self):
+        b = FakeWorkerForBuilder(self.basedir)
+        s = runprocess.RunProcess(
+            b, stdoutCommand('hello'), self.basedir, keepStdout=True)
+        s.KEEP_SPILL_SIZE = 1
+
+        d = s.start()
+
+        def check(ign):
+            self.failUnlessEquals(s.stdout, nl('hello\n'))
+        d.addCallback(check)
+        return d
+
     def testStderr(self):
         b = FakeWorkerForBuilder(self.basedir)
         s = runprocess.RunProcess(b, stderrCommand("hello"), self.basedir)
@@ -773,6 +801,63 @@ class TestLogging(BasedirMixin, unittest.TestCase):
             {'stdout': 'world'},
         ])
 
+    def testSendBufferedInterleavedSegments(self):
+        b = FakeWorkerForBuilder(self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  sendSegments=True)
+        s._addToBuffers('stdout', 'hello ')
+        s._addToBuffers('stderr', 'DIEEEEEEE')
+        s._addToBuffers('stdout', 'wor')
+        s._addToBuffers('stdout', 'ld')
+        s._addToBuffers(('log', 'other'), 'log data')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [
+            {'segments': [('stdout', 'hello '), ('stderr', 'DIEEEEEEE'),
+                          ('stdout', 'world'), (('log', 'other'), 'log data')]},
+        ])
+
+    def testSendBufferedSegmentsOneLog(self):
+        b = FakeWorkerForBuilder(self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  sendSegments=True)
+        s._addToBuffers('stdout', 'hello ')
+        s._addToBuffers('stdout', 'world')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [{'stdout': 'hello world'}])
+
+    def testBufferTimeoutAdapts(self):
+        clock = task.Clock()
+        b = FakeWorkerForBuilder(self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._reactor = clock
+        MIN = s.MIN_BUFFER_TIMEOUT
+
+        # sporadic output goes out after the shortest delay
+        s._addToBuffers('stdout', 'a')
+        clock.advance(MIN)
+        self.failUnlessEqual(b.updates, [{'stdout': 'a'}])
+        self.failUnlessEqual(s.bufferTimeout, MIN)
+
+        # steady output is batched for longer and longer
+        for expected in [MIN * 2, MIN * 4, MIN * 8]:
+            s._addToBuffers('stdout', 'b')
+            s._addToBuffers('stdout', 'c')
+            clock.advance(s.bufferTimeout)
+            self.failUnlessEqual(s.bufferTimeout, expected)
+        self.failUnlessEqual(b.updates[1:], [{'stdout': 'bc'}] * 3)
+
+        # a full buffer is sent right away
+        s._addToBuffers('stdout', 'x' * (s.BUFFER_SIZE + 1))
+        self.failUnlessEqual(len(b.updates), 5)
+        self.failUnlessEqual(s.bufferTimeout, MIN * 16)
+        self.failUnlessEqual(clock.getDelayedCalls(), [])
+
+        # and once the output quiets down again, the delay gets shorter
+        s._addToBuffers('stdout', 'd')
+        clock.advance(s.bufferTimeout)
+        self.failUnlessEqual(s.bufferTimeout, MIN * 8)
+        self.failUnlessEqual(b.updates[-1], {'stdout': 'd'})
+
     def testSendChunked(self):
         b = FakeWorkerForBuilder(self.basedir)
         s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
@@ -793,6 +878,9 @@ class TestLogFileWatcher(BasedirMixin, unittest.TestCase):
 
     def setUp(self):
         self.setUpBasedir()
+        # don't share the inotify instance with other tests
+        self.watches = runprocess._InotifyWatches()
+        self.patch(runprocess.LogFileWatcher, '_inotifyWatches', self.watches)
 
     def tearDown(self):
         self.tearDownBasedir()
@@ -817,3 +905,119 @@ class TestLogFileWatcher(BasedirMixin, unittest.TestCase):
         self.assertEqual(
             st and st[2], 2, "statfile.log exists and size is correct")
         os.remove('statfile.log')
+
+    def makeWatcher(self, follow=False, name='watched.log'):
+        if not os.path.isdir(self.basedir):
+            os.makedirs(self.basedir)
+        self.logfile = os.path.join(self.basedir, name)
+        self.data = []
+        command = Mock()
+        command.addLogfile = lambda name, data: self.data.append(data)
+        return runprocess.LogFileWatcher(command, 'test', self.logfile,
+                                         follow)
+
+    def startInotify(self, lf):
+        if runprocess.inotify is None:
+            raise unittest.SkipTest("inotify is not available")
+        lf.start()
+        self.addCleanup(lf.stop)
+        if not lf.inotifying:
+            raise unittest.SkipTest("inotify could not be set up")
+
+    def test_poll_backoff(self):
+        clock = task.Clock()
+        lf = self.makeWatcher()
+        lf._reactor = clock
+        lf.useInotify = False
+        lf.start()
+        self.assertEqual((lf.wakeups, lf.idleWakeups), (1, 1))
+
+        # an idle file is checked less and less often
+        intervals = []
+        for _ in range(10):
+            intervals.append(lf.pollInterval)
+            clock.advance(lf.pollInterval)
+        self.assertEqual(intervals[:3], [0.2, 0.4, 0.8])
+        self.assertEqual(intervals[-1], lf.MAX_POLL_INTERVAL)
+        self.assertEqual((lf.wakeups, lf.idleWakeups), (11, 11))
+
+        with open(self.logfile, 'wb') as f:
+            f.write(b'hello')
+        clock.advance(lf.pollInterval)
+        self.assertEqual(self.data, [b'hello'])
+        self.assertEqual(lf.pollInterval, lf.MIN_POLL_INTERVAL)
+        self.assertEqual((lf.wakeups, lf.idleWakeups), (12, 11))
+
+        lf.stop()
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    def test_stop_reads_remaining_data(self):
+        clock = task.Clock()
+        lf = self.makeWatcher()
+        lf._reactor = clock
+        lf.useInotify = False
+        lf.start()
+        with open(self.logfile, 'wb') as f:
+            f.write(b'x' * (lf.READ_SIZE + 10))
+        lf.stop()
+        self.assertEqual(b''.join(self.data), b'x' * (lf.READ_SIZE + 10))
+        self.assertEqual(len(self.data), 2)
+
+    @defer.inlineCallbacks
+    def test_inotify(self):
+        lf = self.makeWatcher()
+        self.startInotify(lf)
+        with open(self.logfile, 'wb') as f:
+            f.write(b'hello')
+        for _ in range(100):
+            if self.data:
+                break
+            yield task.deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(self.data, [b'hello'])
+        # nothing wakes the watcher up while the file does not change
+        wakeups = lf.wakeups
+        yield task.deferLater(reactor, 0.3, lambda: None)
+        self.assertEqual(lf.wakeups, wakeups)
+
+    def test_inotify_shared(self):
+        watches = self.watches
+        lf1 = self.makeWatcher(name='one.log')
+        lf2 = self.makeWatcher(name='two.log')
+        self.startInotify(lf1)
+        self.startInotify(lf2)
+        notifier = watches.notifier
+        self.assertEqual(list(watches.watchers),
+                         [os.path.abspath(self.basedir)])
+        lf1.stop()
+        self.assertIdentical(watches.notifier, notifier)
+        lf2.stop()
+        self.assertEqual((watches.notifier, watches.watchers), (None, {}))
+
+    def test_inotify_safety_poll(self):
+        clock = task.Clock()
+        lf = self.makeWatcher()
+        lf._reactor = clock
+        self.startInotify(lf)
+        # data is found even if inotify does not report it, as on NFS
+        with open(self.logfile, 'wb') as f:
+            f.write(b'hello')
+        clock.advance(lf.MAX_POLL_INTERVAL)
+        self.assertEqual(self.data, [b'hello'])
+        self.assertEqual(lf.pollInterval, lf.MAX_POLL_INTERVAL)
+
+    @defer.inlineCallbacks
+    def test_inotify_directory_removed(self):
+        clock = task.Clock()
+        os.makedirs(os.path.join(self.basedir, 'sub'))
+        lf = self.makeWatcher(name=os.path.join('sub', 'watched.log'))
+        lf._reactor = clock
+        self.startInotify(lf)
+        shutil.rmtree(os.path.join(self.basedir, 'sub'))
+        for _ in range(100):
+            if not lf.inotifying:
+                break
+            yield task.deferLater(reactor, 0.05, lambda: None)
+        # the watcher goes back to polling
+        self.assertFalse(lf.inotifying)
+        self.assertEqual(self.watches.notifier, None)
+        self.assertEqual(lf.pollInterval, lf.MIN_POLL_INTERVAL * 2)
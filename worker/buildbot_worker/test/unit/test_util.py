@@ -139,3 +139,27 @@ class TestRewrap(unittest.TestCase):
 
         for text, expected, width in tests:
             self.assertEqual(util.rewrap(text, width=width), expected)
+
+
+class TestAccumulator(unittest.TestCase):
+
+    def test_append(self):
+        acc = util.Accumulator()
+        for chunk in ['abc', '', 'def']:
+            acc.append(chunk)
+        self.assertEqual(acc.getvalue(), 'abcdef')
+        self.assertEqual(len(acc), 6)
+
+    def test_maxSize(self):
+        acc = util.Accumulator(maxSize=4)
+        acc.append('abc')
+        acc.append('def')
+        self.assertEqual(acc.getvalue(), 'abcd')
+        self.assertTrue(acc.truncated)
+
+    def test_spill(self):
+        acc = util.Accumulator(spillSize=2)
+        acc.append('abc')
+        acc.append('def')
+        self.assertEqual(acc.getvalue(), 'abcdef')
+        acc.close()